@@ -0,0 +1,82 @@
+import re
+import struct
+from typing import Callable, Optional
+import numpy as np
+from app.hash_functions import GOLDEN_64, division, mixing, multiplicative
+from app.record import Record
+
+# NumPy is optional: this module is only imported by the methods that need it
+
+BYTE_ORDERS = {'@': '=', '=': '=', '<': '<', '>': '>', '!': '>'}
+
+
+def record_dtype(record: Record) -> np.dtype:
+    # structured dtype with the same layout as the struct format of a record, padding included
+    fmt = record.format.replace(' ', '')
+    order = fmt[0] if fmt and fmt[0] in BYTE_ORDERS else '@'
+    body = fmt[1:] if fmt and fmt[0] in BYTE_ORDERS else fmt
+    formats, offsets = [], []
+    done = order
+    for count, code in re.findall(r'(\d*)(\D)', body):
+        for token in [count + code] if code in 'sp' else int(count or 1) * [code]:
+            size = struct.calcsize(order + token)
+            if code != 'x':
+                offsets.append(struct.calcsize(done + token) - size)
+                if code in 'spc':
+                    formats.append(f'S{size}')
+                elif code == '?':
+                    formats.append('?')
+                else:
+                    kind = 'f' if code in 'efd' else 'u' if code.isupper() else 'i'
+                    formats.append(f'{BYTE_ORDERS[order]}{kind}{size}')
+            done += token
+    return np.dtype({'names': record.attributes, 'formats': formats, 'offsets': offsets, 'itemsize': record.struct.size})
+
+
+def block_array(filename: str, dtype: np.dtype, start: int, end: int, unit: int, header_size: int = 0, header_dtype: Optional[np.dtype] = None) -> np.ndarray:
+    # read-only memory map of the consecutive blocks of unit bytes between start and end, with
+    # a 'records' field holding the records of each block and a 'header' field if header_dtype is given
+    count = (unit - header_size) // dtype.itemsize
+    fields = {'names': ['records'], 'formats': [(dtype, (count,))], 'offsets': [header_size], 'itemsize': unit}
+    if header_dtype is not None:
+        fields = {'names': ['header', 'records'], 'formats': [header_dtype, (dtype, (count,))], 'offsets': [0, header_size], 'itemsize': unit}
+    blocks = max(0, (end - start) // unit)
+    if blocks == 0:
+        return np.zeros(0, dtype=np.dtype(fields))
+    return np.memmap(filename, dtype=np.dtype(fields), mode='r', offset=start, shape=(blocks,))
+
+
+def mix64_array(x: np.ndarray) -> np.ndarray:
+    # app.hash_functions.mix64 on uint64 arrays, whose arithmetic wraps around like the masked one
+    x = x ^ (x >> np.uint64(30))
+    x = x * np.uint64(0xBF58476D1CE4E5B9)
+    x = x ^ (x >> np.uint64(27))
+    x = x * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+
+def hash_array(hash_function: Callable, keys: np.ndarray, num_buckets: int) -> np.ndarray:
+    # bucket indexes (uint64) of many keys; integer keys with the functions of app.hash_functions
+    # are hashed with array operations, anything else one key at a time
+    if keys.dtype.kind in 'iu' and hash_function in (division, multiplicative, mixing):
+        x = keys.astype(np.uint64) # the key modulo 2**64
+        if hash_function is division:
+            if num_buckets == 1 << 64:
+                return x
+            if keys.dtype.kind == 'i' and num_buckets < 1 << 63:
+                return (keys.astype(np.int64) % np.int64(num_buckets)).astype(np.uint64)
+            if keys.dtype.kind == 'u':
+                return x % np.uint64(num_buckets)
+        elif hash_function is multiplicative:
+            x = x * np.uint64(GOLDEN_64)
+            if num_buckets == 1 << 64:
+                return x
+            if num_buckets < 1 << 32:
+                # the high 64 bits of x * num_buckets, in two halves that do not overflow
+                n = np.uint64(num_buckets)
+                low = (x & np.uint64(0xFFFFFFFF)) * n
+                return ((x >> np.uint64(32)) * n + (low >> np.uint64(32))) >> np.uint64(32)
+        else:
+            x = mix64_array(x)
+            return x if num_buckets == 1 << 64 else x % np.uint64(num_buckets)
+    return np.fromiter((hash_function(key, num_buckets) for key in keys.tolist()), dtype=np.uint64, count=len(keys))
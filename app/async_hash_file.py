@@ -0,0 +1,102 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Union
+from app.concurrency import ConcurrentHashFile
+from app.hash_file import HashFile
+
+
+def _resolve(future: asyncio.Future, result, exception):
+    if future.cancelled():
+        return
+    if exception is not None:
+        future.set_exception(exception)
+    else:
+        future.set_result(result)
+
+
+class AsyncHashFile:
+    # Runs the operations of a hash file on a bounded pool of threads, so they do not block the event loop.
+    #
+    # Requests are queued per bucket (per group of buckets split from the same initial bucket for
+    # HashFileDynamic) and every queue is served by at most one thread at a time, in request order.
+    # A thread takes all requests queued at once and runs them back to back, each as its own
+    # operation, so the blocks of a bucket are still in the buffer pool for every request after the
+    # first. Nothing is pinned: pinning is counted for the whole file, so the batches of overlapping
+    # threads would keep the pool from ever being trimmed or written back.
+    def __init__(self, file: Union[HashFile, ConcurrentHashFile], max_workers: int = 4, stripes: int = 64, processes: bool = False):
+        self.file = file if isinstance(file, ConcurrentHashFile) else ConcurrentHashFile(file, stripes, processes)
+        self._executor = ThreadPoolExecutor(max_workers, thread_name_prefix='hashfile')
+        self._queued: Dict[int, List] = {} # bucket group -> requests not yet taken by its thread
+        self._mutex = threading.Lock()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def close(self):
+        await asyncio.get_running_loop().run_in_executor(None, self.__shutdown)
+
+    def __shutdown(self):
+        self._executor.shutdown(wait=True)
+        self.file.close()
+
+    def __serve(self, group: int):
+        while True:
+            with self._mutex:
+                requests = self._queued[group]
+                if not requests:
+                    del self._queued[group]
+                    return
+                self._queued[group] = []
+            for loop, future, operation, argument in requests:
+                result = exception = None
+                try:
+                    result = getattr(self.file, operation)(argument)
+                except Exception as e:
+                    exception = e
+                loop.call_soon_threadsafe(_resolve, future, result, exception)
+
+    def _submit(self, operation: str, id, argument) -> asyncio.Future:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        # only groups the requests, without I/O on the event loop; every operation hashes the key
+        # again under its locks
+        group = self.file.file._bucket_group(id)
+        with self._mutex:
+            queued = self._queued.get(group)
+            if queued is None:
+                self._queued[group] = [(loop, future, operation, argument)]
+                self._executor.submit(self.__serve, group)
+            else:
+                queued.append((loop, future, operation, argument))
+        return future
+
+    async def find(self, id):
+        return await self._submit('find_by_id', id, id)
+
+    async def insert(self, record: Dict) -> bool:
+        return await self._submit('insert_record', record.get('id'), record)
+
+    async def update(self, record: Dict) -> bool:
+        return await self._submit('update_record', record.get('id'), record)
+
+    async def delete(self, id) -> bool:
+        return await self._submit('delete_by_id', id, id)
+
+    async def run(self, method: str, *args, **kwargs):
+        # any other method of the file, e.g. insert_many or vacuum; runs alone, in no particular
+        # order relative to queued single key requests
+        call = getattr(self.file, method)
+        return await asyncio.get_running_loop().run_in_executor(self._executor, lambda: call(*args, **kwargs))
+
+    async def insert_many(self, records: List[Dict]) -> List[bool]:
+        return await self.run('insert_many', records)
+
+    async def update_many(self, records: List[Dict]) -> List[bool]:
+        return await self.run('update_many', records)
+
+    async def delete_many(self, ids: List) -> List[bool]:
+        return await self.run('delete_many', ids)
@@ -1,8 +1,21 @@
 #!/usr/bin/python
 
-import struct
+import mmap
+import os
+import time
+from collections import OrderedDict
+from contextlib import contextmanager, nullcontext
+from app.block_codec import BlockCodec
 from app.record import Record
-from typing import BinaryIO, List, Dict
+from app.stats import IOStats
+from app.wal import PAGE, TRUNCATE, WriteAheadLog, replay
+from typing import BinaryIO, Iterable, Iterator, List, Dict, Optional
+
+
+class Page:
+    def __init__(self, data: bytearray, dirty: bool = False):
+        self.data = data
+        self.dirty = dirty
 
 
 class BinaryFile:
@@ -13,34 +26,418 @@ class BinaryFile:
         blocking_factor: int,
         empty_record: Dict,
         empty_key: int = -1,
+        buffer_size: int = 64,
+        use_mmap: bool = False,
     ):
         self.filename = filename
         self.record = record
-        self.record_size = struct.calcsize(self.record.format)
+        self.codec = BlockCodec(record)
+        self.record_size = self.codec.record_size
         self.blocking_factor = blocking_factor
         self.block_size = self.blocking_factor * self.record_size
         self.empty_record = empty_record
         self.empty_key = empty_key
+        self.buffer_size = buffer_size # max number of blocks kept in the buffer pool
+        self.use_mmap = use_mmap # map the file into memory instead of buffering blocks
 
-    def write_block(self, file: BinaryIO, block: List[Dict]):
-        binary_data = bytearray()
+        self._file: Optional[BinaryIO] = None
+        self._file_size = 0
+        self._map: Optional[mmap.mmap] = None
+        self._buffer: "OrderedDict[int, Page]" = OrderedDict() # position -> page, least recently used first
+        self._pinned_depth = 0
+        self._file_position = 0 # where the next read or write continues without a seek
+        self.stats: Optional[IOStats] = None
+        self._io_lock = nullcontext() # an RLock once threads share the object, see app.concurrency
+        self._wal: Optional[WriteAheadLog] = None
+        self._modified = False # written since it was opened
+        self._reserved = 0 # bytes at the start of the file below every position read or written, see app.superblock
 
-        for rec in block:
-            rec_binary_data = self.record.dict_to_encoded_values(rec)
-            binary_data.extend(rec_binary_data)
+    def enable_stats(self, hook=None) -> IOStats:
+        # starts counting I/O and timing public operations; hook receives a dict for every operation
+        self.stats = IOStats(hook)
+        return self.stats
 
-        file.write(binary_data)
+    def disable_stats(self):
+        self.stats = None
 
-    def read_block(self, file: BinaryIO) -> List[Dict]:
-        binary_data = file.read(self.block_size)
-        block = []
+    def enable_wal(self, group_size: int = 32, checkpoint_size: int = 16 << 20) -> WriteAheadLog:
+        # logs the pages modified by every group_size operations with a single fsync before they
+        # are written to the file; see the README
+        if self.use_mmap:
+            raise ValueError("the write-ahead log needs the buffer pool and cannot be used with use_mmap")
+        self.flush()
+        self._wal = WriteAheadLog(self.filename + '.wal', group_size, checkpoint_size)
+        return self._wal
 
-        if len(binary_data) == 0:
-            return block
+    def disable_wal(self):
+        if self._wal is None:
+            return
+        self.checkpoint()
+        self._wal.close()
+        self._wal = None
+
+    def checkpoint(self):
+        # commits the open group and syncs the file, after which the log is no longer needed
+        with self._io_lock:
+            if self._wal is None or self._file is None:
+                return
+            self._commit()
+            os.fsync(self._file.fileno())
+            self._wal.reset()
+
+    @contextmanager
+    def _operation(self, name: str):
+        # a public operation: timed when statistics are enabled, and the unit of group commit
+        stats, wal = self.stats, self._wal
+        outermost = stats is not None and not getattr(stats._local, 'depth', 0)
+        if outermost:
+            before = stats.counters()
+            stats._local.depth = 1
+            start = time.perf_counter()
+        if wal is not None:
+            depth = getattr(wal.local, 'depth', 0)
+            wal.local.depth = depth + 1
+            with self._io_lock:
+                wal.active += 1
+        try:
+            yield
+        finally:
+            if wal is not None:
+                wal.local.depth = depth
+                with self._io_lock:
+                    wal.active -= 1
+                    if not depth:
+                        wal.pending += 1
+                    # only commit between operations, so that every group holds whole operations
+                    if wal.active == 0 and wal.pending >= wal.group_size and self._file is not None:
+                        self._commit()
+            if outermost:
+                stats._local.depth = 0
+                stats.record(name, time.perf_counter() - start, before)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def open(self):
+        if self._file is None:
+            self._file = open(self.filename, "r+b")
+            self._modified = False
+            if os.path.exists(self.filename + '.wal'): # left behind by a crash
+                replay(self.filename + '.wal', self._file)
+                self._modified = True
+            self._reserved = self._reserved_size()
+            self._file_size = os.fstat(self._file.fileno()).st_size - self._reserved
+            self._file_position = None
+            if self.stats is not None:
+                self.stats.opens += 1
+            self._remap()
+
+    def _remap(self):
+        # a mapping is replaced rather than resized: blocks handed out as memoryviews
+        # keep the old one alive until they are released
+        self._map = None
+        if self.use_mmap and self._file_size > 0:
+            self._map = mmap.mmap(self._file.fileno(), self._reserved + self._file_size)
+
+    def _reserved_size(self) -> int:
+        # the bytes reserved at the start of the file just opened
+        return 0
+
+    def _touch(self):
+        # called before every change to the file
+        self._modified = True
+
+    def flush(self):
+        with self._io_lock:
+            if self._file is None:
+                return
+            if self._wal is not None:
+                self._commit()
+                return
+            self._write_back()
+
+    def _write_back(self):
+        dirty = sorted(pos for pos, page in self._buffer.items() if page.dirty)
+        # write back dirty pages in file order, coalescing adjacent ones into a single write
+        i = 0
+        while i < len(dirty):
+            begin = dirty[i]
+            data = bytearray(self._buffer[begin].data)
+            self._buffer[begin].dirty = False
+            i += 1
+            blocks = 1
+            while i < len(dirty) and dirty[i] == begin + len(data):
+                data.extend(self._buffer[dirty[i]].data)
+                self._buffer[dirty[i]].dirty = False
+                i += 1
+                blocks += 1
+            self._file_write(begin, data, blocks)
+        self._file.flush()
+
+    def _commit(self):
+        # logs the after-images of all dirty pages as one group with a single fsync, after which
+        # they can be written to the file; until then the file only holds committed groups
+        wal = self._wal
+        wal.pending = 0
+        dirty = sorted(pos for pos, page in self._buffer.items() if page.dirty)
+        if not dirty and wal.truncate is None:
+            return
+        # the log holds positions in the file, which replay writes without knowing what is reserved
+        entries = [] if wal.truncate is None else [(TRUNCATE, self._reserved + wal.truncate, b'')]
+        entries += [(PAGE, self._reserved + pos, self._buffer[pos].data) for pos in dirty]
+        wal.append(entries)
+        if wal.truncate is not None:
+            self._file.truncate(self._reserved + wal.truncate)
+            wal.truncate = None
+        self._write_back()
+        if wal.size >= wal.checkpoint_size:
+            self.checkpoint()
+
+    def close(self):
+        if self._file is None:
+            return
+        self.flush()
+        if self._wal is not None:
+            os.fsync(self._file.fileno())
+            self._wal.close()
+        self._unmap()
+        self._file.close()
+        self._file = None
+        self._buffer.clear()
+
+    def _invalidate(self):
+        # forgets everything cached about a file that another process may have changed;
+        # flushing also drops the read-ahead buffer of the file object
+        with self._io_lock:
+            if self._file is None:
+                return
+            self.flush()
+            self._buffer.clear()
+            self._file_size = os.fstat(self._file.fileno()).st_size - self._reserved
+            self._remap()
+
+    def _unmap(self):
+        if self._map is not None:
+            try:
+                self._map.close()
+            except BufferError: # still referenced by a block, released with it
+                pass
+            self._map = None
+
+    @contextmanager
+    def _pinned(self):
+        # keeps every page touched inside the block in memory and writes the dirty ones back
+        # once at the end, so a batch reads and writes each block at most once
+        with self._io_lock:
+            self._pinned_depth += 1
+        try:
+            yield
+        finally:
+            with self._io_lock:
+                self._pinned_depth -= 1
+                # with a write-ahead log dirty pages wait for the group commit instead
+                if self._pinned_depth == 0 and self._file is not None and self._wal is None:
+                    self.flush()
+                    while len(self._buffer) > max(self.buffer_size, 0):
+                        self._evict(next(iter(self._buffer)))
 
-        for i in range(self.blocking_factor):
-            begin = self.record_size * i
-            end = self.record_size * (i + 1)
-            block.append(self.record.encoded_tuple_to_dict(binary_data[begin:end]))
+    @contextmanager
+    def _held(self):
+        # keeps every page touched inside the block in memory until its end, so an operation that
+        # comes back to a block finds it there; unlike _pinned nothing is written back early
+        with self._io_lock:
+            self._pinned_depth += 1
+        try:
+            yield
+        finally:
+            with self._io_lock:
+                self._pinned_depth -= 1
+                if self._file is not None:
+                    self._trim()
 
-        return block
\ No newline at end of file
+    def _create_file(self):
+        # discards buffered pages and (re)creates an empty file
+        if self._file is not None:
+            self._unmap()
+            self._file.close()
+        self._buffer.clear()
+        self._file = open(self.filename, "w+b")
+        self._modified = True
+        self._file_size = 0
+        self._file_position = None
+        if self.stats is not None:
+            self.stats.opens += 1
+        if self._wal is not None: # logged groups belong to the old contents
+            self._wal.reset()
+            self._wal.truncate = None
+
+    def _write_sequential(self, chunks: Iterable[bytes], unit: Optional[int] = None):
+        # streams data to the end of the file, bypassing the buffer pool; chunks hold one
+        # block each unless the block size is given as unit
+        self.flush()
+        self._touch()
+        for chunk in chunks:
+            self._file_write(self._file_size, chunk, len(chunk) // unit if unit else 1)
+            self._file_size += len(chunk)
+        self._file.flush()
+        if self._wal is not None: # not logged, so it has to be durable before the next group commits
+            os.fsync(self._file.fileno())
+            self._wal.reset()
+        self._remap()
+
+    def _read_sequential(self, position: int, end: int, unit: int, units_per_read: int = 1024) -> Iterator[bytes]:
+        # reads the file from position to end in chunks of whole units, bypassing the buffer pool
+        self.open()
+        self.flush()
+        while position < end:
+            size = min(units_per_read * unit, end - position)
+            chunk = self._file_read(position, size, -(-size // unit))
+            if not chunk:
+                return
+            position += len(chunk)
+            yield chunk
+
+    def _file_read(self, position: int, size: int, blocks: int = 1) -> bytes:
+        if self._file_position != position:
+            self._file.seek(self._reserved + position)
+            if self.stats is not None:
+                self.stats.seeks += 1
+        data = self._file.read(size)
+        self._file_position = position + len(data)
+        if self.stats is not None:
+            self.stats.blocks_read += blocks
+            self.stats.bytes_read += len(data)
+        return data
+
+    def _file_write(self, position: int, data: bytes, blocks: int = 1):
+        if self._file_position != position:
+            self._file.seek(self._reserved + position)
+            if self.stats is not None:
+                self.stats.seeks += 1
+        self._file.write(data)
+        self._file_position = position + len(data)
+        if self.stats is not None:
+            self.stats.blocks_written += blocks
+            self.stats.bytes_written += len(data)
+
+    def _file_end(self) -> int:
+        self.open()
+        return self._file_size
+
+    def _read_raw(self, position: int, size: int) -> Optional[bytearray]:
+        with self._io_lock:
+            if self.use_mmap:
+                if position + size > self._file_end():
+                    return None
+                if self.stats is not None:
+                    self.stats.blocks_read += 1
+                    self.stats.bytes_read += size
+                return memoryview(self._map)[self._reserved + position:self._reserved + position + size]
+            page = self._buffer.get(position)
+            if page is not None and len(page.data) == size:
+                self._buffer.move_to_end(position)
+                if self.stats is not None:
+                    self.stats.cache_hits += 1
+                return page.data
+            if position + size > self._file_end():
+                return None
+            if page is not None:
+                self._evict(position)
+            if self.stats is not None:
+                self.stats.cache_misses += 1
+            data = bytearray(self._file_read(position, size))
+            truncated = self._wal.truncate if self._wal is not None else None
+            if truncated is not None and position + size > truncated: # the file is not truncated until the group commits
+                keep = max(truncated - position, 0)
+                data = data[:keep] + bytearray(size - keep)
+            if len(data) < size:
+                return None
+            self._cache(position, Page(data))
+            return data
+
+    def _write_raw(self, position: int, data: bytes):
+        with self._io_lock:
+            self.open()
+            self._touch()
+            if self.use_mmap:
+                end = position + len(data)
+                if end > self._file_size:
+                    self._file.truncate(self._reserved + end)
+                    self._file_size = end
+                    self._remap()
+                self._map[self._reserved + position:self._reserved + end] = data
+                if self.stats is not None:
+                    self.stats.blocks_written += 1
+                    self.stats.bytes_written += len(data)
+                return
+            if not isinstance(data, bytearray):
+                data = bytearray(data)
+            page = self._buffer.get(position)
+            if page is not None and len(page.data) == len(data):
+                page.data = data
+                page.dirty = True
+                self._buffer.move_to_end(position)
+            else:
+                if page is not None:
+                    self._evict(position)
+                self._cache(position, Page(data, True))
+            self._file_size = max(self._file_size, position + len(data))
+
+    def _truncate(self, size: int):
+        with self._io_lock:
+            self.open()
+            self._touch()
+            for pos in [pos for pos in self._buffer if pos >= size]:
+                del self._buffer[pos]
+            if self._wal is not None: # applied to the file by the group commit
+                self._wal.truncate = size if self._wal.truncate is None else min(self._wal.truncate, size)
+            else:
+                self._file.truncate(self._reserved + size)
+            self._file_size = size
+            self._remap()
+
+    def _cache(self, position: int, page: Page):
+        self._buffer[position] = page
+        self._trim()
+
+    def _trim(self):
+        # evicts the least recently used pages beyond buffer_size, unless pages are pinned
+        while len(self._buffer) > max(self.buffer_size, 0) and self._pinned_depth == 0:
+            victim = next(iter(self._buffer))
+            if self._wal is not None: # uncommitted pages must not reach the file
+                victim = next((pos for pos, page in self._buffer.items() if not page.dirty), None)
+                if victim is None:
+                    break
+            self._evict(victim)
+
+    def _evict(self, position: int):
+        page = self._buffer.pop(position)
+        if page.dirty:
+            self._file_write(position, page.data)
+
+    def encode_block(self, block: List[Dict]) -> bytearray:
+        return self.codec.encode(block)
+
+    def decode_block(self, binary_data: bytes, offset: int = 0) -> List[Dict]:
+        return self.codec.decode(binary_data, offset)
+
+    def read_block_at(self, position: int) -> List[Dict]:
+        binary_data = self._read_raw(position, self.block_size)
+        if binary_data is None:
+            return []
+        return self.decode_block(binary_data)
+
+    def write_block_at(self, position: int, block: List[Dict]):
+        self._write_raw(position, self.encode_block(block))
+
+    def write_block(self, file: BinaryIO, block: List[Dict]):
+        file.write(self.encode_block(block))
+
+    def read_block(self, file: BinaryIO) -> List[Dict]:
+        binary_data = file.read(self.block_size)
+        if len(binary_data) == 0:
+            return []
+        return self.decode_block(binary_data)
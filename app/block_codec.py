@@ -0,0 +1,83 @@
+import operator
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from app.record import Record
+
+OPERATORS = {'==': operator.eq, '!=': operator.ne, '<': operator.lt, '<=': operator.le, '>': operator.gt, '>=': operator.ge}
+
+
+class BlockCodec:
+    def __init__(self, record: Record):
+        self.record = record
+        self.struct = record.struct
+        self.record_size = self.struct.size
+        self.attributes = record.attributes
+        self.coding = record.coding
+        # indexes of string fields, found by unpacking a zeroed record once
+        sample = self.struct.unpack(bytes(self.record_size))
+        self.text_fields = [i for i, value in enumerate(sample) if isinstance(value, bytes)]
+        self.text_sizes = {i: len(sample[i]) for i in self.text_fields}
+
+    def __reduce__(self):
+        return BlockCodec, (self.record,)
+
+    def values_to_dict(self, values: tuple) -> Dict:
+        if self.text_fields:
+            values = list(values)
+            for i in self.text_fields:
+                values[i] = values[i].decode(self.coding).strip('\x00')
+        return dict(zip(self.attributes, values))
+
+    def dict_to_values(self, rec: Dict) -> list:
+        values = [rec[attr] for attr in self.attributes]
+        for i in self.text_fields:
+            if isinstance(values[i], str):
+                values[i] = values[i].encode(self.coding)
+        return values
+
+    def unpack(self, buffer, offset: int = 0, count: Optional[int] = None) -> List[tuple]:
+        with memoryview(buffer) as view:
+            if count is None:
+                count = (len(view) - offset) // self.record_size
+            end = offset + count * self.record_size
+            with view[offset:end] as records:
+                return list(self.struct.iter_unpack(records))
+
+    def decode(self, buffer, offset: int = 0, count: Optional[int] = None) -> List[Dict]:
+        return [self.values_to_dict(values) for values in self.unpack(buffer, offset, count)]
+
+    def predicate(self, where: Iterable[Tuple[str, str, object]]) -> Callable[[tuple], bool]:
+        # (attribute, operator, value) conditions evaluated on unpacked values; strings are compared
+        # with the zero padded bytes stored in the record, which order like the decoded strings
+        conditions = []
+        for attr, op, value in where:
+            if attr not in self.attributes or op not in OPERATORS:
+                raise ValueError(f"unsupported condition: {attr} {op} {value!r}")
+            i = self.attributes.index(attr)
+            if i in self.text_sizes and isinstance(value, str):
+                value = value.encode(self.coding).ljust(self.text_sizes[i], b'\x00')
+            conditions.append((i, OPERATORS[op], value))
+        return lambda values: all(op(values[i], value) for i, op, value in conditions)
+
+    def projection(self, attributes: Optional[Iterable[str]]) -> Callable[[tuple], Dict]:
+        # unpacked values -> dict of the given attributes only
+        if attributes is None:
+            return self.values_to_dict
+        fields = []
+        for attr in attributes:
+            if attr not in self.attributes:
+                raise ValueError(f"unknown attribute: {attr}")
+            i = self.attributes.index(attr)
+            fields.append((attr, i, i in self.text_sizes))
+        coding = self.coding
+        return lambda values: {attr: values[i].decode(coding).strip('\x00') if text else values[i] for attr, i, text in fields}
+
+    def encode_into(self, buffer: bytearray, offset: int, block: List[Dict]):
+        pack_into = self.struct.pack_into
+        for rec in block:
+            pack_into(buffer, offset, *self.dict_to_values(rec))
+            offset += self.record_size
+
+    def encode(self, block: List[Dict]) -> bytearray:
+        buffer = bytearray(len(block) * self.record_size)
+        self.encode_into(buffer, 0, block)
+        return buffer
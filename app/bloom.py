@@ -0,0 +1,71 @@
+import struct
+from math import ceil, log
+from typing import Tuple
+from app.hash_functions import key_to_int, mix64
+
+HEADER = struct.Struct('<4sQQIII') # magic, data file size and mtime in ns, filters, bytes per filter, hash functions
+MAGIC = b'HBLM'
+SEED = 0x5851F42D4C957F2D # keeps the filter bits independent of hash functions that also use mix64
+
+
+class BloomFilters:
+    # one Bloom filter per bucket over the keys whose home is that bucket: a key missing from
+    # the filter of its home bucket is certainly not in the file
+    def __init__(self, keys_per_bucket: int, fp_rate: float):
+        self.keys_per_bucket = keys_per_bucket
+        self.fp_rate = fp_rate
+        bits = max(8, ceil(-keys_per_bucket * log(fp_rate) / log(2) ** 2))
+        self.filter_size = (bits + 7) // 8
+        self.bits = self.filter_size * 8
+        self.num_hashes = max(1, round(self.bits / keys_per_bucket * log(2)))
+        self.data = bytearray() # filters of all buckets, grown as keys are added
+
+    def __positions(self, bucket_idx: int, id):
+        # double hashing of a single 64-bit hash into num_hashes bit positions
+        h = mix64(key_to_int(id) ^ SEED)
+        h1, h2 = h & 0xFFFFFFFF, (h >> 32) | 1
+        base = bucket_idx * self.bits
+        return [base + (h1 + i * h2) % self.bits for i in range(self.num_hashes)]
+
+    def add(self, bucket_idx: int, id):
+        end = (bucket_idx + 1) * self.filter_size
+        if end > len(self.data):
+            self.data.extend(bytes(end - len(self.data)))
+        for pos in self.__positions(bucket_idx, id):
+            self.data[pos >> 3] |= 1 << (pos & 7)
+
+    def might_contain(self, bucket_idx: int, id) -> bool:
+        if (bucket_idx + 1) * self.filter_size > len(self.data): # nothing was added to the bucket
+            return False
+        return all(self.data[pos >> 3] >> (pos & 7) & 1 for pos in self.__positions(bucket_idx, id))
+
+    def clear(self, bucket_idx: int = None):
+        if bucket_idx is None:
+            self.data = bytearray()
+            return
+        start = bucket_idx * self.filter_size
+        if start < len(self.data):
+            self.data[start:start + self.filter_size] = bytes(self.filter_size)
+
+    def save(self, filename: str, stamp: Tuple[int, int]):
+        with open(filename, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, *stamp, len(self.data) // self.filter_size, self.filter_size, self.num_hashes))
+            f.write(self.data)
+
+    def load(self, filename: str, stamp: Tuple[int, int]) -> bool:
+        # takes the saved filters only if they were saved for exactly this version of the data file
+        try:
+            with open(filename, 'rb') as f:
+                header = f.read(HEADER.size)
+                data = f.read()
+        except FileNotFoundError:
+            return False
+        if len(header) < HEADER.size:
+            return False
+        magic, size, mtime, count, filter_size, num_hashes = HEADER.unpack(header)
+        if (magic, (size, mtime), filter_size, num_hashes) != (MAGIC, tuple(stamp), self.filter_size, self.num_hashes):
+            return False
+        if len(data) != count * filter_size:
+            return False
+        self.data = bytearray(data)
+        return True
@@ -0,0 +1,196 @@
+import os
+import threading
+from contextlib import contextmanager
+from functools import wraps
+from typing import Dict, Optional
+from app.hash_file import HashFile
+
+STRUCTURE_LOCK = 0 # lock file byte guarding the whole file, stripe s is guarded by byte 1 + s
+# operations that stay in their home bucket whenever all the operations they may run there do
+COMPOSED = {'upsert': ('insert_record', 'update_record'), 'update_if': ('update_record',), 'get_and_delete': ('delete_by_id',)}
+
+
+class RWLock:
+    # any number of readers or a single writer; a waiting writer keeps new readers out so it is not starved
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = False
+        self._waiting_writers = 0
+
+    def acquire(self, exclusive: bool = False):
+        with self._cond:
+            if exclusive:
+                self._waiting_writers += 1
+                while self._writer or self._readers:
+                    self._cond.wait()
+                self._waiting_writers -= 1
+                self._writer = True
+            else:
+                while self._writer or self._waiting_writers:
+                    self._cond.wait()
+                self._readers += 1
+
+    def release(self, exclusive: bool = False):
+        with self._cond:
+            if exclusive:
+                self._writer = False
+            else:
+                self._readers -= 1
+            self._cond.notify_all()
+
+
+class ProcessLocks:
+    # fcntl byte-range locks on a companion lock file, one byte per lock. The data file itself is not
+    # used, since closing any descriptor of a file drops every lock the process holds on it.
+    # Record locks belong to the process rather than to a thread, so shared locks are counted and
+    # only the first thread to take one and the last one to release it touch the lock file.
+    def __init__(self, filename: str):
+        import fcntl
+        self._fcntl = fcntl
+        self._fd = os.open(filename, os.O_RDWR | os.O_CREAT, 0o666)
+        self._shared: Dict[int, int] = {} # byte -> threads holding it shared
+        self._mutexes: Dict[int, threading.Lock] = {}
+
+    def acquire(self, byte: int, exclusive: bool = False):
+        if exclusive:
+            self._fcntl.lockf(self._fd, self._fcntl.LOCK_EX, 1, byte)
+            return
+        with self._mutexes.setdefault(byte, threading.Lock()):
+            if not self._shared.get(byte):
+                self._fcntl.lockf(self._fd, self._fcntl.LOCK_SH, 1, byte)
+            self._shared[byte] = self._shared.get(byte, 0) + 1
+
+    def release(self, byte: int, exclusive: bool = False):
+        if not exclusive:
+            with self._mutexes[byte]:
+                self._shared[byte] -= 1
+                if self._shared[byte]:
+                    return
+                self._fcntl.lockf(self._fd, self._fcntl.LOCK_UN, 1, byte)
+            return
+        self._fcntl.lockf(self._fd, self._fcntl.LOCK_UN, 1, byte)
+
+    def close(self):
+        os.close(self._fd)
+
+
+class ConcurrentHashFile:
+    # Shares a hash file between threads and, with processes=True, between processes.
+    #
+    # Buckets are mapped onto stripes, each guarded by a reader-writer lock, and the file as a whole
+    # by a structure lock. Locks are always taken in the same order: the structure lock, then at most
+    # one stripe lock. An operation on a single key first takes the structure lock shared and the stripe
+    # of the key's home bucket (shared for lookups, exclusive for changes); if the file reports that the
+    # operation will not leave that bucket it runs there, in parallel with operations on other stripes.
+    # Everything else - probing or backward shifting past the home bucket, the shared overflow zone,
+    # the linked overflow free list, splits, batches, bulk loads, any change to a file with secondary
+    # indexes - runs under the exclusive structure lock.
+    def __init__(self, file: HashFile, stripes: int = 64, processes: bool = False):
+        if processes and file._wal is not None:
+            raise ValueError("a write-ahead log belongs to a single process")
+        if processes and file._bloom is not None:
+            raise ValueError("Bloom filters are kept in memory and would miss keys inserted by other processes")
+        if processes and file._indexes:
+            raise ValueError("secondary indexes cannot be shared between processes")
+        self.file = file
+        self.stripes = stripes # every process sharing a file has to use the same number
+        self._structure = RWLock()
+        self._stripe_locks = [RWLock() for _ in range(stripes)]
+        self._process_locks = ProcessLocks(file.filename + '.lock') if processes else None
+        file._io_lock = threading.RLock()
+        file._state_lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        # counters of this process may miss changes of others, which close must not save
+        with self._structure_lock(True):
+            self.file.close()
+        if self._process_locks is not None:
+            self._process_locks.close()
+
+    @contextmanager
+    def _lock(self, byte: int, lock: RWLock, exclusive: bool):
+        lock.acquire(exclusive)
+        try:
+            if self._process_locks is not None:
+                self._process_locks.acquire(byte, exclusive)
+            try:
+                yield
+            finally:
+                if self._process_locks is not None:
+                    self._process_locks.release(byte, exclusive)
+        finally:
+            lock.release(exclusive)
+
+    @contextmanager
+    def _structure_lock(self, exclusive: bool):
+        with self._lock(STRUCTURE_LOCK, self._structure, exclusive):
+            if self._process_locks is not None:
+                # other processes may have changed anything since the last operation
+                self.file._invalidate()
+            yield
+
+    def _run(self, method, *args, **kwargs):
+        result = method(*args, **kwargs)
+        if self._process_locks is not None:
+            self.file.flush() # before the locks are released
+        return result
+
+    def _keyed(self, operation: str, id, *args):
+        method = getattr(self.file, operation)
+        with self._structure_lock(False):
+            stripe = self.file.hash(id) % self.stripes
+            with self._lock(1 + stripe, self._stripe_locks[stripe], operation != 'find_by_id'):
+                # secondary indexes are shared by all buckets
+                if not self.file._indexes and all(self.file._single_bucket(part, id) for part in COMPOSED.get(operation, (operation,))):
+                    return self._run(method, *args)
+        with self._structure_lock(True):
+            return self._run(method, *args)
+
+    def find_by_id(self, id):
+        return self._keyed('find_by_id', id, id)
+
+    def insert_record(self, record: Dict) -> bool:
+        return self._keyed('insert_record', record.get('id'), record)
+
+    def update_record(self, record: Dict) -> bool:
+        return self._keyed('update_record', record.get('id'), record)
+
+    def delete_by_id(self, id) -> bool:
+        return self._keyed('delete_by_id', id, id)
+
+    def logical_delete_by_id(self, id) -> bool:
+        return self._keyed('logical_delete_by_id', id, id)
+
+    def upsert(self, record: Dict) -> bool:
+        return self._keyed('upsert', record.get('id'), record)
+
+    def update_if(self, id, expected: Dict, record: Dict) -> bool:
+        return self._keyed('update_if', id, id, expected, record)
+
+    def get_and_delete(self, id) -> Optional[Dict]:
+        return self._keyed('get_and_delete', id, id)
+
+    def scan(self, *args, **kwargs):
+        # the file stays locked until the scan is exhausted or closed, so the loop must not use it
+        with self._structure_lock(True):
+            yield from self.file.scan(*args, **kwargs)
+
+    def __getattr__(self, name: str):
+        # every other method of the file runs alone
+        attr = getattr(self.file, name)
+        if not callable(attr):
+            return attr
+
+        @wraps(attr)
+        def exclusive(*args, **kwargs):
+            with self._structure_lock(True):
+                return self._run(attr, *args, **kwargs)
+
+        return exclusive
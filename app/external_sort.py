@@ -0,0 +1,78 @@
+import heapq
+import struct
+import tempfile
+from operator import itemgetter
+from typing import Dict, Iterator, List, Tuple
+from app.block_codec import BlockCodec
+
+
+class ExternalSorter:
+    # stable sort of (key, record) pairs that spills sorted runs to temporary files
+    # once more than memory_records pairs are held in memory
+    def __init__(self, codec: BlockCodec, memory_records: int = 100000):
+        self.codec = codec
+        self.memory_records = max(memory_records, 1)
+        format = codec.record.format
+        prefix = format[0] if format[:1] in ('@', '=', '<', '>', '!') else ''
+        self.entry = struct.Struct(prefix + 'q' + format[len(prefix):])
+        self._items: List[Tuple[int, Dict]] = []
+        self._runs = []
+        self._sorted = False
+        self._count = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return self._count
+
+    def add(self, key: int, record: Dict):
+        self._items.append((key, record))
+        self._sorted = False
+        self._count += 1
+        if len(self._items) >= self.memory_records:
+            self._spill()
+
+    def _spill(self):
+        self._items.sort(key=itemgetter(0))
+        run = tempfile.TemporaryFile()
+        chunk = bytearray(min(len(self._items), 4096) * self.entry.size)
+        used = 0
+        for key, record in self._items:
+            self.entry.pack_into(chunk, used, key, *self.codec.dict_to_values(record))
+            used += self.entry.size
+            if used == len(chunk):
+                run.write(chunk)
+                used = 0
+        run.write(chunk[:used])
+        self._runs.append(run)
+        self._items = []
+
+    def _read_run(self, run) -> Iterator[Tuple[int, Dict]]:
+        run.seek(0)
+        while True:
+            chunk = run.read(4096 * self.entry.size)
+            if not chunk:
+                return
+            for values in self.entry.iter_unpack(chunk):
+                yield values[0], self.codec.values_to_dict(values[1:])
+
+    def __iter__(self) -> Iterator[Tuple[int, Dict]]:
+        if not self._runs:
+            if not self._sorted:
+                self._items.sort(key=itemgetter(0))
+                self._sorted = True
+            return iter(self._items)
+        if self._items:
+            self._spill()
+        # heapq.merge keeps equal keys in run order, so the sort stays stable across runs
+        return heapq.merge(*(self._read_run(run) for run in self._runs), key=itemgetter(0))
+
+    def close(self):
+        for run in self._runs:
+            run.close()
+        self._runs = []
+        self._items = []
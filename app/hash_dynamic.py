@@ -0,0 +1,415 @@
+import tempfile
+from collections import Counter
+from typing import Callable, Dict, Iterable, List, Optional, Tuple, Union
+from app.external_sort import ExternalSorter
+from app.hash_file import HashFile, indexed
+from app.hash_functions import division
+from app.hash_linked_overflow import Bucket
+from app.record import Record
+from app.stats import timed
+
+
+class HashFileDynamic(HashFile):
+    def __init__(self, filename: str, record: Record, num_buckets: int, blocking_factor: int, empty_record: Dict, empty_key: int = -1, max_load: float = 0.8, buffer_size: int = 64, use_mmap: bool = False, hash_function: Callable = division):
+        super().__init__(filename, record, num_buckets, blocking_factor, empty_record, empty_key, buffer_size, use_mmap, hash_function)
+        self.max_load = max_load # fraction of occupied record slots past which the next bucket is split
+        self.file_header_record = Record(['initial_buckets', 'level', 'split', 'records'], 'iiiq', 'ascii')
+        self.page_header_record = Record(['u', 'owner'], 'ii', 'ascii') # link to the next page of the chain, bucket the page belongs to
+        self.page_header_size = self.page_header_record.struct.size
+        self.page_size = self.page_header_size + self.block_size
+        # the file header takes the first page, bucket b is page b after it and overflow pages follow the last bucket
+        self.data_offset = max(self.page_size, self.file_header_record.struct.size)
+
+        self.initial_buckets = num_buckets
+        self.level = 0
+        self.split = 0 # next bucket to split
+        self.num_records = 0
+        self._header_loaded = False
+
+    def hash(self, id) -> int:
+        self.__load_header()
+        # splits need a hash whose range does not depend on the number of buckets
+        full_hash = self.hash_function(id, 1 << 64)
+        bucket_idx = full_hash % (self.initial_buckets << self.level)
+        if bucket_idx < self.split: # already split in this round
+            bucket_idx = full_hash % (self.initial_buckets << (self.level + 1))
+        return bucket_idx
+
+    def __load_header(self):
+        if self._header_loaded:
+            return
+        header = self.file_header_record.encoded_tuple_to_dict(self._read_raw(0, self.file_header_record.struct.size))
+        self.initial_buckets = header['initial_buckets']
+        self.level = header['level']
+        self.split = header['split']
+        self.num_records = header['records']
+        self.num_buckets = (self.initial_buckets << self.level) + self.split
+        self._header_loaded = True
+
+    def __write_header(self):
+        self._write_raw(0, self.file_header_record.dict_to_encoded_values({
+            'initial_buckets': self.initial_buckets,
+            'level': self.level,
+            'split': self.split,
+            'records': self.num_records,
+        }))
+
+    def _encode_page(self, page: Bucket) -> bytearray:
+        binary_data = bytearray(self.page_size)
+        self.page_header_record.struct.pack_into(binary_data, 0, page.header['u'], page.header['owner'])
+        self.codec.encode_into(binary_data, self.page_header_size, page.block)
+        return binary_data
+
+    def _decode_page(self, binary_data: bytes) -> Bucket:
+        link, owner = self.page_header_record.struct.unpack_from(binary_data, 0)
+        return Bucket({'u': link, 'owner': owner}, self.decode_block(binary_data, self.page_header_size))
+
+    def _read_page(self, page_idx: int) -> Bucket:
+        binary_data = self._read_raw(self.data_offset + page_idx * self.page_size, self.page_size)
+        if binary_data is None:
+            return None
+        return self._decode_page(binary_data)
+
+    def _write_page(self, page_idx: int, page: Bucket):
+        self._write_raw(self.data_offset + page_idx * self.page_size, self._encode_page(page))
+
+    def __num_pages(self) -> int:
+        return (self._file_end() - self.data_offset) // self.page_size
+
+    def __chain(self, bucket_idx: int):
+        # yields (page_idx, page) for the primary page of a bucket and every overflow page linked from it
+        page_idx = bucket_idx
+        while page_idx != -1:
+            page = self._read_page(page_idx)
+            yield page_idx, page
+            page_idx = page.header['u']
+
+    def __move_page(self, src: int, dst: int):
+        # moves an overflow page, relinking the page before it in the chain of its bucket
+        page = self._read_page(src)
+        for page_idx, prev in self.__chain(page.header['owner']):
+            if prev.header['u'] == src:
+                prev.header['u'] = dst
+                self._write_page(page_idx, prev)
+                break
+        self._write_page(dst, page)
+
+    def __free_page(self, page_idx: int):
+        # overflow pages are kept contiguous: the last page of the file is moved into the freed one
+        last_idx = self.__num_pages() - 1
+        if page_idx != last_idx:
+            self.__move_page(last_idx, page_idx)
+        self._truncate(self.data_offset + last_idx * self.page_size)
+
+    def __write_chain(self, bucket_idx: int, records: List[Dict], spare: List[int]):
+        # writes the records into the primary page of a bucket and as many spare pages as needed
+        bf = self.blocking_factor
+        blocks = [records[i:i + bf] for i in range(0, len(records), bf)] or [[]]
+        page_indices = [bucket_idx] + [spare.pop(0) for _ in blocks[1:]]
+        for i, block in enumerate(blocks):
+            link = page_indices[i + 1] if i + 1 < len(blocks) else -1
+            self._write_page(page_indices[i], Bucket({'u': link, 'owner': bucket_idx}, block + (bf - len(block)) * [self.empty_record]))
+
+    def __split(self):
+        old_idx = self.split
+        new_idx = self.num_buckets
+        # the new bucket takes the first page after the primary ones, an overflow page there goes to the end
+        if new_idx < self.__num_pages():
+            self.__move_page(new_idx, self.__num_pages())
+        pages = list(self.__chain(old_idx))
+        records = [rec for _, page in pages for rec in page.block if rec.get('status') == 1]
+
+        self.split += 1
+        if self.split == self.initial_buckets << self.level:
+            self.level += 1
+            self.split = 0
+        self.num_buckets += 1
+
+        spare = sorted(page_idx for page_idx, _ in pages[1:])
+        self.__write_chain(old_idx, [rec for rec in records if self.hash(rec.get('id')) == old_idx], spare)
+        self.__write_chain(new_idx, [rec for rec in records if self.hash(rec.get('id')) == new_idx], spare)
+        if self._bloom is not None:
+            self._bloom.clear(old_idx)
+            self._bloom.clear(new_idx)
+            for rec in records:
+                self._bloom.add(self.hash(rec.get('id')), rec.get('id'))
+        for page_idx in reversed(spare):
+            self.__free_page(page_idx)
+
+    def __create_file(self):
+        # empty file holding only the header of a file with the initial number of buckets
+        self._create_file()
+        self.level = 0
+        self.split = 0
+        self.num_records = 0
+        self.num_buckets = self.initial_buckets
+        self._header_loaded = True
+        self.__write_header()
+        self._write_raw(self.file_header_record.struct.size, bytes(self.data_offset - self.file_header_record.struct.size))
+        self.flush()
+
+    @timed
+    @indexed
+    def init_file(self):
+        self.__create_file()
+        self._clear_bloom()
+        page = Bucket({'u': -1, 'owner': 0}, self.blocking_factor * [self.empty_record])
+
+        def primary_zone():
+            for bucket_idx in range(self.num_buckets):
+                page.header['owner'] = bucket_idx
+                yield self._encode_page(page)
+
+        self._write_sequential(primary_zone())
+        self._set_counters(0)
+
+    @timed
+    @indexed
+    def bulk_load(self, records: Iterable[Dict], memory_records: int = 100000) -> int:
+        # builds the file from scratch with the initial number of buckets: records are sorted by
+        # bucket (spilling to temporary files when needed), then the primary pages and the overflow
+        # pages of every chain are written sequentially; later inserts split buckets as usual
+        bf = self.blocking_factor
+        longest = 1
+        self.__create_file()
+        with ExternalSorter(self.codec, memory_records) as sorter, tempfile.TemporaryFile() as overflow:
+            for record in records:
+                record['status'] = 1
+                sorter.add(self.hash(record.get('id')), record)
+
+            def empty_page(bucket_idx: int) -> bytearray:
+                return self._encode_page(Bucket({'u': -1, 'owner': bucket_idx}, bf * [self.empty_record]))
+
+            def primary_zone():
+                nonlocal longest
+                next_idx = 0
+                overflow_idx = self.num_buckets # index of the next overflow page
+                for bucket_idx, group in self._unique_groups(sorter):
+                    for idx in range(next_idx, bucket_idx):
+                        yield empty_page(idx)
+                    blocks = [group[i:i + bf] for i in range(0, len(group), bf)]
+                    longest = max(longest, len(blocks))
+                    for i, block in enumerate(blocks):
+                        link = overflow_idx + i if i + 1 < len(blocks) else -1
+                        page = self._encode_page(Bucket({'u': link, 'owner': bucket_idx}, block + (bf - len(block)) * [self.empty_record]))
+                        if i == 0:
+                            yield page
+                        else:
+                            overflow.write(page)
+                    overflow_idx += len(blocks) - 1
+                    self.num_records += len(group)
+                    next_idx = bucket_idx + 1
+                for idx in range(next_idx, self.num_buckets):
+                    yield empty_page(idx)
+
+            def overflow_zone():
+                overflow.seek(0)
+                chunk = overflow.read(1024 * self.page_size)
+                while chunk:
+                    yield chunk
+                    chunk = overflow.read(1024 * self.page_size)
+
+            self._write_sequential(primary_zone())
+            self._write_sequential(overflow_zone(), self.page_size)
+        self.__write_header()
+        self.flush()
+        self._set_counters(self.num_records, 0, longest)
+        return self.num_records
+
+    def _zones(self) -> List[Tuple[int, int, int, int]]:
+        return [(self.data_offset, self._file_end(), self.page_size, self.page_header_size)]
+
+    def _home_zones(self) -> Tuple[Optional[Tuple[int, int, int, int]], List[Tuple[int, int, int, int]]]:
+        self.__load_header()
+        primary_end = self.data_offset + self.num_buckets * self.page_size
+        return (self.data_offset, primary_end, self.page_size, self.page_header_size), [(primary_end, self._file_end(), self.page_size, self.page_header_size)]
+
+    def _placement(self) -> Tuple:
+        self.__load_header()
+        return 'linear hashing', self.hash_function, self.initial_buckets, self.level, self.split
+
+    def _bucket_records(self, bucket_idx: int) -> List[Dict]:
+        # live records of a bucket and its overflow pages
+        return [rec for _, page in self.__chain(bucket_idx) for rec in page.block if rec.get('status') == 1]
+
+    def _locate(self, id) -> Optional[Tuple[List[Dict], int, Callable[[], None]]]:
+        found = self.__search(id)
+        if found is None:
+            return None
+        page_idx, rec_idx, page = found
+        return page.block, rec_idx, lambda: self._write_page(page_idx, page)
+
+    def _hash_array(self, ids: 'np.ndarray') -> 'np.ndarray':
+        import numpy as np
+        from app.arrays import hash_array
+        self.__load_header()
+        full_hash = hash_array(self.hash_function, ids, 1 << 64)
+        bucket_idx = full_hash % np.uint64(self.initial_buckets << self.level)
+        split = bucket_idx < self.split
+        bucket_idx[split] = full_hash[split] % np.uint64(self.initial_buckets << (self.level + 1))
+        return bucket_idx.astype(np.int64)
+
+    def _header_record(self) -> Optional[Record]:
+        return self.page_header_record
+
+    def _continues(self, blocks: 'np.ndarray') -> 'np.ndarray':
+        return super()._continues(blocks) & (blocks['header']['u'] != -1)
+
+    def _options(self) -> Dict:
+        return {'max_load': self.max_load}
+
+    def _overflow_state(self) -> Dict:
+        # overflow pages are kept contiguous after the primary ones
+        self.__load_header()
+        return {'overflow_pages': self.__num_pages() - self.num_buckets, 'level': self.level, 'split': self.split}
+
+    def _invalidate(self):
+        super()._invalidate()
+        self._header_loaded = False
+
+    def _bucket_group(self, id) -> int:
+        # the initial bucket the home bucket of id was split from; hash reads the header
+        return self.hash_function(id, 1 << 64) % self.initial_buckets
+
+    def _single_bucket(self, operation: str, id) -> bool:
+        # inserts and deletes update the record count in the header, may split or move pages
+        return operation in ('find_by_id', 'update_record')
+
+    def structure_stats(self) -> Dict:
+        self.__load_header()
+        chains = Counter() # bucket_idx -> its overflow pages
+        for page_idx, header, _ in self._scan_blocks(self.data_offset, self._file_end(), self.page_size, self.page_header_size):
+            if page_idx >= self.num_buckets:
+                chains[self.page_header_record.struct.unpack(header)[1]] += 1
+        return {
+            'num_buckets': self.num_buckets,
+            'blocking_factor': self.blocking_factor,
+            'level': self.level,
+            'split': self.split,
+            'records': self.num_records,
+            'tombstones': 0,
+            'load_factor': self.num_records / (self.num_buckets * self.blocking_factor),
+            'overflow_pages': sum(chains.values()),
+            'chain_lengths': dict(sorted(Counter(chains[i] for i in range(self.num_buckets)).items())), # overflow pages of a bucket -> buckets
+            'longest_search': 1 + max(chains.values(), default=0),
+        }
+
+    @timed
+    def find_by_id(self, id) -> Union[Tuple[int, int], None]:
+        found = self.__search(id)
+        return found[:2] if found is not None else None
+
+    def __search(self, id) -> Optional[Tuple[int, int, Bucket]]:
+        # find_by_id, also returning the page holding the record
+        if not self._might_contain(id):
+            return None
+        for page_idx, page in self.__chain(self.hash(id)):
+            for rec_idx, rec in enumerate(page.block):
+                if rec.get('id') == id and rec.get('status') == 1:
+                    return page_idx, rec_idx, page
+                if rec.get('id') == self.empty_key:
+                    return None
+        return None
+
+    @timed
+    @indexed
+    def insert_record(self, record: Dict) -> bool:
+        id = record.get('id')
+        bucket_idx = self.hash(id)
+        for length, (page_idx, page) in enumerate(self.__chain(bucket_idx), 1):
+            if any(rec.get('id') == id and rec.get('status') == 1 for rec in page.block):
+                return False
+        record['status'] = 1
+        self._bloom_add(id)
+
+        # records are kept packed: only the last page of a chain has free slots
+        free = next((i for i, rec in enumerate(page.block) if rec.get('id') == self.empty_key), None)
+        if free is not None:
+            page.block[free] = record
+        else:
+            new_idx = self.__num_pages()
+            self._write_page(new_idx, Bucket({'u': -1, 'owner': bucket_idx}, [record] + (self.blocking_factor - 1) * [self.empty_record]))
+            page.header['u'] = new_idx
+            length += 1
+        self._write_page(page_idx, page)
+        self._count(1, 0, length) # splits only shorten chains
+
+        self.num_records += 1
+        if self.num_records > self.max_load * self.num_buckets * self.blocking_factor:
+            self.__split()
+        self.__write_header()
+        return True
+
+    @timed
+    @indexed
+    def update_record(self, record: Dict) -> bool:
+        find_res = self.find_by_id(record.get('id'))
+        if find_res is None:
+            return False
+        page_idx, rec_idx = find_res
+        record['status'] = 1
+        page = self._read_page(page_idx)
+        page.block[rec_idx] = record
+        self._write_page(page_idx, page)
+        return True
+
+    @timed
+    @indexed
+    def delete_by_id(self, id) -> bool:
+        chain = list(self.__chain(self.hash(id)))
+        target = next(((i, rec_idx) for i, (_, page) in enumerate(chain) for rec_idx, rec in enumerate(page.block) if rec.get('id') == id and rec.get('status') == 1), None)
+        if target is None:
+            return False
+        i, rec_idx = target
+
+        # fill the hole with the last record of the chain
+        last_idx, last_page = chain[-1]
+        last = max(j for j, rec in enumerate(last_page.block) if rec.get('id') != self.empty_key)
+        page_idx, page = chain[i]
+        page.block[rec_idx] = last_page.block[last]
+        last_page.block[last] = self.empty_record
+        self._write_page(page_idx, page)
+        if last == 0 and len(chain) > 1: # the last overflow page is empty now
+            prev_idx, prev = chain[-2]
+            prev.header['u'] = -1
+            self._write_page(prev_idx, prev)
+            self.__free_page(last_idx)
+        else:
+            self._write_page(last_idx, last_page)
+
+        self.num_records -= 1
+        self.__write_header()
+        self._count(-1)
+        return True
+
+    # splits move records between buckets in the middle of a batch, so records are not grouped by
+    # bucket; pinning still reads and writes every page and the header at most once
+    @timed
+    @indexed
+    def insert_many(self, records: List[Dict]) -> List[bool]:
+        with self._pinned():
+            return [self.insert_record(record) for record in records]
+
+    @timed
+    @indexed
+    def update_many(self, records: List[Dict]) -> List[bool]:
+        with self._pinned():
+            return [self.update_record(record) for record in records]
+
+    @timed
+    @indexed
+    def delete_many(self, ids: List) -> List[bool]:
+        with self._pinned():
+            return [self.delete_by_id(id) for id in ids]
+
+    def print_file(self):
+        self.__load_header()
+        print(f"Level: {self.level}, split pointer: {self.split}, records: {self.num_records}")
+        for i in range(self.num_buckets):
+            print(f"\nBUCKET {i+1}:")
+            for page_idx, page in self.__chain(i):
+                if page_idx != i:
+                    print(f"Overflow page {page_idx+1}:")
+                for j, rec in enumerate(page.block):
+                    print(f"Record {j}:\t{rec}")
+        print()
@@ -0,0 +1,596 @@
+import heapq
+import os
+from contextlib import nullcontext
+from functools import wraps
+from itertools import groupby
+from operator import itemgetter
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from app import superblock
+from app.binary_file import BinaryFile
+from app.bloom import BloomFilters
+from app.external_sort import ExternalSorter
+from app.hash_functions import division
+from app.record import Record
+from app.stats import timed
+
+
+def indexed(method):
+    # keeps the secondary indexes of a file in step with a modifying operation, see create_index
+    name = method.__name__
+
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if not self._indexes or self._indexing: # operations called from other operations are covered by them
+            return method(self, *args, **kwargs)
+        self._indexing = True
+        try:
+            return update(self, *args, **kwargs)
+        finally:
+            self._indexing = False
+
+    def update(self, *args, **kwargs):
+        if name in ('init_file', 'bulk_load'):
+            result = method(self, *args, **kwargs)
+            for index in self._indexes.values():
+                index.build(self)
+            return result
+        if name in ('insert_record', 'insert_many'):
+            # only records that were not in the file before are inserted
+            result = method(self, *args, **kwargs)
+            inserted = [args[0]] if name == 'insert_record' else args[0]
+            for record, ok in zip(inserted, [result] if name == 'insert_record' else result):
+                if ok:
+                    for index in self._indexes.values():
+                        index.add(record)
+            return result
+        if name in ('update_record', 'update_many', 'upsert'):
+            ids = [record['id'] for record in args[0]] if name == 'update_many' else [args[0]['id']]
+        else:
+            ids = list(args[0]) if name == 'delete_many' else [args[0]]
+        before = {id: self._find_record(id) for id in ids}
+        before = {id: dict(rec) if rec is not None else None for id, rec in before.items()}
+        result = method(self, *args, **kwargs)
+        for id, old in before.items():
+            new = self._find_record(id)
+            for index in self._indexes.values():
+                index.replace(old, new)
+        return result
+
+    return wrapper
+
+
+class HashFile(BinaryFile):
+    def __init__(self, filename: str, record: Record, num_buckets: int, blocking_factor: int, empty_record: Dict, empty_key: int = -1, buffer_size: int = 64, use_mmap: bool = False, hash_function: Callable = division):
+        super().__init__(filename, record, blocking_factor, empty_record, empty_key, buffer_size, use_mmap)
+        self.num_buckets = num_buckets
+        self.hash_function = hash_function # (key, num_buckets) -> bucket index, see app.hash_functions
+        self._bloom: Optional[BloomFilters] = None
+        self._indexes: Dict[str, 'SecondaryIndex'] = {}
+        self._indexing = False # inside an operation that updates the indexes
+        # live records, tombstones and an upper bound on the blocks read by a search ('longest', None
+        # when it is not known), kept by every operation; None when the file has to be counted again
+        self._counters: Optional[Dict[str, Optional[int]]] = None
+        # guards the counters and Bloom filters, which operations on different stripes of a
+        # ConcurrentHashFile update at the same time
+        self._state_lock = nullcontext()
+        self._counters_saved = False # the superblock holds the counters as of the last open
+        self._writes_superblock = True # False for the copies worker processes use, see app.parallel
+
+    def hash(self, id) -> int:
+        return self.hash_function(id, self.num_buckets)
+
+    def create_index(self, attribute: str, num_buckets: int = 8, blocking_factor: int = 16, rebuild: bool = False) -> 'SecondaryIndex':
+        # secondary hash index on a non-key attribute, kept in <filename>.<attribute>.idx; an existing
+        # index file is taken as it is unless rebuild is set
+        from app.secondary_index import SecondaryIndex
+        if attribute in ('id', 'status') or attribute not in self.record.attributes:
+            raise ValueError(f"cannot index attribute: {attribute}")
+        index = SecondaryIndex(self, attribute, num_buckets, blocking_factor)
+        if rebuild or not os.path.exists(index.file.filename):
+            index.build(self)
+        self._indexes[attribute] = index
+        return index
+
+    def drop_index(self, attribute: str):
+        self._indexes.pop(attribute).drop()
+
+    @timed
+    def find_by(self, attribute: str, value) -> List[Dict]:
+        # live records whose attribute equals value: through the index on the attribute if there is
+        # one, with a scan of the whole file otherwise
+        if attribute == 'id':
+            record = self._find_record(value)
+            return [record] if record is not None else []
+        if attribute not in self._indexes:
+            return list(self.scan(where=[(attribute, '==', value)]))
+        records = (self._find_record(id) for id in self._indexes[attribute].ids(value))
+        return [record for record in records if record is not None and record[attribute] == value]
+
+    # Read-modify-write operations. The live record is changed in the block it was found in, which
+    # is written back without being read again; when the class's own insert or delete has to run,
+    # every page read by the search stays in memory until the end of the operation.
+
+    @timed
+    @indexed
+    def upsert(self, record: Dict) -> bool:
+        # replaces the live record with the same id, or inserts the record if there is none;
+        # False only if it could not be inserted
+        with self._held():
+            located = self._locate(record.get('id'))
+            if located is None:
+                return self.insert_record(record)
+            records, rec_idx, write = located
+            record['status'] = 1
+            records[rec_idx] = record
+            write()
+            return True
+
+    @timed
+    @indexed
+    def update_if(self, id, expected: Dict, record: Dict) -> bool:
+        # compare-and-swap: replaces the live record with the id only while its attributes have the
+        # expected values
+        if record.get('id') != id:
+            raise ValueError("the new record must have the same id")
+        located = self._locate(id)
+        if located is None:
+            return False
+        records, rec_idx, write = located
+        if any(records[rec_idx].get(attribute) != value for attribute, value in expected.items()):
+            return False
+        record['status'] = 1
+        records[rec_idx] = record
+        write()
+        return True
+
+    @timed
+    @indexed
+    def get_and_delete(self, id) -> Optional[Dict]:
+        # deletes the live record with the id like delete_by_id and returns it
+        with self._held():
+            located = self._locate(id)
+            if located is None:
+                return None
+            records, rec_idx, _ = located
+            record = dict(records[rec_idx])
+            self.delete_by_id(id)
+            return record
+
+    def enable_bloom(self, fp_rate: float = 0.01, keys_per_bucket: Optional[int] = None) -> BloomFilters:
+        # keeps a Bloom filter per bucket, saved to <filename>.bloom on close and rebuilt with a scan
+        # when the saved one does not match the file, so that lookups and inserts of keys that are
+        # not in the file can skip reading buckets, overflow records and probe sequences
+        self._bloom = BloomFilters(keys_per_bucket or self.blocking_factor, fp_rate)
+        if os.path.exists(self.filename):
+            self.open() # replays a leftover write-ahead log
+            self.flush()
+            if not self._bloom.load(self.filename + '.bloom', self.__file_stamp()):
+                self.rebuild_bloom()
+        return self._bloom
+
+    def disable_bloom(self):
+        self._bloom = None
+
+    @timed
+    def rebuild_bloom(self):
+        # deleted keys stay in the filters until they are rebuilt
+        self._bloom.clear()
+        for rec in self._iter_records():
+            self._bloom.add(self.hash(rec.get('id')), rec.get('id'))
+
+    def __file_stamp(self) -> Tuple[int, int]:
+        st = os.stat(self.filename)
+        return st.st_size, st.st_mtime_ns
+
+    def _might_contain(self, id) -> bool:
+        return self._bloom is None or self._bloom.might_contain(self.hash(id), id)
+
+    def _bloom_add(self, id):
+        if self._bloom is not None:
+            with self._state_lock:
+                self._bloom.add(self.hash(id), id)
+
+    def open(self):
+        opened = self._file is None
+        super().open()
+        if opened:
+            # counters saved by the last close, unless the file was changed after it
+            self._counters = superblock.load_counters(self)
+            self._counters_saved = self._counters is not None
+            if self._writes_superblock and not self._reserved and self._file_size and not os.path.exists(superblock.path(self.filename)):
+                superblock.save(self, self.__file_stamp(), self._overflow_state())
+
+    def _reserved_size(self) -> int:
+        return superblock.SIZE if superblock.present(self._file.fileno()) else 0
+
+    def _create_file(self):
+        super()._create_file()
+        self._reserved = superblock.SIZE
+        if self._writes_superblock:
+            superblock.write(self, None, None)
+
+    def _touch(self):
+        if not self._modified and self._reserved and self._writes_superblock:
+            # the saved counters no longer hold once the file changes, until it is closed
+            superblock.write(self, None, None)
+        super()._touch()
+
+    def flush(self):
+        super().flush()
+        for index in self._indexes.values():
+            index.flush()
+
+    def close(self):
+        opened = self._file is not None
+        # the superblock only changes with the file, or once counters missing from it were counted
+        save = opened and self._writes_superblock and (self._modified or not self._counters_saved and self._counters is not None)
+        overflow = self._overflow_state() if save else None
+        if save and self._reserved:
+            self.flush()
+            superblock.write(self, self._counters, overflow)
+        super().close()
+        if save and not self._reserved:
+            superblock.save(self, self.__file_stamp(), overflow)
+        if opened:
+            if self._bloom is not None:
+                self._bloom.save(self.filename + '.bloom', self.__file_stamp())
+        for index in self._indexes.values():
+            index.close()
+
+    def _invalidate(self):
+        super()._invalidate()
+        self._counters = None
+
+    def _set_counters(self, records: int, tombstones: int = 0, longest: Optional[int] = 1):
+        self._counters = {'records': records, 'tombstones': tombstones, 'longest': longest}
+
+    def _count(self, records: int = 0, tombstones: int = 0, longest: int = 0, grown: int = 0):
+        # longest: the blocks a search for a record written by the operation reads; grown: the blocks
+        # a search in a chain that was not read got longer by, which raises the bound as much;
+        # deletes leave it as it is, so it stays an upper bound
+        with self._state_lock:
+            if self._counters is None:
+                return
+            self._counters['records'] += records
+            self._counters['tombstones'] += tombstones
+            if self._counters['longest'] is not None:
+                self._counters['longest'] = max(self._counters['longest'], longest) + grown
+
+    def _known_counters(self) -> Dict[str, Optional[int]]:
+        self.open() # loads the saved counters
+        if self._counters is None:
+            self.__recount()
+        return self._counters
+
+    def __recount(self):
+        stats = self.structure_stats()
+        self._set_counters(stats['records'], stats['tombstones'], stats['longest_search'])
+
+    @timed
+    def occupancy(self) -> Dict:
+        # record counts, load and overflow state from the counters kept by every operation, without
+        # reading the file; files whose counters are not known (changed by another process, or not
+        # closed after their last change) or whose longest search is not are counted once with
+        # structure_stats
+        if self._known_counters()['longest'] is None:
+            self.__recount()
+        counters = self._counters
+        return {
+            'records': counters['records'],
+            'tombstones': counters['tombstones'],
+            'load_factor': counters['records'] / (self.num_buckets * self.blocking_factor),
+            'longest_search': counters['longest'],
+            **self._overflow_state(),
+        }
+
+    def _overflow_state(self) -> Dict:
+        # state of the overflow areas kept in file headers or given by the file size, read without a scan
+        return {}
+
+    def _options(self) -> Dict:
+        # constructor arguments of the class beyond those of HashFile, see _clone and app.superblock
+        return {}
+
+    def _clear_bloom(self):
+        if self._bloom is not None:
+            self._bloom.clear()
+
+    def _group_by_bucket(self, ids: List) -> Dict[int, List[int]]:
+        # bucket index -> positions of the ids that hash into it, buckets in file order
+        groups = {}
+        for pos, id in enumerate(ids):
+            groups.setdefault(self.hash(id), []).append(pos)
+        return dict(sorted(groups.items()))
+
+    def _unique_groups(self, pairs: Iterable[Tuple[int, Dict]]) -> Iterator[Tuple[int, List[Dict]]]:
+        # groups key-sorted (key, record) pairs, keeping the first record of every id; every bulk
+        # load passes its records through here, so this is where the Bloom filters are refilled
+        self._clear_bloom()
+        key, group, ids = None, [], set()
+        for pair_key, record in pairs:
+            if pair_key != key:
+                if group:
+                    yield key, group
+                key, group, ids = pair_key, [], set()
+            if record.get('id') in ids:
+                continue
+            ids.add(record.get('id'))
+            record['status'] = 1
+            group.append(record)
+            self._bloom_add(record.get('id'))
+        if group:
+            yield key, group
+
+    def _scan_blocks(self, start: int, end: int, unit: int, header_size: int = 0) -> Iterator[Tuple[int, bytes, List[Dict]]]:
+        # yields (index, header, records) for consecutive blocks of unit bytes read sequentially,
+        # each starting with a header of header_size bytes
+        count = (unit - header_size) // self.record_size
+        idx = 0
+        for chunk in self._read_sequential(start, end, unit):
+            for offset in range(0, len(chunk) - unit + 1, unit):
+                yield idx, chunk[offset:offset + header_size], self.codec.decode(chunk, offset + header_size, count)
+                idx += 1
+
+    def scan(self, attributes: Optional[Iterable[str]] = None, where: Iterable[Tuple[str, str, object]] = ()) -> Iterator[Dict]:
+        # streams the live records of the whole file with large sequential reads. where holds
+        # (attribute, operator, value) conditions that must all hold, e.g. ('number', '>', 10), and
+        # attributes the ones to keep; records are only turned into dicts once they pass the conditions
+        return self._scan_zones(self._zones(), attributes, where)
+
+    def _scan_zones(self, zones: List[Tuple[int, int, int, int]], attributes: Optional[Iterable[str]] = None, where: Iterable[Tuple[str, str, object]] = ()) -> Iterator[Dict]:
+        status = self.record.attributes.index('status')
+        matches = self.codec.predicate(where)
+        project = self.codec.projection(attributes)
+        for start, end, unit, header_size in zones:
+            count = (unit - header_size) // self.record_size
+            for chunk in self._read_sequential(start, end, unit):
+                for offset in range(header_size, len(chunk) - unit + header_size + 1, unit):
+                    for values in self.codec.unpack(chunk, offset, count):
+                        if values[status] == 1 and matches(values):
+                            yield project(values)
+
+    # Joins and set operations. Two files whose keys map to the same buckets - the same class of
+    # mapping, hash function and number of buckets - are read side by side one bucket at a time,
+    # each with sequential reads; records of other files are first sorted into the buckets of the
+    # other file. Memory is bounded by a bucket and its overflow records, and by memory_records for
+    # the sorts. Results come in bucket order.
+
+    def join(self, other: 'HashFile', on: str = 'id', memory_records: int = 100000) -> Iterator[Tuple[Dict, Dict]]:
+        # (record, match) for every live record of this file whose attribute on equals the key of a
+        # live record of other
+        if on not in self.record.attributes:
+            raise ValueError(f"unknown attribute: {on}")
+        for records, matches in self.__matched_groups(other, on, memory_records):
+            for record in records:
+                match = matches.get(record.get(on))
+                if match is not None:
+                    yield record, match
+
+    def intersect(self, other: 'HashFile', memory_records: int = 100000) -> Iterator[Dict]:
+        # live records of this file whose key is also a live key of other
+        for records, matches in self.__matched_groups(other, 'id', memory_records):
+            yield from (record for record in records if record.get('id') in matches)
+
+    def difference(self, other: 'HashFile', memory_records: int = 100000) -> Iterator[Dict]:
+        # live records of this file whose key is not a live key of other
+        for records, matches in self.__matched_groups(other, 'id', memory_records):
+            yield from (record for record in records if record.get('id') not in matches)
+
+    def __matched_groups(self, other: 'HashFile', on: str, memory_records: int) -> Iterator[Tuple[List[Dict], Dict]]:
+        # groups of records of this file whose values of on hash to the same bucket of other,
+        # each with the live records of that bucket of other by key
+        if on == 'id' and self._placement() == other._placement():
+            groups = self._home_groups(memory_records)
+        else:
+            groups = self.__groups_in(other, on, memory_records)
+        theirs = other._home_groups(memory_records)
+        current = next(theirs, None)
+        for bucket_idx, records in groups:
+            while current is not None and current[0] < bucket_idx:
+                current = next(theirs, None)
+            matches = {rec.get('id'): rec for rec in current[1]} if current is not None and current[0] == bucket_idx else {}
+            yield records, matches
+
+    def __groups_in(self, other: 'HashFile', on: str, memory_records: int) -> Iterator[Tuple[int, List[Dict]]]:
+        # the live records of this file grouped by the bucket of other their value of on hashes to
+        with ExternalSorter(self.codec, memory_records) as sorter:
+            for record in self.scan():
+                sorter.add(other.hash(record.get(on)), record)
+            for bucket_idx, pairs in groupby(sorter, key=itemgetter(0)):
+                yield bucket_idx, [record for _, record in pairs]
+
+    def _placement(self) -> Tuple:
+        # what decides the bucket of a key: files with equal placements put every key in the same bucket
+        return 'static', self.hash_function, self.num_buckets
+
+    def _home_groups(self, memory_records: int = 100000) -> Iterator[Tuple[int, List[Dict]]]:
+        # (bucket_idx, live records whose home is the bucket) for every bucket with any, in bucket
+        # order and with sequential reads: primary buckets are read in order, the records of the
+        # overflow zones are sorted by bucket beforehand
+        primary, overflow = self._home_zones()
+        with ExternalSorter(self.codec, memory_records) as sorter:
+            for record in self._scan_zones(overflow):
+                sorter.add(self.hash(record.get('id')), record)
+            buckets = iter(())
+            if primary is not None:
+                buckets = ((bucket_idx, [rec for rec in block if rec.get('status') == 1]) for bucket_idx, _, block in self._scan_blocks(*primary))
+            spilled = ((bucket_idx, [record for _, record in pairs]) for bucket_idx, pairs in groupby(sorter, key=itemgetter(0)))
+            for bucket_idx, parts in groupby(heapq.merge(buckets, spilled, key=itemgetter(0)), key=itemgetter(0)):
+                records = [record for _, part in parts for record in part]
+                if records:
+                    yield bucket_idx, records
+
+    def _home_zones(self) -> Tuple[Optional[Tuple[int, int, int, int]], List[Tuple[int, int, int, int]]]:
+        # the zone of primary buckets, if block i of it only holds records whose home is bucket i,
+        # and the zones holding the other records (see _zones)
+        zones = self._zones()
+        return zones[0], zones[1:]
+
+    def to_numpy(self) -> Tuple['np.ndarray', 'np.ndarray']:
+        # every record slot of the file as a structured array (see app.arrays.record_dtype) and a mask
+        # of the live ones; a memory map of the file where records are stored without block headers,
+        # a copy otherwise. Requires NumPy.
+        import numpy as np
+        from app.arrays import block_array, record_dtype
+        self.flush()
+        dtype = record_dtype(self.record)
+        zones = [block_array(self.filename, dtype, self._reserved + start, self._reserved + end, unit, header_size)['records'].reshape(-1)
+                 for start, end, unit, header_size in self._zones()]
+        records = zones[0] if len(zones) == 1 else np.concatenate(zones)
+        return records, records['status'] == 1
+
+    def find_many(self, ids) -> Tuple['np.ndarray', 'np.ndarray']:
+        # looks up many ids at once: hashes them with array operations, gathers their home buckets
+        # from a memory map of the primary zone in file order and matches the keys there. Ids that
+        # are missing from a full bucket go on to the next bucket of their probe sequence the same
+        # way, or are looked up one by one in the overflow records of their bucket. Returns a
+        # structured array with the record of every id, in input order, and a mask of the ids
+        # that were found. Requires NumPy.
+        import numpy as np
+        from app.arrays import block_array, record_dtype
+        self.flush()
+        dtype = record_dtype(self.record)
+        ids = np.asarray(ids)
+        result = np.zeros(len(ids), dtype=dtype)
+        found = np.zeros(len(ids), dtype=bool)
+        start, _, unit, header_size = self._zones()[0]
+        header = self._header_record()
+        primary = block_array(self.filename, dtype, self._reserved + start, self._reserved + start + self.num_buckets * unit, unit, header_size,
+                              record_dtype(header) if header is not None else None)
+        keys = np.char.encode(ids.astype(str), self.record.coding) if dtype['id'].kind == 'S' else ids
+        pending = np.arange(len(ids)) # positions of the ids still looked for
+        home = bucket_idx = self._hash_array(ids)
+        while len(pending):
+            buckets, inverse = np.unique(bucket_idx, return_inverse=True)
+            blocks = np.asarray(primary[buckets])[inverse]
+            hits = (blocks['records']['id'] == keys[pending, None]) & (blocks['records']['status'] == 1)
+            hit = hits.any(axis=1)
+            found[pending[hit]] = True
+            result[pending[hit]] = blocks['records'][hit, hits[hit].argmax(axis=1)]
+            more = ~hit & self._continues(blocks)
+            pending, home, bucket_idx = pending[more], home[more], bucket_idx[more]
+            next_idx = self._next_buckets(ids[pending], bucket_idx)
+            if next_idx is None:
+                for pos in pending:
+                    rec = self._find_record(ids[pos].item())
+                    if rec is not None:
+                        result[pos] = tuple(self.codec.dict_to_values(rec))
+                        found[pos] = True
+                break
+            back = next_idx == home # the whole probe sequence was read
+            pending, home, bucket_idx = pending[~back], home[~back], next_idx[~back]
+        return result, found
+
+    def _hash_array(self, ids: 'np.ndarray') -> 'np.ndarray':
+        from app.arrays import hash_array
+        return hash_array(self.hash_function, ids, self.num_buckets).astype('int64')
+
+    def _next_buckets(self, ids: 'np.ndarray', bucket_idx: 'np.ndarray') -> Optional['np.ndarray']:
+        # the buckets probed after the given ones by the given ids, for organizations whose records
+        # continue in other primary buckets rather than in overflow records
+        return None
+
+    def _header_record(self) -> Optional[Record]:
+        # layout of the header that starts every primary bucket, if any
+        return None
+
+    def _continues(self, blocks: 'np.ndarray') -> 'np.ndarray':
+        # for primary buckets as returned by app.arrays.block_array: whether a key missing from a
+        # bucket may still be stored elsewhere, which is only possible once the bucket is full
+        return (blocks['records']['status'] != 0).all(axis=1)
+
+    def _find_record(self, id) -> Optional[Dict]:
+        located = self._locate(id)
+        return located[0][located[1]] if located is not None else None
+
+    def _locate(self, id) -> Optional[Tuple[List[Dict], int, Callable[[], None]]]:
+        # the live record with the id, found like find_by_id: the records of the block holding it as
+        # read by the search, the index of the record among them and a function writing them back
+        raise NotImplementedError
+
+    def structure_stats(self) -> Dict:
+        raise NotImplementedError
+
+    def _zones(self) -> List[Tuple[int, int, int, int]]:
+        # (start, end, unit, header_size) of the file areas holding records: consecutive blocks of
+        # unit bytes, each starting with a header of header_size bytes
+        raise NotImplementedError
+
+    def _iter_records(self) -> Iterator[Dict]:
+        return self.scan()
+
+    def _clone(self, filename: str, num_buckets: int, blocking_factor: int) -> "HashFile":
+        # an unopened file of the same class, record layout and options
+        return type(self)(filename, self.record, num_buckets, blocking_factor, self.empty_record, self.empty_key,
+                          buffer_size=self.buffer_size, use_mmap=self.use_mmap, hash_function=self.hash_function, **self._options())
+
+    def _bucket_group(self, id) -> int:
+        # a group of buckets holding the home bucket of id, computed without reading the file
+        return self.hash(id)
+
+    def _single_bucket(self, operation: str, id) -> bool:
+        # whether an operation on id reads and writes nothing but the home bucket of id and the
+        # overflow records owned by it, judged by reading the home bucket (see app.concurrency)
+        return False
+
+    def _local_insert(self, id) -> bool:
+        # whether inserting id reads and writes nothing but its home bucket, apart from record counts
+        # kept in memory, when nobody else writes that bucket (see app.parallel)
+        return self._single_bucket('insert_record', id)
+
+    @timed
+    def reorganize(self, new_num_buckets: int, new_blocking_factor: Optional[int] = None, memory_records: int = 100000) -> int:
+        # streams every live record into a new file built next to this one with bulk_load,
+        # which then replaces this file atomically; returns the number of records kept
+        return self._reorganize(self._iter_records(), new_num_buckets, new_blocking_factor, memory_records)
+
+    def _reorganize(self, source: Iterator[Dict], new_num_buckets: int, new_blocking_factor: Optional[int], memory_records: int) -> int:
+        # reorganize with the live records of this file read from source
+        target = self._clone(self.filename + '.reorg', new_num_buckets, new_blocking_factor or self.blocking_factor)
+        target._check_fits(self._known_counters()['records'], (record['id'] for record in self.scan(['id'])))
+        read = 0
+
+        def records():
+            nonlocal read
+            for record in source:
+                read += 1
+                yield record
+
+        try:
+            with target:
+                loaded = target.bulk_load(records(), memory_records)
+                if loaded < read: # this file is only replaced by one holding every record
+                    raise ValueError(f"only {loaded} of {read} records were loaded into the new file")
+                os.fsync(target._file.fileno())
+        except BaseException:
+            target._discard()
+            raise
+        self._replace_with(target)
+        return loaded
+
+    def _check_fits(self, records: int, ids: Iterable):
+        # raises ValueError if this geometry cannot hold the given number of records with these
+        # ids (a generator, only read if the class needs them)
+        pass
+
+    def _discard(self):
+        # removes an unfinished file and the superblock of a file without one of its own
+        for name in (self.filename, superblock.path(self.filename)):
+            if os.path.exists(name):
+                os.remove(name)
+
+    def _replace_with(self, target: "HashFile"):
+        # atomically replaces this file with a complete and synced new file built next to it
+        filename = self.filename
+        self.close()
+        os.replace(target.filename, filename)
+        if os.path.exists(superblock.path(filename)): # the new file has a superblock of its own
+            os.remove(superblock.path(filename))
+        # take over the geometry and state of the new file
+        kept = {name: vars(self)[name] for name in ('stats', '_io_lock', '_state_lock', '_wal', '_indexes')}
+        bloom = self._bloom
+        vars(self).update(vars(target))
+        self.filename = filename
+        vars(self).update(kept)
+        if bloom is not None:
+            self.enable_bloom(bloom.fp_rate, bloom.keys_per_bucket)
@@ -0,0 +1,37 @@
+import hashlib
+
+MASK_64 = (1 << 64) - 1
+GOLDEN_64 = 0x9E3779B97F4A7C15 # 2**64 divided by the golden ratio, rounded to an odd number
+
+
+def key_to_int(key) -> int:
+    # integers are used as they are, other keys are reduced to 64 bits with a hash that,
+    # unlike the built-in hash(), gives the same value in every run
+    if isinstance(key, int):
+        return key
+    if isinstance(key, str):
+        key = key.encode('utf-8')
+    elif not isinstance(key, (bytes, bytearray)):
+        key = repr(key).encode('utf-8')
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), 'little')
+
+
+def mix64(x: int) -> int:
+    # splitmix64 finalizer: every input bit affects every output bit
+    x &= MASK_64
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & MASK_64
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & MASK_64
+    return x ^ (x >> 31)
+
+
+def division(key, num_buckets: int) -> int:
+    return key_to_int(key) % num_buckets
+
+
+def multiplicative(key, num_buckets: int) -> int:
+    # Knuth's multiplicative method: the fractional part of key * golden ratio, scaled to the range
+    return ((key_to_int(key) * GOLDEN_64) & MASK_64) * num_buckets >> 64
+
+
+def mixing(key, num_buckets: int) -> int:
+    return mix64(key_to_int(key)) % num_buckets
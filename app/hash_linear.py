@@ -1,138 +1,665 @@
-from typing import Dict, Tuple
-from app.binary_file import BinaryFile
+import os
+from collections import Counter, deque
+from itertools import chain, groupby
+from math import gcd
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from app.external_sort import ExternalSorter
+from app.hash_file import HashFile, indexed
+from app.hash_functions import GOLDEN_64, division, key_to_int, mix64
 from app.record import Record
+from app.stats import timed
 
 
-class HashFileLinear(BinaryFile):
-    def __init__(self, filename: str, record: Record, num_buckets: int, blocking_factor: int, empty_record: Dict, empty_key: int=-1, step:int=1):
-        super().__init__(filename, record, blocking_factor, empty_record, empty_key)
-        self.num_buckets = num_buckets
+class HashFileLinear(HashFile):
+    def __init__(self, filename: str, record: Record, num_buckets: int, blocking_factor: int, empty_record: Dict, empty_key: int=-1, step:int=1, buffer_size: int=64, use_mmap: bool=False, hash_function: Callable = division, double_hashing: bool = False, robin_hood: bool = False):
+        super().__init__(filename, record, num_buckets, blocking_factor, empty_record, empty_key, buffer_size, use_mmap, hash_function)
+        if robin_hood and double_hashing:
+            raise ValueError("Robin Hood probing needs a probe sequence shared by all keys")
         self.step = step
+        self.double_hashing = double_hashing # derive the probe step from the key instead of using step
+        # Robin Hood mode: records are kept in the order of their home buckets along the probe sequence,
+        # so lookups stop at the first bucket holding a record closer to its home than the key would be
+        self.robin_hood = robin_hood
+        self.file_header_record = Record(['max_displacement'], 'q', 'ascii')
+        # in Robin Hood mode the file header takes the first block and bucket b is block b after it
+        self.data_offset = max(self.block_size, self.file_header_record.struct.size) if robin_hood else 0
+        self.max_displacement = 0 # largest number of buckets any record was stored past its home bucket
+        self._header_loaded = False
 
-    def hash(self, id: int) -> int:
-        return id % self.num_buckets
-    
+    def _read_bucket(self, bucket_idx: int) -> List[Dict]:
+        return self.read_block_at(self.data_offset + bucket_idx * self.block_size)
+
+    def _write_bucket(self, bucket_idx: int, bucket: List[Dict]):
+        self.write_block_at(self.data_offset + bucket_idx * self.block_size, bucket)
+
+    def __load_header(self):
+        if self._header_loaded:
+            return
+        header = self.file_header_record.encoded_tuple_to_dict(self._read_raw(0, self.file_header_record.struct.size))
+        self.max_displacement = header['max_displacement']
+        self._header_loaded = True
+
+    def __write_header(self):
+        self._write_raw(0, self.file_header_record.dict_to_encoded_values({'max_displacement': self.max_displacement}))
+
+    def __header_block(self, max_displacement: int) -> List[bytes]:
+        # the header block that starts a new file, if it has one
+        if not self.robin_hood:
+            return []
+        self.max_displacement = max_displacement
+        self._header_loaded = True
+        header = self.file_header_record.dict_to_encoded_values({'max_displacement': max_displacement})
+        return [header + bytes(self.data_offset - len(header))]
+
+    def _invalidate(self):
+        super()._invalidate()
+        self._header_loaded = False
+
+    def __step(self, id) -> int:
+        if not self.double_hashing or self.num_buckets == 1:
+            return self.step
+        # a second hash, independent of the home bucket, picks a step coprime with num_buckets
+        # so that the probe sequence of every key visits all buckets
+        step = 1 + mix64(key_to_int(id) + GOLDEN_64) % (self.num_buckets - 1)
+        while gcd(step, self.num_buckets) != 1:
+            step = step % (self.num_buckets - 1) + 1
+        return step
+
+    def __probe(self, bucket_idx: int):
+        curr_idx = bucket_idx
+        while True:
+            yield curr_idx, self._read_bucket(curr_idx)
+            curr_idx = (curr_idx + self.step) % self.num_buckets
+            if curr_idx == bucket_idx:
+                break
+
+    def __free_slots(self, bucket_idx: int, live: Dict, dead: Dict):
+        # yields empty slots along the probe sequence, recording the position
+        # of every live and logically deleted record passed on the way
+        for curr_idx, bucket in self.__probe(bucket_idx):
+            for rec_idx, rec in enumerate(bucket):
+                if rec.get('status') == 0:
+                    yield curr_idx, rec_idx
+                elif rec.get('status') == 1:
+                    live[rec.get('id')] = (curr_idx, rec_idx)
+                else:
+                    dead[rec.get('id')] = (curr_idx, rec_idx)
+
+    def _write_record(self, bucket_idx: int, rec_idx: int, record: Dict):
+        bucket = self._read_bucket(bucket_idx)
+        bucket[rec_idx] = record
+        self._write_bucket(bucket_idx, bucket)
+
+    @timed
+    @indexed
     def init_file(self):
-        with open(self.filename, "wb") as f:
-            for _ in range(self.num_buckets):
-                bucket = self.blocking_factor * [self.empty_record]
-                self.write_block(f, bucket)
+        self._create_file()
+        self._clear_bloom()
+        bucket = self.encode_block(self.blocking_factor * [self.empty_record])
+        self._write_sequential(chain(self.__header_block(0), (bucket for _ in range(self.num_buckets))))
+        self._set_counters(0)
+
+    def __cycle_key(self, bucket_idx: int) -> int:
+        # position of a bucket in the order probe sequences visit buckets: probing with a step
+        # that shares a divisor g with num_buckets splits the file into g separate cycles
+        g = gcd(self.step, self.num_buckets)
+        cycle_len = self.num_buckets // g
+        start = bucket_idx % g
+        return start * cycle_len + (bucket_idx - start) // g * pow(self.step // g, -1, cycle_len) % cycle_len
+
+    def __cycle_bucket(self, key: int) -> int:
+        cycle_len = self.num_buckets // gcd(self.step, self.num_buckets)
+        start, pos = divmod(key, cycle_len)
+        return (start + pos * self.step) % self.num_buckets
+
+    def __rotations(self, counts: Dict[int, int]) -> Dict[int, int]:
+        # for every cycle (by its first cycle key), how far into it placing records in probe order has
+        # to start so that it ends without wrapping around: wrapped records would be stored behind
+        # records closer to their home, which Robin Hood lookups take as the end of the search.
+        # That is right after the lowest point of records minus slots summed along the cycle.
+        cycle_len = self.num_buckets // gcd(self.step, self.num_buckets)
+        rotations = {}
+        for first, keys in groupby(sorted(counts), key=lambda key: key - key % cycle_len):
+            total, low, start = 0, None, 0
+            for key in keys:
+                level = total - self.blocking_factor * (key - first) # summed up to the bucket before key
+                if key > first and (low is None or level < low):
+                    low, start = level, key - first
+                total += counts[key]
+            if low is None or total - self.blocking_factor * cycle_len <= low:
+                start = 0
+            rotations[first] = start
+        return rotations
+
+    def __place(self, counts: Dict[int, int], unrotate: Callable[[int], int] = lambda key: key) -> Dict[int, List[Tuple[int, int, int]]]:
+        # replays inserting the records cycle by cycle in probe order and returns, for every
+        # home bucket (as cycle key), the (bucket_idx, rec_idx, count) runs its records land in;
+        # unrotate maps the keys back when the cycles were rotated to start elsewhere
+        cycle_len = self.num_buckets // gcd(self.step, self.num_buckets)
+        homes = sorted(counts)
+        segments = {}
+        i = 0
+        while i < len(homes):
+            first = homes[i] - homes[i] % cycle_len
+            end = first + cycle_len
+            used = {}
+            carry = deque() # [home key, records left], oldest first
+            key = first
+            wrapped = False
+            while True:
+                if not carry:
+                    if wrapped or i == len(homes) or homes[i] >= end:
+                        break
+                    key = homes[i]
+                if key == end:
+                    if wrapped: # no free slot left in this cycle
+                        break
+                    wrapped = True
+                    key = first
+                    continue
+                if i < len(homes) and homes[i] == key:
+                    carry.append([key, counts[key]])
+                    i += 1
+                free = self.blocking_factor - used.get(key, 0)
+                while carry and free:
+                    home = carry[0]
+                    n = min(home[1], free)
+                    segments.setdefault(home[0], []).append((self.__cycle_bucket(unrotate(key)), self.blocking_factor - free, n))
+                    free -= n
+                    home[1] -= n
+                    if home[1] == 0:
+                        carry.popleft()
+                used[key] = self.blocking_factor - free
+                key += 1
+            while i < len(homes) and homes[i] < end:
+                i += 1
+        return segments
+
+    @timed
+    @indexed
+    def bulk_load(self, records: Iterable[Dict], memory_records: int = 100000) -> int:
+        # builds the file from scratch with the layout inserting the records in probe order
+        # would produce: slots are computed from per-bucket counts, records are sorted by
+        # their final slot (spilling to temporary files when needed) and written sequentially
+        bf = self.blocking_factor
+        empty_block = self.encode_block(bf * [self.empty_record])
+        max_displacement = 0
+        longest = 1 # buckets read to reach the farthest record
+        unplaced = 0 # records for which the probe sequence of their key has no free slot left
+        with ExternalSorter(self.codec, memory_records) as sorter, ExternalSorter(self.codec, memory_records) as placed:
+            if self.double_hashing:
+                # every key probes differently: replay the inserts in bucket order on per-bucket counts
+                for record in records:
+                    record['status'] = 1
+                    sorter.add(self.hash(record.get('id')), record)
+                counts = [0] * self.num_buckets
+                for bucket_idx, group in self._unique_groups(sorter):
+                    for record in group:
+                        step = self.__step(record.get('id'))
+                        curr_idx = bucket_idx
+                        probes = 1
+                        while counts[curr_idx] == bf:
+                            curr_idx = (curr_idx + step) % self.num_buckets
+                            probes += 1
+                            if curr_idx == bucket_idx: # completely filled file
+                                break
+                        if counts[curr_idx] < bf:
+                            placed.add(curr_idx * bf + counts[curr_idx], record)
+                            counts[curr_idx] += 1
+                            longest = max(longest, probes)
+                        else:
+                            unplaced += 1
+                total = sum(counts) + unplaced
+            else:
+                for record in records:
+                    record['status'] = 1
+                    sorter.add(self.__cycle_key(self.hash(record.get('id'))), record)
+                counts = {key: len(group) for key, group in self._unique_groups(sorter)}
+                cycle_len = self.num_buckets // gcd(self.step, self.num_buckets)
+                rotations = self.__rotations(counts) if self.robin_hood else {}
+
+                def rotate(key: int, sign: int = 1) -> int:
+                    first = key - key % cycle_len
+                    return first + (key - first - sign * rotations.get(first, 0)) % cycle_len
+
+                segments = self.__place({rotate(key): n for key, n in counts.items()}, lambda key: rotate(key, -1))
+                # a probe cycle holds no more records than its slots, whatever the other cycles hold
+                total = sum(counts.values())
+                unplaced = total - sum(n for runs in segments.values() for _, _, n in runs)
+                for key, group in self._unique_groups(sorter):
+                    remaining = iter(group)
+                    runs = segments.get(rotate(key), ())
+                    for bucket_idx, rec_idx, n in runs:
+                        for i in range(n):
+                            placed.add(bucket_idx * bf + rec_idx + i, next(remaining))
+                    if runs:
+                        longest = max(longest, (self.__cycle_key(runs[-1][0]) - key) % cycle_len + 1)
+                if self.robin_hood:
+                    max_displacement = longest - 1
+            if unplaced:
+                if self._bloom is not None and os.path.exists(self.filename): # refilled with the new records
+                    self.rebuild_bloom()
+                raise ValueError(f"{unplaced} of {total} records do not fit into {self.num_buckets} buckets of {bf} records with step {self.step}")
+
+            def buckets():
+                next_idx = 0
+                for bucket_idx, group in groupby(placed, key=lambda pair: pair[0] // bf):
+                    for _ in range(next_idx, bucket_idx):
+                        yield empty_block
+                    block = [record for _, record in group]
+                    yield self.encode_block(block + (bf - len(block)) * [self.empty_record])
+                    next_idx = bucket_idx + 1
+                for _ in range(next_idx, self.num_buckets):
+                    yield empty_block
+
+            self._create_file()
+            self._write_sequential(chain(self.__header_block(max_displacement), buckets()))
+            self._set_counters(len(placed), 0, longest)
+            return len(placed)
+
+    def _zones(self) -> List[Tuple[int, int, int, int]]:
+        return [(self.data_offset, self.data_offset + self.num_buckets * self.block_size, self.block_size, 0)]
+
+    def _home_zones(self) -> Tuple[Optional[Tuple[int, int, int, int]], List[Tuple[int, int, int, int]]]:
+        return None, self._zones()
+
+    def _home_groups(self, memory_records: int = 100000) -> Iterator[Tuple[int, List[Dict]]]:
+        if self.step != 1 or self.double_hashing: # probe sequences do not follow the file
+            return super()._home_groups(memory_records)
+        return self.__run_groups()
+
+    def __run_groups(self) -> Iterator[Tuple[int, List[Dict]]]:
+        # records lie between their home and the first bucket with an empty slot after it, so
+        # the buckets up to such a bucket hold all records of their homes; records of the last
+        # probe run that wrapped around to the start of the file are kept until the end
+        pending: Dict[int, List[Dict]] = {}
+        wrapped = []
+        for bucket_idx, _, block in self._scan_blocks(*self._zones()[0]):
+            for rec in block:
+                if rec.get('status') == 1:
+                    home = self.hash(rec.get('id'))
+                    (wrapped if home > bucket_idx else pending.setdefault(home, [])).append(rec)
+            if any(rec.get('status') == 0 for rec in block):
+                yield from sorted(pending.items())
+                pending = {}
+        for rec in wrapped:
+            pending.setdefault(self.hash(rec.get('id')), []).append(rec)
+        yield from sorted(pending.items())
+
+    def _locate(self, id) -> Optional[Tuple[List[Dict], int, Callable[[], None]]]:
+        found, bucket_idx, rec_idx, bucket = self.__search(id)
+        return (bucket, rec_idx, lambda: self._write_bucket(bucket_idx, bucket)) if found else None
+
+    def _next_buckets(self, ids: 'np.ndarray', bucket_idx: 'np.ndarray') -> Optional['np.ndarray']:
+        import numpy as np
+        steps = self.step if not self.double_hashing else np.fromiter((self.__step(id) for id in ids.tolist()), dtype=np.int64, count=len(ids))
+        return (bucket_idx + steps) % self.num_buckets
+
+    def _check_fits(self, records: int, ids: Iterable):
+        if records > self.num_buckets * self.blocking_factor:
+            raise ValueError(f"{records} records do not fit into {self.num_buckets} buckets of {self.blocking_factor} records")
+        g = gcd(self.step, self.num_buckets)
+        if g > 1 and not self.double_hashing:
+            # a key only probes the buckets of its cycle, those congruent to its home modulo g
+            cycles = Counter(self.hash(id) % g for id in ids)
+            slots = self.num_buckets // g * self.blocking_factor
+            if max(cycles.values(), default=0) > slots:
+                raise ValueError(f"with step {self.step}, {max(cycles.values())} records share a probe cycle of {slots} slots")
+
+    def _options(self) -> Dict:
+        return {'step': self.step, 'double_hashing': self.double_hashing, 'robin_hood': self.robin_hood}
 
+    def _overflow_state(self) -> Dict:
+        if not self.robin_hood:
+            return {}
+        self.__load_header()
+        return {'max_displacement': self.max_displacement}
+
+    def _single_bucket(self, operation: str, id) -> bool:
+        bucket = self._read_bucket(self.hash(id))
+        if any(rec.get('status') == 0 for rec in bucket): # every probe sequence and backward shift ends here
+            return True
+        local = ('find_by_id', 'update_record', 'logical_delete_by_id') + (('delete_by_id',) if self.double_hashing else ())
+        return operation in local and any(rec.get('id') == id and rec.get('status') == 1 for rec in bucket)
+
+    def __displacement(self, id, bucket_idx: int) -> int:
+        # buckets between the home bucket of a key and bucket_idx along the probe sequence
+        if self.step == 1:
+            return (bucket_idx - self.hash(id)) % self.num_buckets
+        return self.__probe_length(id, bucket_idx) - 1
+
+    def __probe_length(self, id, bucket_idx: int) -> int:
+        # number of buckets read to reach a record stored in bucket_idx
+        home = self.hash(id)
+        if self.double_hashing:
+            return (bucket_idx - home) * pow(self.__step(id), -1, self.num_buckets) % self.num_buckets + 1
+        cycle_len = self.num_buckets // gcd(self.step, self.num_buckets)
+        return (self.__cycle_key(bucket_idx) - self.__cycle_key(home)) % cycle_len + 1
+
+    def structure_stats(self) -> Dict:
+        records, tombstones = 0, 0
+        probe_lengths = Counter()
+        for bucket_idx, _, block in self._scan_blocks(*self._zones()[0]):
+            for rec in block:
+                if rec.get('status') == 2:
+                    tombstones += 1
+                elif rec.get('status') == 1:
+                    records += 1
+                    probe_lengths[self.__probe_length(rec.get('id'), bucket_idx)] += 1
+        stats = {
+            'num_buckets': self.num_buckets,
+            'blocking_factor': self.blocking_factor,
+            'records': records,
+            'tombstones': tombstones,
+            'load_factor': records / (self.num_buckets * self.blocking_factor),
+            'probe_lengths': dict(sorted(probe_lengths.items())), # buckets read to find a record -> records
+            'longest_search': max(probe_lengths, default=1),
+        }
+        if self.robin_hood:
+            self.__load_header()
+            stats['max_displacement'] = self.max_displacement
+        return stats
+
+    @timed
     def find_by_id(self, id) -> Tuple[bool, int, int]:
+        return self.__search(id)[:3]
+
+    def __search(self, id) -> Tuple[bool, int, int, List[Dict]]:
+        # find_by_id, also returning the bucket the search ended in
         bucket_idx = self.hash(id)
+        if not self._might_contain(id): # no position, insert_record looks for a free slot itself
+            return False, bucket_idx, self.blocking_factor, []
+        step = self.__step(id)
+        if self.robin_hood:
+            self.__load_header()
         curr_idx = bucket_idx
-        with open(self.filename, "rb") as f:
-            while True:
-                f.seek(curr_idx * self.block_size)
-                bucket = self.read_block(f)
-                for rec_idx, rec in enumerate(bucket):
-                    if rec.get('status') == 0:
-                        return False, curr_idx, rec_idx
-                    if rec.get('id') == id:
-                        if rec.get('status') == 1:
-                            return True, curr_idx, rec_idx
-                        return False, curr_idx, rec_idx
-                curr_idx = (curr_idx + self.step) % self.num_buckets
-                if curr_idx == bucket_idx:
+        distance = 0
+        while True:
+            bucket = self._read_bucket(curr_idx)
+            for rec_idx, rec in enumerate(bucket):
+                if rec.get('status') == 0:
+                    return False, curr_idx, rec_idx, bucket
+                if rec.get('id') == id:
+                    return rec.get('status') == 1, curr_idx, rec_idx, bucket
+            if self.robin_hood:
+                # the key would have displaced any record closer to its home, and no record is further
+                # from its home than the header says
+                if distance == self.max_displacement or any(self.__displacement(rec.get('id'), curr_idx) < distance for rec in bucket):
                     break
-        return False, bucket_idx, self.blocking_factor
-    
+                distance += 1
+            curr_idx = (curr_idx + step) % self.num_buckets
+            if curr_idx == bucket_idx:
+                break
+        return False, bucket_idx, self.blocking_factor, []
+
+    def __first_free(self, id) -> Tuple[int, int]:
+        # first logically deleted or empty slot on the probe sequence of a key
+        bucket_idx = self.hash(id)
+        step = self.__step(id)
+        curr_idx = bucket_idx
+        while True:
+            bucket = self._read_bucket(curr_idx)
+            for rec_idx, rec in enumerate(bucket):
+                if rec.get('status') != 1:
+                    return curr_idx, rec_idx
+            curr_idx = (curr_idx + step) % self.num_buckets
+            if curr_idx == bucket_idx:
+                return bucket_idx, self.blocking_factor
+
+    def __robin_hood_insert(self, record: Dict) -> bool:
+        # walks the probe sequence with the record in hand; in a full bucket it swaps it for the record
+        # closest to its home if that one is closer than the record in hand, which then walks on.
+        # Changed buckets are only written once a free slot is reached, so a full file stays unchanged.
+        self.__load_header()
+        home = curr_idx = self.hash(record.get('id'))
+        distance = farthest = 0
+        changed = {}
+        while True:
+            bucket = self._read_bucket(curr_idx)
+            for rec_idx, rec in enumerate(bucket):
+                if rec.get('status') == 0:
+                    bucket[rec_idx] = record
+                    changed[curr_idx] = bucket
+                    for bucket_idx, bucket in changed.items():
+                        self._write_bucket(bucket_idx, bucket)
+                    if max(farthest, distance) > self.max_displacement:
+                        self.max_displacement = max(farthest, distance)
+                        self.__write_header()
+                    return True
+            displacements = [self.__displacement(rec.get('id'), curr_idx) for rec in bucket]
+            rec_idx = min(range(self.blocking_factor), key=displacements.__getitem__)
+            if displacements[rec_idx] < distance:
+                bucket[rec_idx], record = record, bucket[rec_idx]
+                changed[curr_idx] = bucket
+                farthest = max(farthest, distance)
+                distance = displacements[rec_idx]
+            curr_idx = (curr_idx + self.step) % self.num_buckets
+            distance += 1
+            if curr_idx == home: # completely filled file
+                return False
+
+    @timed
+    @indexed
     def insert_record(self, record: Dict) -> bool:
         id = record.get('id')
-        found, bucket_idx, rec_idx = self.find_by_id(id)
-        if found:
-            return False
+        new = not self._might_contain(id)
+        if not new:
+            found, bucket_idx, rec_idx = self.find_by_id(id)
+            if found:
+                return False
+        if self.robin_hood:
+            if new or rec_idx == self.blocking_factor or self._read_bucket(bucket_idx)[rec_idx].get('id') != id:
+                record['status'] = 1
+                if not self.__robin_hood_insert(record):
+                    return False
+                self._bloom_add(id)
+                self._count(1, 0, self.max_displacement + 1)
+                return True
+            # otherwise a logically deleted record of the key, which keeps its place
+        elif self.double_hashing or new:
+            # full buckets keep their tombstones, so new records reuse them
+            bucket_idx, rec_idx = self.__first_free(id)
         if rec_idx == self.blocking_factor: # completely filled file
             return False
         record['status'] = 1
-        with open(self.filename, "+rb") as f:
-            f.seek(bucket_idx * self.block_size)
-            bucket = self.read_block(f)
-            bucket[rec_idx] = record
-            f.seek(-self.block_size, 1)
-            self.write_block(f, bucket)
+        self._bloom_add(id)
+        bucket = self._read_bucket(bucket_idx)
+        self._count(1, -1 if bucket[rec_idx].get('status') == 2 else 0, self.__probe_length(id, bucket_idx))
+        bucket[rec_idx] = record
+        self._write_bucket(bucket_idx, bucket)
         return True
-    
+
+    @timed
+    @indexed
     def update_record(self, record: Dict) -> bool:
         id = record.get('id')
         found, bucket_idx, rec_idx = self.find_by_id(id)
         if not found:
             return False
         record['status'] = 1
-        with open(self.filename, "+rb") as f:
-            f.seek(bucket_idx * self.block_size)
-            bucket = self.read_block(f)
-            bucket[rec_idx] = record
-            f.seek(-self.block_size, 1)
-            self.write_block(f, bucket)
+        bucket = self._read_bucket(bucket_idx)
+        bucket[rec_idx] = record
+        self._write_bucket(bucket_idx, bucket)
         return True
-    
+
+    @timed
+    @indexed
     def logical_delete_by_id(self, id: int) -> bool:
         found, bucket_idx, rec_idx = self.find_by_id(id)
         if not found:
             return False
-        with open(self.filename, "+rb") as f:
-            f.seek(bucket_idx * self.block_size)
-            bucket = self.read_block(f)
-            bucket[rec_idx]['status'] = 2
-            f.seek(-self.block_size, 1)
-            self.write_block(f, bucket)
+        bucket = self._read_bucket(bucket_idx)
+        bucket[rec_idx]['status'] = 2
+        self._write_bucket(bucket_idx, bucket)
+        self._count(-1, 1)
         return True
-    
+
+    def __robin_hood_shift(self, bucket_idx: int, rec_idx: int):
+        # removes a record and fills the hole with the record of the next bucket furthest from its home,
+        # as long as the bucket was full and the next one holds a record that is not at home; that
+        # keeps the records in the order of their home buckets. The header bound is left as it is.
+        first = bucket_idx
+        bucket = self._read_bucket(bucket_idx)
+        while True:
+            full = bucket[-1].get('status') != 0
+            del bucket[rec_idx]
+            bucket.append(self.empty_record)
+            next_idx = (bucket_idx + self.step) % self.num_buckets
+            if not full or next_idx == first:
+                break
+            next_bucket = self._read_bucket(next_idx)
+            displacements = [self.__displacement(rec.get('id'), next_idx) if rec.get('status') != 0 else 0 for rec in next_bucket]
+            rec_idx = max(range(self.blocking_factor), key=displacements.__getitem__)
+            if displacements[rec_idx] == 0:
+                break
+            bucket[-1] = next_bucket[rec_idx]
+            self._write_bucket(bucket_idx, bucket)
+            bucket_idx, bucket = next_idx, next_bucket
+        self._write_bucket(bucket_idx, bucket)
+
+    @timed
+    @indexed
     def delete_by_id(self, id: int) -> bool:
         found, block_idx, rec_idx = self.find_by_id(id)
         if not found:
             return False
-        
-        with open(self.filename, "rb+") as f:
-            curr_blk_idx, curr_rec_idx = block_idx, rec_idx
-            done = False
-            while not done:
-                f.seek(curr_blk_idx * self.block_size)
-                block = self.read_block(f)
-                block[curr_rec_idx] = self.empty_record
-                for i in range(curr_rec_idx, self.blocking_factor-1):
-                    block[i] = block[i+1]
-                    if block[i].get('id') == self.empty_key:
+        if self.double_hashing:
+            # every key has its own probe sequence, so records cannot be shifted back into the hole; but
+            # no probe sequence passes a bucket that has an empty slot, and only there can a record be removed
+            block = self._read_bucket(block_idx)
+            if block[-1].get('status') == 0:
+                del block[rec_idx]
+                block.append(self.empty_record)
+                self._count(-1)
+            else:
+                block[rec_idx]['status'] = 2
+                self._count(-1, 1)
+            self._write_bucket(block_idx, block)
+            return True
+        self._count(-1)
+        if self.robin_hood:
+            self.__robin_hood_shift(block_idx, rec_idx)
+            return True
+
+        curr_blk_idx, curr_rec_idx = block_idx, rec_idx
+        done = False
+        while not done:
+            block = self._read_bucket(curr_blk_idx)
+            block[curr_rec_idx] = self.empty_record
+            for i in range(curr_rec_idx, self.blocking_factor-1):
+                block[i] = block[i+1]
+                if block[i].get('id') == self.empty_key:
+                    done = True
+            block[-1] = self.empty_record
+            if done:
+                break
+            # buckets between the hole and the candidate record; a record whose
+            # home bucket is among them would become unreachable if moved
+            passed_blocks = set()
+            moved = False
+            next_idx = (curr_blk_idx + self.step) % self.num_buckets
+            while next_idx != curr_blk_idx: # in a full file the scan comes all the way around to the hole
+                passed_blocks.add(next_idx)
+                next_block = self._read_bucket(next_idx)
+                next_rec_idx = None
+                for i, rec in enumerate(next_block):
+                    if rec.get('status') == 0:
                         done = True
-                block[-1] = self.empty_record
-                if done:
-                    break
-                seen_blocks = set()
-                seen_blocks.add(curr_blk_idx)
-                next_idx = (curr_blk_idx + self.step) % self.num_buckets
-                while next_idx != block_idx:
-                    seen_blocks.add(next_idx)
-                    f.seek(next_idx * self.block_size)
-                    next_block = self.read_block(f)
-                    next_rec_idx = None
-                    for i, rec in enumerate(next_block):
-                        if rec.get('status') == 0:
-                            done = True
-                            break
-                        if self.hash(rec.get('id')) not in seen_blocks:
-                            next_rec_idx = i
-                            break
-                    if done:
                         break
-                    if next_rec_idx != None:
-                        block[-1] = next_block[next_rec_idx]
-                        f.seek(curr_blk_idx * self.block_size)
-                        self.write_block(f, block)
-                        curr_blk_idx = next_idx
-                        curr_rec_idx = next_rec_idx
+                    if self.hash(rec.get('id')) not in passed_blocks:
+                        next_rec_idx = i
                         break
-                    next_idx = (next_idx + self.step) % self.num_buckets
-                if next_idx == block_idx:
+                if done:
+                    break
+                if next_rec_idx != None:
+                    block[-1] = next_block[next_rec_idx]
+                    self._write_bucket(curr_blk_idx, block)
+                    curr_blk_idx = next_idx
+                    curr_rec_idx = next_rec_idx
+                    moved = True
                     break
-            f.seek(curr_blk_idx * self.block_size)
-            self.write_block(f, block)
-    
+                next_idx = (next_idx + self.step) % self.num_buckets
+            if not moved:
+                break
+        self._write_bucket(curr_blk_idx, block)
+        return True
+
+    @timed
+    @indexed
+    def insert_many(self, records: List[Dict]) -> List[bool]:
+        results = [False] * len(records)
+        if self.double_hashing or self.robin_hood: # synonyms do not share a probe sequence, or move each other
+            with self._pinned():
+                for positions in self._group_by_bucket([rec.get('id') for rec in records]).values():
+                    for pos in positions:
+                        results[pos] = self.insert_record(records[pos])
+            return results
+        with self._pinned():
+            for bucket_idx, positions in self._group_by_bucket([rec.get('id') for rec in records]).items():
+                # all synonyms share the probe sequence: walk it once for the whole group
+                live, dead = {}, {}
+                free = self.__free_slots(bucket_idx, live, dead)
+                slot = None
+                for pos in positions:
+                    record = records[pos]
+                    id = record.get('id')
+                    if slot is None:
+                        slot = next(free, None)
+                    if id in live:
+                        continue
+                    if id in dead:
+                        target = dead.pop(id)
+                        self._count(0, -1)
+                    elif slot is not None:
+                        target, slot = slot, None
+                    else: # completely filled file
+                        continue
+                    record['status'] = 1
+                    self._write_record(*target, record)
+                    self._bloom_add(id)
+                    self._count(1, 0, self.__probe_length(id, target[0]))
+                    live[id] = target
+                    results[pos] = True
+        return results
+
+    @timed
+    @indexed
+    def update_many(self, records: List[Dict]) -> List[bool]:
+        results = [False] * len(records)
+        if self.double_hashing or self.robin_hood:
+            with self._pinned():
+                for positions in self._group_by_bucket([rec.get('id') for rec in records]).values():
+                    for pos in positions:
+                        results[pos] = self.update_record(records[pos])
+            return results
+        with self._pinned():
+            for bucket_idx, positions in self._group_by_bucket([rec.get('id') for rec in records]).items():
+                live = {}
+                next(self.__free_slots(bucket_idx, live, {}), None)
+                for pos in positions:
+                    record = records[pos]
+                    target = live.get(record.get('id'))
+                    if target is None:
+                        continue
+                    record['status'] = 1
+                    self._write_record(*target, record)
+                    results[pos] = True
+        return results
+
+    @timed
+    @indexed
+    def delete_many(self, ids: List[int]) -> List[bool]:
+        results = [False] * len(ids)
+        with self._pinned():
+            for positions in self._group_by_bucket(ids).values():
+                for pos in positions:
+                    results[pos] = self.delete_by_id(ids[pos])
+        return results
+
     def print_file(self):
-        with open(self.filename, "rb") as f:
-            for i in range(self.num_buckets):
-                print(f"BUCKET {i+1}:")
-                bucket = self.read_block(f)
-                for j, rec in enumerate(bucket):
-                    print(f"Record {j}:\t{rec}")
-                print()
\ No newline at end of file
+        for i in range(self.num_buckets):
+            print(f"BUCKET {i+1}:")
+            bucket = self._read_bucket(i)
+            for j, rec in enumerate(bucket):
+                print(f"Record {j}:\t{rec}")
+            print()
@@ -1,142 +1,327 @@
-from typing import Dict, BinaryIO, Tuple, Union
-from app.binary_file import BinaryFile
+import tempfile
+from collections import Counter
+from typing import Callable, Dict, Iterable, List, Optional, Tuple, Union
+from app.external_sort import ExternalSorter
+from app.hash_file import HashFile, indexed
+from app.hash_functions import division
 from app.record import Record
-import struct
+from app.stats import timed
 
 class Bucket:
     def __init__(self, header: Dict, block: list[Dict]):
         self.header = header
         self.block = block
 
-class HashFileLinkedOverflow(BinaryFile):
-    def __init__(self, filename: str, record: Record, num_buckets: int, blocking_factor: int, empty_record: Dict, empty_key: int = -1):
-        super().__init__(filename, record, blocking_factor, empty_record, empty_key)
-        self.num_buckets = num_buckets
+class HashFileLinkedOverflow(HashFile):
+    def __init__(self, filename: str, record: Record, num_buckets: int, blocking_factor: int, empty_record: Dict, empty_key: int = -1, buffer_size: int = 64, use_mmap: bool = False, overflow_blocking_factor: int = 1, hash_function: Callable = division):
+        super().__init__(filename, record, num_buckets, blocking_factor, empty_record, empty_key, buffer_size, use_mmap, hash_function)
         self.header_record = Record(['u'], 'i', 'ascii')
-        self.header_record_size = struct.calcsize(self.header_record.format)
+        self.header_record_size = self.header_record.struct.size
         self.primary_bucket_size = self.header_record_size + self.block_size
-        self.overflow_bucket_size = self.header_record_size + self.record_size # use blocking factor 1 for overflow zone
+        self.overflow_blocking_factor = overflow_blocking_factor
+        self.overflow_bucket_size = self.header_record_size + self.overflow_blocking_factor * self.record_size
 
-    def hash(self, id):
-        return id % self.num_buckets
+    def _encode_bucket(self, bucket: Bucket) -> bytearray:
+        binary_data = bytearray(self.header_record_size + len(bucket.block) * self.record_size)
+        self.header_record.struct.pack_into(binary_data, 0, bucket.header['u'])
+        self.codec.encode_into(binary_data, self.header_record_size, bucket.block)
+        return binary_data
 
-    def _write_header(self, file: BinaryIO, header: Dict):
-        binary_data = self.header_record.dict_to_encoded_values(header)
-        file.write(binary_data)
+    def _decode_bucket(self, binary_data: bytes) -> Bucket:
+        header = {'u': self.header_record.struct.unpack_from(binary_data, 0)[0]}
+        block = self.decode_block(binary_data, self.header_record_size)
+        return Bucket(header, block)
 
-    def _read_header(self, file: BinaryIO) -> Dict:
-        binary_data = file.read(self.header_record_size)
-        if len(binary_data) == 0:
-            return None
+    def _read_overflow_header(self) -> Dict:
+        binary_data = self._read_raw(self.num_buckets * self.primary_bucket_size, self.header_record_size)
         return self.header_record.encoded_tuple_to_dict(binary_data)
 
-    def _write_bucket(self, file: BinaryIO, bucket: Bucket):
-        self._write_header(file, bucket.header)
-        self.write_block(file, bucket.block)
+    def _write_overflow_header(self, header: Dict):
+        self._write_raw(self.num_buckets * self.primary_bucket_size, self.header_record.dict_to_encoded_values(header))
 
-    def _read_primary_bucket(self, file: BinaryIO) -> Bucket:
-        header = self._read_header(file)
-        if header is None:
+    def _read_primary_bucket(self, bucket_idx: int) -> Bucket:
+        binary_data = self._read_raw(bucket_idx * self.primary_bucket_size, self.primary_bucket_size)
+        if binary_data is None:
             return None
-        block = self.read_block(file)
-        return Bucket(header, block)
-    
-    def _read_overflow_bucket(self, file: BinaryIO) -> Bucket:
-        header = self._read_header(file)
-        if header is None:
+        return self._decode_bucket(binary_data)
+
+    def _write_primary_bucket(self, bucket_idx: int, bucket: Bucket):
+        self._write_raw(bucket_idx * self.primary_bucket_size, self._encode_bucket(bucket))
+
+    def _read_overflow_bucket(self, bucket_idx: int) -> Bucket:
+        binary_data = self._read_raw(self.__calc_overflow_bucket_position(bucket_idx), self.overflow_bucket_size)
+        if binary_data is None:
             return None
-        binary_data = file.read(self.record_size)
-        record = self.record.encoded_tuple_to_dict(binary_data)
-        return Bucket(header, [record])
-    
+        return self._decode_bucket(binary_data)
+
+    def _write_overflow_bucket(self, bucket_idx: int, bucket: Bucket):
+        self._write_raw(self.__calc_overflow_bucket_position(bucket_idx), self._encode_bucket(bucket))
+
     def __calc_overflow_bucket_position(self, bucket_idx: int) -> int:
         return self.num_buckets*self.primary_bucket_size + self.header_record_size + (bucket_idx-self.num_buckets)*self.overflow_bucket_size
 
-    def init_file(self):
-        with open(self.filename, "wb") as f:
-            # primary zone
-            for _ in range(self.num_buckets):
-                bucket = Bucket({'u':-1}, self.blocking_factor*[self.empty_record])
-                self._write_bucket(f, bucket)
-            # overflow zone
-            self._write_header(f, {'u': -1}) # help struct E (pointer to first free location in overflow zone)
+    def __iter_chain(self, bucket: Bucket):
+        # yields (bucket_idx, bucket) for every overflow bucket linked from the given bucket
+        bucket_idx = bucket.header.get('u')
+        while bucket_idx != -1:
+            bucket = self._read_overflow_bucket(bucket_idx)
+            yield bucket_idx, bucket
+            bucket_idx = bucket.header.get('u')
 
-    def find_by_id(self, id) -> Union[Tuple[int, int], None]:
-        bucket_idx = self.hash(id)
-        with open(self.filename, "rb") as f:
-            # primary bucket
-            f.seek(bucket_idx * self.primary_bucket_size)
-            bucket = self._read_primary_bucket(f)
-            for rec_idx, rec in enumerate(bucket.block):
-                if rec.get('id') == id and rec.get('status') == 1:
-                    return bucket_idx, rec_idx
-                if rec.get('id') == self.empty_key:
-                    return None
-            # overflow zone
-            while True:
-                bucket_idx = bucket.header.get('u')
-                if bucket_idx == -1:
-                    break
-                f.seek(self.__calc_overflow_bucket_position(bucket_idx))
-                bucket = self._read_overflow_bucket(f)
-                if bucket.block[0].get('id') == id:
-                    return bucket_idx, 0
-                
-    def insert_record(self, record) -> bool:
-        id = record.get('id')
-        find_res = self.find_by_id(id)
-        if find_res is not None:
-            return False
-        bucket_idx = self.hash(id)
-        record['status'] = 1
+    def __allocate_overflow_bucket(self, record: Dict, link: int) -> int:
+        overflow_header = self._read_overflow_header()
+        if overflow_header['u'] == -1:
+            # no free buckets in overflow zone: add new bucket
+            pos_in_overflow = self._file_end() - self.num_buckets*self.primary_bucket_size - self.header_record_size
+            new_idx = self.num_buckets + pos_in_overflow // self.overflow_bucket_size
+            self._write_overflow_bucket(new_idx, Bucket({'u': link}, [record] + (self.overflow_blocking_factor - 1) * [self.empty_record]))
+        else:
+            # add to first free bucket in overflow zone
+            new_idx = overflow_header['u']
+            new_bucket = self._read_overflow_bucket(new_idx)
+
+            overflow_header['u'] = new_bucket.header.get('u')
+
+            new_bucket.header['u'] = link
+            new_bucket.block = [record] + (self.overflow_blocking_factor - 1) * [self.empty_record]
+            self._write_overflow_bucket(new_idx, new_bucket)
+
+            self._write_overflow_header(overflow_header)
+        return new_idx
 
-        with open(self.filename, "rb+") as f:
-            # primary zone
-            f.seek(bucket_idx * self.primary_bucket_size)
-            bucket = self._read_primary_bucket(f)
-            for rec_idx, rec in enumerate(bucket.block[:]):
+    def __push_to_chain(self, bucket: Bucket, record: Dict) -> bool:
+        # only the first bucket of a chain may have free slots: it is filled before a new one is linked in front of it;
+        # returns whether the chain got longer
+        head_idx = bucket.header.get('u')
+        if head_idx != -1:
+            head = self._read_overflow_bucket(head_idx)
+            for rec_idx, rec in enumerate(head.block):
                 if rec.get('id') == self.empty_key:
-                    bucket.block[rec_idx] = record
-                    f.seek(bucket_idx * self.primary_bucket_size)
-                    self._write_bucket(f, bucket)
-                    return True
+                    head.block[rec_idx] = record
+                    self._write_overflow_bucket(head_idx, head)
+                    return False
+        bucket.header['u'] = self.__allocate_overflow_bucket(record, head_idx)
+        return True
+
+    def __pop_from_chain(self, bucket: Bucket) -> Tuple[Dict, int, int]:
+        # removes the last record of the first bucket of a chain, returning the bucket to the free
+        # list once it is empty; returns the record together with the position it was taken from
+        head_idx = bucket.header.get('u')
+        head = self._read_overflow_bucket(head_idx)
+        last = max(i for i, rec in enumerate(head.block) if rec.get('id') != self.empty_key)
+        record = head.block[last]
+        head.block[last] = self.empty_record
+        if last == 0:
+            overflow_header = self._read_overflow_header()
+            bucket.header['u'] = head.header.get('u')
+            head.header['u'] = overflow_header.get('u')
+            overflow_header['u'] = head_idx
+            self._write_overflow_header(overflow_header)
+        self._write_overflow_bucket(head_idx, head)
+        return record, head_idx, last
+
+    @timed
+    @indexed
+    def init_file(self):
+        self._create_file()
+        self._clear_bloom()
+        # primary zone
+        bucket = self._encode_bucket(Bucket({'u':-1}, self.blocking_factor*[self.empty_record]))
+        self._write_sequential(bucket for _ in range(self.num_buckets))
+        # overflow zone
+        self._write_overflow_header({'u': -1}) # help struct E (pointer to first free location in overflow zone)
+        self.flush()
+        self._set_counters(0)
+
+    @timed
+    @indexed
+    def bulk_load(self, records: Iterable[Dict], memory_records: int = 100000) -> int:
+        # builds the file from scratch: records are sorted by bucket (spilling to temporary
+        # files when needed), then the primary zone and the chains are written sequentially
+        bf = self.blocking_factor
+        obf = self.overflow_blocking_factor
+        empty_bucket = self._encode_bucket(Bucket({'u': -1}, bf * [self.empty_record]))
+        loaded = 0
+        longest = 1
+        with ExternalSorter(self.codec, memory_records) as sorter, tempfile.TemporaryFile() as overflow:
+            for record in records:
+                record['status'] = 1
+                sorter.add(self.hash(record.get('id')), record)
 
-            # overflow zone
-            f.seek(self.num_buckets * self.primary_bucket_size)
-            overflow_header = self._read_header(f)
-            if overflow_header['u'] == -1:
-                # no free buckets in overflow zone: add new bucket
-                f.seek(0, 2) # end of file
+            def primary_zone():
+                nonlocal loaded, longest
+                next_idx = 0
+                overflow_idx = self.num_buckets # index of the next overflow bucket
+                for bucket_idx, group in self._unique_groups(sorter):
+                    for _ in range(next_idx, bucket_idx):
+                        yield empty_bucket
+                    chain = group[bf:]
+                    link = overflow_idx if chain else -1
+                    yield self._encode_bucket(Bucket({'u': link}, group[:bf] + (bf - len(group[:bf])) * [self.empty_record]))
+                    # only the first bucket of the chain may be partially filled
+                    first = len(chain) % obf or obf
+                    blocks = [chain[i:i + obf] for i in range(first, len(chain), obf)]
+                    if chain:
+                        blocks.insert(0, chain[:first])
+                    longest = max(longest, 1 + len(blocks))
+                    for i, block in enumerate(blocks):
+                        link = overflow_idx + 1 if i < len(blocks) - 1 else -1
+                        overflow.write(self._encode_bucket(Bucket({'u': link}, block + (obf - len(block)) * [self.empty_record])))
+                        overflow_idx += 1
+                    loaded += len(group)
+                    next_idx = bucket_idx + 1
+                for _ in range(next_idx, self.num_buckets):
+                    yield empty_bucket
+                yield self.header_record.dict_to_encoded_values({'u': -1})
 
-                pos_in_overflow = f.tell() - self.num_buckets*self.primary_bucket_size - self.header_record_size
-                new_idx = self.num_buckets + pos_in_overflow // self.overflow_bucket_size
+            def overflow_zone():
+                overflow.seek(0)
+                chunk = overflow.read(1024 * self.overflow_bucket_size)
+                while chunk:
+                    yield chunk
+                    chunk = overflow.read(1024 * self.overflow_bucket_size)
 
-                new_bucket = Bucket({'u': bucket.header['u']}, [record])
-                self._write_bucket(f, new_bucket)
+            self._create_file()
+            self._write_sequential(primary_zone())
+            self._write_sequential(overflow_zone(), self.overflow_bucket_size)
+        self._set_counters(loaded, 0, longest)
+        return loaded
 
-                bucket.header['u'] = new_idx
-            else:
-                # add to first free bucket in overflow zone
-                new_idx = overflow_header['u']
-                f.seek((new_idx-self.num_buckets) * self.overflow_bucket_size, 1)
-                new_bucket = self._read_overflow_bucket(f)
+    def _zones(self) -> List[Tuple[int, int, int, int]]:
+        primary_end = self.num_buckets * self.primary_bucket_size
+        return [(0, primary_end, self.primary_bucket_size, self.header_record_size),
+                (primary_end + self.header_record_size, self._file_end(), self.overflow_bucket_size, self.header_record_size)]
 
-                overflow_header['u'] = new_bucket.header.get('u')
+    def _locate(self, id) -> Optional[Tuple[List[Dict], int, Callable[[], None]]]:
+        found = self.__search(id)
+        if found is None:
+            return None
+        bucket_idx, rec_idx, bucket = found
+        write = self._write_primary_bucket if bucket_idx < self.num_buckets else self._write_overflow_bucket
+        return bucket.block, rec_idx, lambda: write(bucket_idx, bucket)
 
-                new_bucket.header['u'] = bucket.header['u']
-                new_bucket.block[0] = record
-                f.seek(-self.overflow_bucket_size, 1)
-                self._write_bucket(f, new_bucket)
+    def _header_record(self) -> Optional[Record]:
+        return self.header_record
 
-                f.seek(self.num_buckets * self.primary_bucket_size)
-                self._write_header(f, overflow_header)
+    def _continues(self, blocks: 'np.ndarray') -> 'np.ndarray':
+        return super()._continues(blocks) & (blocks['header']['u'] != -1)
 
-                bucket.header['u'] = new_idx
+    def _options(self) -> Dict:
+        return {'overflow_blocking_factor': self.overflow_blocking_factor}
 
-            f.seek(bucket_idx * self.primary_bucket_size)
-            self._write_bucket(f, bucket)
+    def _overflow_state(self) -> Dict:
+        # new overflow buckets are taken from the free list, or appended at the end of the file when it is empty
+        overflow_end = self._file_end() - self.num_buckets * self.primary_bucket_size - self.header_record_size
+        return {'overflow_buckets': overflow_end // self.overflow_bucket_size, 'free_overflow_head': self._read_overflow_header()['u']}
+
+    def _single_bucket(self, operation: str, id) -> bool:
+        # overflow buckets are allocated from and returned to a free list shared by all chains
+        bucket = self._read_primary_bucket(self.hash(id))
+        if bucket.header.get('u') == -1:
+            return operation != 'insert_record' or bucket.block[-1].get('id') == self.empty_key
+        return operation in ('find_by_id', 'update_record') and any(rec.get('id') == id and rec.get('status') == 1 for rec in bucket.block)
+
+    def structure_stats(self) -> Dict:
+        records = 0
+        heads = []
+        primary_end = self.num_buckets * self.primary_bucket_size
+        for _, header, block in self._scan_blocks(0, primary_end, self.primary_bucket_size, self.header_record_size):
+            heads.append(self.header_record.struct.unpack(header)[0])
+            records += sum(1 for rec in block if rec.get('status') == 1)
+        links = {} # overflow bucket_idx -> next bucket_idx in its chain or in the free list
+        overflow_records = 0
+        overflow_start = primary_end + self.header_record_size
+        for i, header, block in self._scan_blocks(overflow_start, self._file_end(), self.overflow_bucket_size, self.header_record_size):
+            links[self.num_buckets + i] = self.header_record.struct.unpack(header)[0]
+            overflow_records += sum(1 for rec in block if rec.get('status') == 1)
+
+        def chain_length(bucket_idx: int) -> int:
+            length = 0
+            while bucket_idx != -1:
+                length += 1
+                bucket_idx = links[bucket_idx]
+            return length
+
+        return {
+            'num_buckets': self.num_buckets,
+            'blocking_factor': self.blocking_factor,
+            'overflow_blocking_factor': self.overflow_blocking_factor,
+            'records': records + overflow_records,
+            'tombstones': 0,
+            'load_factor': (records + overflow_records) / (self.num_buckets * self.blocking_factor),
+            'overflow_buckets': len(links),
+            'free_overflow_buckets': chain_length(self._read_overflow_header()['u']),
+            'overflow_records': overflow_records,
+            'chain_lengths': dict(sorted(Counter(chain_length(head) for head in heads).items())), # overflow buckets in a chain -> chains
+            'longest_search': 1 + max((chain_length(head) for head in heads), default=0),
+        }
+
+    @timed
+    def find_by_id(self, id) -> Union[Tuple[int, int], None]:
+        found = self.__search(id)
+        return found[:2] if found is not None else None
+
+    def __search(self, id) -> Optional[Tuple[int, int, Bucket]]:
+        # find_by_id, also returning the bucket holding the record
+        if not self._might_contain(id):
+            return None
+        bucket_idx = self.hash(id)
+        # primary bucket
+        bucket = self._read_primary_bucket(bucket_idx)
+        for rec_idx, rec in enumerate(bucket.block):
+            if rec.get('id') == id and rec.get('status') == 1:
+                return bucket_idx, rec_idx, bucket
+            if rec.get('id') == self.empty_key:
+                return None
+        # overflow zone
+        while True:
+            bucket_idx = bucket.header.get('u')
+            if bucket_idx == -1:
+                break
+            bucket = self._read_overflow_bucket(bucket_idx)
+            for rec_idx, rec in enumerate(bucket.block):
+                if rec.get('id') == id:
+                    return bucket_idx, rec_idx, bucket
+
+    @timed
+    @indexed
+    def insert_record(self, record) -> bool:
+        id = record.get('id')
+        bucket_idx = self.hash(id)
+        bucket = self._read_primary_bucket(bucket_idx)
+        full = bucket.block[-1].get('id') != self.empty_key
+        length = None # overflow buckets in the chain, if it was walked
+        if self._might_contain(id):
+            # the search of find_by_id, keeping the length of the chain
+            if any(rec.get('id') == id and rec.get('status') == 1 for rec in bucket.block):
+                return False
+            if full:
+                chain = [overflow_bucket for _, overflow_bucket in self.__iter_chain(bucket)]
+                if any(rec.get('id') == id for overflow_bucket in chain for rec in overflow_bucket.block):
+                    return False
+                length = len(chain)
+        record['status'] = 1
+        self._bloom_add(id)
+
+        # primary zone
+        if not full:
+            rec_idx = next(i for i, rec in enumerate(bucket.block) if rec.get('id') == self.empty_key)
+            bucket.block[rec_idx] = record
+            self._write_primary_bucket(bucket_idx, bucket)
+            self._count(1)
             return True
-        
+
+        # overflow zone
+        grown = self.__push_to_chain(bucket, record)
+        self._write_primary_bucket(bucket_idx, bucket)
+        if length is not None:
+            self._count(1, 0, 1 + length + grown)
+        else: # the Bloom filter saved walking the chain
+            self._count(1, 0, grown=grown)
+        return True
+
+    @timed
+    @indexed
     def update_record(self, record) -> bool:
         id = record.get('id')
         find_res = self.find_by_id(id)
@@ -144,81 +329,41 @@ class HashFileLinkedOverflow(BinaryFile):
             return False
         bucket_idx, rec_idx = find_res
         record['status'] = 1
-        with open(self.filename, "rb+") as f:
-            if bucket_idx < self.num_buckets: # primary
-                f.seek(bucket_idx * self.primary_bucket_size)
-                bucket = self._read_primary_bucket(f)
-                bucket.block[rec_idx] = record
-                f.seek(-self.primary_bucket_size, 1)
-                self._write_bucket(f, bucket)
-            else: # overflow
-                f.seek(self.__calc_overflow_bucket_position(bucket_idx))
-                bucket = self._read_overflow_bucket(f)
-                bucket.block[0] = record
-                f.seek(-self.overflow_bucket_size, 1)
-                self._write_bucket(f, bucket)
+        if bucket_idx < self.num_buckets: # primary
+            bucket = self._read_primary_bucket(bucket_idx)
+            bucket.block[rec_idx] = record
+            self._write_primary_bucket(bucket_idx, bucket)
+        else: # overflow
+            bucket = self._read_overflow_bucket(bucket_idx)
+            bucket.block[rec_idx] = record
+            self._write_overflow_bucket(bucket_idx, bucket)
         return True
-    
+
     def __delete_primary(self, bucket_idx: int, rec_idx: int):
-        with open(self.filename, "rb+") as f:
-            f.seek(bucket_idx * self.primary_bucket_size)
-            bucket = self._read_primary_bucket(f)
-            for i, rec in enumerate(bucket.block[rec_idx+1:]):
-                bucket.block[rec_idx+i] = bucket.block[rec_idx+i+1]
-                if rec.get('id') == self.empty_key:
-                    break
-            overflow_bucket_idx = bucket.header.get('u')
-            if overflow_bucket_idx == -1: # no overflow records
-                bucket.block[-1] = self.empty_record
-            else:
-                f.seek(self.__calc_overflow_bucket_position(overflow_bucket_idx))
-                overflow_bucket = self._read_overflow_bucket(f)
-                f.seek(self.num_buckets * self.primary_bucket_size)
-                overflow_header = self._read_header(f)
-
-                bucket.header['u'] = overflow_bucket.header.get('u')
-                overflow_bucket.header['u'] = overflow_header.get('u')
-                overflow_header['u'] = overflow_bucket_idx
-
-                bucket.block[-1] = overflow_bucket.block[0]
-                overflow_bucket.block[0] = self.empty_record
-
-                f.seek(self.__calc_overflow_bucket_position(overflow_bucket_idx))
-                self._write_bucket(f, overflow_bucket)
-                f.seek(self.num_buckets * self.primary_bucket_size)
-                self._write_header(f, overflow_header)
-            f.seek(bucket_idx * self.primary_bucket_size)
-            self._write_bucket(f, bucket)
-
-    def __delete_overflow(self, id, bucket_idx):
-        with open(self.filename, "rb+") as f:
-            f.seek(self.hash(id) * self.primary_bucket_size)
-            primary_bucket = self._read_primary_bucket(f)
-            f.seek(self.__calc_overflow_bucket_position(bucket_idx))
-            bucket = self._read_overflow_bucket(f)
-            f.seek(self.num_buckets * self.primary_bucket_size)
-            overflow_header = self._read_header(f)
-            first_idx = primary_bucket.header.get('u')
-            f.seek(self.__calc_overflow_bucket_position(first_idx))
-            first_bucket = self._read_overflow_bucket(f)
-
-            # swap bucket contents with first bucket contents and remove first bucket
-            bucket.block[0] = first_bucket.block[0]
-            first_bucket.block[0] = self.empty_record
-
-            primary_bucket.header['u'] = first_bucket.header.get('u')
-            first_bucket.header['u'] = overflow_header.get('u')
-            overflow_header['u'] = first_idx
-
-            f.seek(self.hash(id) * self.primary_bucket_size)
-            self._write_bucket(f, primary_bucket)
-            f.seek(self.__calc_overflow_bucket_position(bucket_idx))
-            self._write_bucket(f, bucket)
-            f.seek(self.num_buckets * self.primary_bucket_size)
-            self._write_header(f, overflow_header)
-            f.seek(self.__calc_overflow_bucket_position(first_idx))
-            self._write_bucket(f, first_bucket)
+        bucket = self._read_primary_bucket(bucket_idx)
+        for i, rec in enumerate(bucket.block[rec_idx+1:]):
+            bucket.block[rec_idx+i] = bucket.block[rec_idx+i+1]
+            if rec.get('id') == self.empty_key:
+                break
+        if bucket.header.get('u') == -1: # no overflow records
+            bucket.block[-1] = self.empty_record
+        else:
+            bucket.block[-1], _, _ = self.__pop_from_chain(bucket)
+        self._write_primary_bucket(bucket_idx, bucket)
+
+    def __delete_overflow(self, id, bucket_idx: int, rec_idx: int):
+        primary_idx = self.hash(id)
+        primary_bucket = self._read_primary_bucket(primary_idx)
+        # fill the hole with the last record of the first bucket of the chain
+        record, head_idx, last = self.__pop_from_chain(primary_bucket)
+        if (head_idx, last) != (bucket_idx, rec_idx):
+            bucket = self._read_overflow_bucket(bucket_idx)
+            bucket.block[rec_idx] = record
+            self._write_overflow_bucket(bucket_idx, bucket)
+        self._write_primary_bucket(primary_idx, primary_bucket)
 
+    @timed
+    @indexed
     def delete_by_id(self, id) -> bool:
         find_res = self.find_by_id(id)
         if find_res is None:
@@ -226,29 +371,114 @@ class HashFileLinkedOverflow(BinaryFile):
         bucket_idx, rec_idx = find_res
         if bucket_idx < self.num_buckets:
             self.__delete_primary(bucket_idx, rec_idx)
-        else: 
-            self.__delete_overflow(id, bucket_idx)
+        else:
+            self.__delete_overflow(id, bucket_idx, rec_idx)
+        self._count(-1)
         return True
-            
+
+    @timed
+    @indexed
+    def insert_many(self, records: List[Dict]) -> List[bool]:
+        results = [False] * len(records)
+        longest_growth = 0 # the most a chain that was not walked got longer by
+        with self._pinned():
+            for bucket_idx, positions in self._group_by_bucket([rec.get('id') for rec in records]).items():
+                # read the primary bucket and walk its chain once for the whole group
+                bucket = self._read_primary_bucket(bucket_idx)
+                existing = {rec.get('id') for rec in bucket.block if rec.get('status') == 1}
+                length = None # overflow buckets in the chain, if it was walked
+                if any(self._might_contain(records[pos].get('id')) for pos in positions):
+                    chain = [overflow_bucket for _, overflow_bucket in self.__iter_chain(bucket)]
+                    existing.update(rec.get('id') for overflow_bucket in chain for rec in overflow_bucket.block)
+                    length = len(chain)
+                unread_growth = 0
+                dirty = False
+                for pos in positions:
+                    record = records[pos]
+                    if record.get('id') in existing:
+                        continue
+                    existing.add(record.get('id'))
+                    record['status'] = 1
+                    self._bloom_add(record.get('id'))
+                    free = next((i for i, rec in enumerate(bucket.block) if rec.get('id') == self.empty_key), None)
+                    if free is not None:
+                        bucket.block[free] = record
+                        self._count(1)
+                    else:
+                        grown = self.__push_to_chain(bucket, record)
+                        if length is not None:
+                            length += grown
+                            self._count(1, 0, 1 + length)
+                        else:
+                            self._count(1)
+                            unread_growth += grown
+                    results[pos] = True
+                    dirty = True
+                if dirty:
+                    self._write_primary_bucket(bucket_idx, bucket)
+                longest_growth = max(longest_growth, unread_growth)
+            self._count(grown=longest_growth)
+        return results
+
+    @timed
+    @indexed
+    def update_many(self, records: List[Dict]) -> List[bool]:
+        results = [False] * len(records)
+        with self._pinned():
+            for bucket_idx, positions in self._group_by_bucket([rec.get('id') for rec in records]).items():
+                bucket = self._read_primary_bucket(bucket_idx)
+                located = {rec.get('id'): rec_idx for rec_idx, rec in enumerate(bucket.block) if rec.get('status') == 1}
+                chain = {rec.get('id'): (overflow_idx, rec_idx, overflow_bucket) for overflow_idx, overflow_bucket in self.__iter_chain(bucket) for rec_idx, rec in enumerate(overflow_bucket.block)}
+                chain.pop(self.empty_key, None)
+                dirty = False
+                for pos in positions:
+                    record = records[pos]
+                    id = record.get('id')
+                    if id in located:
+                        record['status'] = 1
+                        bucket.block[located[id]] = record
+                        dirty = True
+                    elif id in chain:
+                        record['status'] = 1
+                        overflow_idx, rec_idx, overflow_bucket = chain[id]
+                        overflow_bucket.block[rec_idx] = record
+                        self._write_overflow_bucket(overflow_idx, overflow_bucket)
+                    else:
+                        continue
+                    results[pos] = True
+                if dirty:
+                    self._write_primary_bucket(bucket_idx, bucket)
+        return results
+
+    @timed
+    @indexed
+    def delete_many(self, ids: List[int]) -> List[bool]:
+        results = [False] * len(ids)
+        with self._pinned():
+            for positions in self._group_by_bucket(ids).values():
+                for pos in positions:
+                    results[pos] = self.delete_by_id(ids[pos])
+        return results
+
     def print_file(self):
-        with open(self.filename, "rb") as f:
-            print("Primary zone:")
-            for i in range(self.num_buckets):
-                bucket = self._read_primary_bucket(f)
-                print(f"\nBUCKET {i+1}:")
-                print(f"Header: {bucket.header.get('u')+1}")
-                for j, rec in enumerate(bucket.block):
-                    print(f"Record {j}:\t{rec}")
-            print("\nOverflow zone:")
-            overflow_header = self._read_header(f)
-            print(f"Overflow zone header: {overflow_header.get('u')+1}\n")
-            i = self.num_buckets
-            while True:
-                bucket = self._read_overflow_bucket(f)
-                if bucket is None:
-                    break
-                i += 1
-                print(f"BLOCK {i}:")
-                print(f"Record:\t{bucket.block[0]}")
-                print(f"Link: {bucket.header.get('u')+1}\n")
-            print()
\ No newline at end of file
+        print("Primary zone:")
+        for i in range(self.num_buckets):
+            bucket = self._read_primary_bucket(i)
+            print(f"\nBUCKET {i+1}:")
+            print(f"Header: {bucket.header.get('u')+1}")
+            for j, rec in enumerate(bucket.block):
+                print(f"Record {j}:\t{rec}")
+        print("\nOverflow zone:")
+        overflow_header = self._read_overflow_header()
+        print(f"Overflow zone header: {overflow_header.get('u')+1}\n")
+        i = self.num_buckets
+        while True:
+            bucket = self._read_overflow_bucket(i)
+            if bucket is None:
+                break
+            i += 1
+            print(f"BLOCK {i}:")
+            for j, rec in enumerate(bucket.block):
+                print(f"Record {j}:\t{rec}")
+            print(f"Link: {bucket.header.get('u')+1}\n")
+        print()
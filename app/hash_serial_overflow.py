@@ -1,194 +1,612 @@
-from typing import Dict
-import os
-from app.binary_file import BinaryFile
+import tempfile
+from bisect import bisect_right
+from collections import Counter
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from app.external_sort import ExternalSorter
+from app.hash_file import HashFile, indexed
+from app.hash_functions import division
 from app.record import Record
+from app.stats import timed
 
 
-class HashFileSerialOverflow(BinaryFile):
-    def __init__(self, filename: str, record: Record, num_buckets: int, blocking_factor: int, empty_record: Dict, empty_key: int = -1):
-        super().__init__(filename, record, blocking_factor, empty_record, empty_key)
-        self.num_buckets = num_buckets
+class HashFileSerialOverflow(HashFile):
+    def __init__(self, filename: str, record: Record, num_buckets: int, blocking_factor: int, empty_record: Dict, empty_key: int = -1, buffer_size: int = 64, use_mmap: bool = False, deferred_delete: bool = False, vacuum_threshold: float = 0.25, hash_function: Callable = division):
+        super().__init__(filename, record, num_buckets, blocking_factor, empty_record, empty_key, buffer_size, use_mmap, hash_function)
+        self.deferred_delete = deferred_delete # deletes only leave tombstones, removed later by vacuum()
+        self.vacuum_threshold = vacuum_threshold # tombstone ratio past which a deferred delete vacuums the file
+        # bucket_idx -> sorted overflow zone slots of its synonyms, rebuilt lazily when None
+        self._overflow_directory: Optional[Dict[int, List[int]]] = None
 
-    def hash(self, id):
-        return id % self.num_buckets
+    def _read_bucket(self, block_idx: int) -> List[Dict]:
+        return self.read_block_at(block_idx * self.block_size)
 
+    def _write_bucket(self, block_idx: int, block: List[Dict]):
+        self.write_block_at(block_idx * self.block_size, block)
+
+    def _last_block_idx(self) -> int:
+        return self._file_end() // self.block_size - 1
+
+    @timed
+    @indexed
     def init_file(self):
-        with open(self.filename, "wb") as f:
-            for _ in range(self.num_buckets + 1): # +1 for serial overflow zone last record
-                bucket = self.blocking_factor * [self.empty_record]
-                self.write_block(f, bucket)
+        self._create_file()
+        self._clear_bloom()
+        self._overflow_directory = None
+        self._set_counters(0)
+        bucket = self.encode_block(self.blocking_factor * [self.empty_record])
+        self._write_sequential(bucket for _ in range(self.num_buckets + 1)) # +1 for serial overflow zone last record
+
+    @timed
+    @indexed
+    def bulk_load(self, records: Iterable[Dict], memory_records: int = 100000) -> int:
+        # builds the file from scratch: records are sorted by bucket (spilling to temporary
+        # files when needed), then both zones are written sequentially from start to end
+        bf = self.blocking_factor
+        empty_block = self.encode_block(bf * [self.empty_record])
+        loaded = 0
+        spilled = 0
+        most = 0 # largest number of synonyms of a bucket in the overflow zone
+        with ExternalSorter(self.codec, memory_records) as sorter, tempfile.TemporaryFile() as overflow:
+            for record in records:
+                record['status'] = 1
+                sorter.add(self.hash(record.get('id')), record)
+
+            def primary_zone():
+                nonlocal loaded, spilled, most
+                next_idx = 0
+                for bucket_idx, group in self._unique_groups(sorter):
+                    for _ in range(next_idx, bucket_idx):
+                        yield empty_block
+                    yield self.encode_block(group[:bf] + (bf - len(group[:bf])) * [self.empty_record])
+                    if len(group) > bf:
+                        overflow.write(self.encode_block(group[bf:]))
+                        spilled += len(group) - bf
+                        most = max(most, len(group) - bf)
+                    loaded += len(group)
+                    next_idx = bucket_idx + 1
+                for _ in range(next_idx, self.num_buckets):
+                    yield empty_block
+
+            def overflow_zone():
+                overflow.seek(0)
+                chunk = overflow.read(1024 * self.block_size)
+                while chunk:
+                    yield chunk
+                    chunk = overflow.read(1024 * self.block_size)
+                # the last block always keeps at least one free slot
+                yield self.encode_block((bf - spilled % bf) * [self.empty_record])
+
+            self._create_file()
+            self._overflow_directory = None
+            self._write_sequential(primary_zone())
+            self._write_sequential(overflow_zone(), self.block_size)
+        self._set_counters(loaded, 0, 1 + most)
+        return loaded
+
+    def _zones(self) -> List[Tuple[int, int, int, int]]:
+        return [(0, self._file_end(), self.block_size, 0)]
+
+    def _home_zones(self) -> Tuple[Optional[Tuple[int, int, int, int]], List[Tuple[int, int, int, int]]]:
+        primary_end = self.num_buckets * self.block_size
+        return (0, primary_end, self.block_size, 0), [(primary_end, self._file_end(), self.block_size, 0)]
+
+    def _locate(self, id) -> Optional[Tuple[List[Dict], int, Callable[[], None]]]:
+        found = self.__search(id)
+        if found is None:
+            return None
+        block_idx, rec_idx, block = found
+        return block, rec_idx, lambda: self._write_bucket(block_idx, block)
 
+    def _options(self) -> Dict:
+        return {'deferred_delete': self.deferred_delete, 'vacuum_threshold': self.vacuum_threshold}
+
+    def _overflow_state(self) -> Dict:
+        # records are appended to the last block of the overflow zone
+        return {'overflow_blocks': self._last_block_idx() + 1 - self.num_buckets, 'overflow_tail_block': self._last_block_idx()}
+
+    def structure_stats(self) -> Dict:
+        records, tombstones = 0, 0
+        synonyms = Counter() # bucket_idx -> records hashing into it
+        overflow = Counter() # bucket_idx -> its records in the overflow zone
+        for block_idx, _, block in self._scan_blocks(0, self._file_end(), self.block_size):
+            for rec in block:
+                if rec.get('status') == 0:
+                    continue
+                if rec.get('status') == 2:
+                    tombstones += 1
+                    continue
+                records += 1
+                synonyms[self.hash(rec.get('id'))] += 1
+                if block_idx >= self.num_buckets:
+                    overflow[self.hash(rec.get('id'))] += 1
+        return {
+            'num_buckets': self.num_buckets,
+            'blocking_factor': self.blocking_factor,
+            'records': records,
+            'tombstones': tombstones,
+            'load_factor': records / (self.num_buckets * self.blocking_factor),
+            'overflow_blocks': self._last_block_idx() + 1 - self.num_buckets,
+            'overflow_records': sum(overflow.values()),
+            # number of records -> buckets with that many synonyms, in total and in the overflow zone
+            'synonyms': dict(sorted(Counter(synonyms[i] for i in range(self.num_buckets)).items())),
+            'overflow_synonyms': dict(sorted(Counter(overflow[i] for i in range(self.num_buckets)).items())),
+            # blocks read by the longest search: the primary bucket and a block per overflow synonym
+            'longest_search': 1 + max(overflow.values(), default=0),
+        }
+
+    def _invalidate(self):
+        super()._invalidate()
+        self._overflow_directory = None
+
+    def _single_bucket(self, operation: str, id) -> bool:
+        # inserts and deletes change the record counts and may touch the shared overflow zone
+        if operation not in ('find_by_id', 'update_record'):
+            return False
+        bucket = self._read_bucket(self.hash(id))
+        if operation == 'find_by_id' and bucket[-1].get('status') == 0:
+            return True
+        return any(rec.get('id') == id and rec.get('status') == 1 for rec in bucket)
+
+    def _local_insert(self, id) -> bool:
+        # an empty slot ends the search for id and takes the record
+        return any(rec.get('status') == 0 for rec in self._read_bucket(self.hash(id)))
+
+    @timed
     def find_by_id(self, id):
+        found = self.__search(id)
+        return found[:2] if found is not None else None
+
+    def __search(self, id) -> Optional[Tuple[int, int, List[Dict]]]:
+        # find_by_id, also returning the block holding the record
+        if not self._might_contain(id):
+            return None
         bucket_idx = self.hash(id)
-        with open(self.filename, "rb") as f:
-            f.seek(bucket_idx*self.block_size)
-            bucket = self.read_block(f)
-            for rec_idx, rec in enumerate(bucket):
-                if rec.get('status') == 0:
-                    return None
-                if rec.get('id') == id:
-                    if rec.get('status') == 1:
-                        return bucket_idx, rec_idx
-                    return None
+        bucket = self._read_bucket(bucket_idx)
+        for rec_idx, rec in enumerate(bucket):
+            if rec.get('status') == 0:
+                return None
+            if rec.get('id') == id and rec.get('status') == 1:
+                return bucket_idx, rec_idx, bucket
         return self.__find_in_overflow(id)
-    
+
+    def __iter_overflow(self):
+        # yields (block_idx, rec_idx, record) for every record in the overflow zone
+        block_idx = self.num_buckets
+        block = self._read_bucket(block_idx)
+        while block:
+            for rec_idx, rec in enumerate(block):
+                if rec.get('id') == self.empty_key:
+                    return
+                yield block_idx, rec_idx, rec
+            block_idx += 1
+            block = self._read_bucket(block_idx)
+
+    def __slot(self, block_idx: int, rec_idx: int) -> int:
+        return (block_idx - self.num_buckets) * self.blocking_factor + rec_idx
+
+    def __slot_position(self, slot: int):
+        block_idx, rec_idx = divmod(slot, self.blocking_factor)
+        return self.num_buckets + block_idx, rec_idx
+
+    def __directory(self) -> Dict[int, List[int]]:
+        if self._overflow_directory is None:
+            self._overflow_directory = {}
+            for block_idx, rec_idx, rec in self.__iter_overflow():
+                self._overflow_directory.setdefault(self.hash(rec.get('id')), []).append(self.__slot(block_idx, rec_idx))
+        return self._overflow_directory
+
+    def __remove_from_directory(self, bucket_idx: int, slot: int):
+        # every record after the removed one moves one slot back
+        directory = self.__directory()
+        directory[bucket_idx].remove(slot)
+        if not directory[bucket_idx]:
+            del directory[bucket_idx]
+        for slots in directory.values():
+            for i in range(bisect_right(slots, slot), len(slots)):
+                slots[i] -= 1
+
+    def __append_to_overflow(self, records: List[Dict]):
+        # the last block always has at least one free slot
+        block_idx = self._last_block_idx()
+        block = self._read_bucket(block_idx)
+        i = next(i for i, rec in enumerate(block) if rec.get('id') == self.empty_key)
+        for record in records:
+            if i == self.blocking_factor:
+                self._write_bucket(block_idx, block)
+                block_idx += 1
+                block = self.blocking_factor * [self.empty_record]
+                i = 0
+            block[i] = record
+            if self._overflow_directory is not None:
+                self._overflow_directory.setdefault(self.hash(record.get('id')), []).append(self.__slot(block_idx, i))
+            i += 1
+        self._write_bucket(block_idx, block)
+        if i == self.blocking_factor:
+            self._write_bucket(block_idx + 1, self.blocking_factor * [self.empty_record])
+
     def __find_in_overflow(self, id):
-        with open(self.filename, "rb") as f:
-            f.seek(self.num_buckets * self.block_size)
-            i = 0
-            bucket = self.read_block(f)
-            while bucket:
-                for j, rec in enumerate(bucket):
-                    if rec.get('id') == self.empty_key:
-                        return None
-                    if rec.get('id') == id:
-                        return self.num_buckets+i, j
-                bucket = self.read_block(f)
+        for slot in self.__directory().get(self.hash(id), ()):
+            block_idx, rec_idx = self.__slot_position(slot)
+            block = self._read_bucket(block_idx)
+            if block[rec_idx].get('id') == id and block[rec_idx].get('status') == 1:
+                return block_idx, rec_idx, block
         return None
 
+    def __find_synonym_in_overflow(self, bucket_idx):
+        slots = self.__directory().get(bucket_idx)
+        if not slots:
+            return None
+        return self.__slot_position(slots[0])
+
+    @timed
+    @indexed
     def insert_record(self, record) -> bool:
         id = record.get('id')
         bucket_idx = self.hash(id)
 
-        find_res = self.find_by_id(id)
-        if find_res is not None:
+        if self._might_contain(id) and self.find_by_id(id) is not None:
             return False
 
         record['status'] = 1
+        self._bloom_add(id)
 
-        with open(self.filename, "+rb") as f:
-            f.seek(bucket_idx * self.block_size)
-            bucket = self.read_block(f)
-            for i, rec in enumerate(bucket[:]):
-                if rec.get('status') != 1:
-                    bucket[i] = record
-                    f.seek(-self.block_size, 1)
-                    self.write_block(f, bucket)
-                    return True
-        
-            # overflow zone
-            f.seek(-self.block_size, 2)
-            bucket = self.read_block(f)
-            for i, rec in enumerate(bucket[:]):
-                if rec.get('id') == self.empty_key:
-                    bucket[i] = record
-                    f.seek(-self.block_size, 1)
-                    self.write_block(f, bucket)
-                    if i == self.blocking_factor:
-                        self.write_block(self.blocking_factor*[self.empty_record])
-                    return True
-                    
-    def update_record(self, record):
+        bucket = self._read_bucket(bucket_idx)
+        for i, rec in enumerate(bucket):
+            if rec.get('status') != 1:
+                self._count(1, -1 if rec.get('status') == 2 else 0)
+                bucket[i] = record
+                self._write_bucket(bucket_idx, bucket)
+                return True
+
+        self.__append_to_overflow([record])
+        if self._overflow_directory is not None:
+            self._count(1, 0, self.__search_length(bucket_idx))
+        else: # one more overflow synonym to read for this bucket
+            self._count(1, 0, grown=1)
+        return True
+
+    @timed
+    @indexed
+    def update_record(self, record) -> bool:
         id = record.get('id')
         find_res = self.find_by_id(id)
         if find_res is None:
             return False
         record['status'] = 1
         block_idx, rec_idx = find_res
-        with open(self.filename, "r+b") as f:
-            f.seek(self.block_size*block_idx)
-            block = self.read_block(f)
-            block[rec_idx] = record
-            f.seek(-self.block_size, 1)
-            self.write_block(f, block)
-                    
+        block = self._read_bucket(block_idx)
+        block[rec_idx] = record
+        self._write_bucket(block_idx, block)
+        return True
+
+    @timed
+    @indexed
     def logical_delete_by_id(self, id) -> bool:
         find_res = self.find_by_id(id)
         if find_res is None:
             return False
         block_idx, rec_idx = find_res
 
-        with open(self.filename, "rb+") as f:
-            f.seek(block_idx * self.block_size)
-            bucket = self.read_block(f)
-            bucket[rec_idx]['status'] = 2
-            f.seek(-self.block_size, 1)
-            self.write_block(f, bucket)
+        bucket = self._read_bucket(block_idx)
+        bucket[rec_idx]['status'] = 2
+        self._write_bucket(block_idx, bucket)
+        self._count(-1, 1)
+        return True
 
+    @timed
+    @indexed
     def delete_by_id(self, id) -> bool:
+        if self.deferred_delete:
+            deleted = self.logical_delete_by_id(id)
+            if deleted:
+                self.__vacuum_if_needed()
+            return deleted
+
         find_res = self.find_by_id(id)
         if find_res is None:
             return False
         block_idx, rec_idx = find_res
+        self._count(-1, 0)
 
-        with open(self.filename, "rb+") as f:
-            if block_idx < self.num_buckets:
-                # remove from primary zone
-                f.seek(block_idx * self.block_size)
-                bucket = self.read_block(f)
-                overflow = True
-                for i in range(rec_idx, self.blocking_factor-1):
-                    bucket[i] = bucket[i+1]
-                    if bucket[i].get('id') == self.empty_key:
-                        overflow = False
-                        break
-                if not overflow:
-                    f.seek(-self.block_size, 1)
-                    self.write_block(f, bucket)
-                    return True
-
-                # search for overflow record in overflow zone
-                f.seek(self.num_buckets * self.block_size)
-                overflow_block_idx = self.num_buckets - 1 # updated at the beginning of each iteration
-                overflow_rec_idx = None # None if no record with the same hash is found
-                while overflow_rec_idx is None:
-                    overflow_block_idx += 1
-                    overflow_block = self.read_block(f)
-                    if not overflow_block:
-                        break
-                    for i, rec in enumerate(overflow_block):
-                        if self.hash(rec.get('id')) == block_idx:
-                            overflow_rec_idx = i
-                            break
-                if overflow_rec_idx is not None:
-                    bucket[-1] = overflow_block[overflow_rec_idx]
+        if block_idx < self.num_buckets:
+            # remove from primary zone
+            bucket = self._read_bucket(block_idx)
+            overflow = bucket[-1].get('id') != self.empty_key
+            bucket = bucket[:rec_idx] + bucket[rec_idx+1:] + [self.empty_record]
+            if not overflow:
+                self._write_bucket(block_idx, bucket)
+                return True
+
+            # search for overflow record in overflow zone
+            synonym = self.__find_synonym_in_overflow(block_idx)
+            if synonym is None:
+                self._write_bucket(block_idx, bucket)
+                return True
+            overflow_block_idx, overflow_rec_idx = synonym
+            bucket[-1] = self._read_bucket(overflow_block_idx)[overflow_rec_idx]
+            self._write_bucket(block_idx, bucket)
+            block_idx = overflow_block_idx
+            rec_idx = overflow_rec_idx
+
+        # remove from overflow zone, shifting every following record one place back
+        self.__remove_from_directory(self.hash(self._read_bucket(block_idx)[rec_idx].get('id')), self.__slot(block_idx, rec_idx))
+        last_block_idx = self._last_block_idx()
+        block = self._read_bucket(block_idx)
+        del block[rec_idx]
+        while block_idx < last_block_idx and not (block and block[-1].get('id') == self.empty_key):
+            next_block = self._read_bucket(block_idx + 1)
+            moved = next_block.pop(0)
+            block.append(moved)
+            self._write_bucket(block_idx, block)
+            block = next_block
+            block_idx += 1
+            if moved.get('id') == self.empty_key:
+                break
+        block.append(self.empty_record)
+        self._write_bucket(block_idx, block)
+
+        # drop the last block if it is empty and the one before can hold the next overflow record
+        if last_block_idx > self.num_buckets:
+            last_block = self._read_bucket(last_block_idx)
+            if last_block[0].get('id') == self.empty_key and self._read_bucket(last_block_idx - 1)[-1].get('id') == self.empty_key:
+                self._truncate(last_block_idx * self.block_size)
+        return True
+
+    @timed
+    @indexed
+    def insert_many(self, records: List[Dict]) -> List[bool]:
+        results = [False] * len(records)
+        with self._pinned():
+            groups = self._group_by_bucket([rec.get('id') for rec in records])
+            buckets = {bucket_idx: self._read_bucket(bucket_idx) for bucket_idx in groups}
+            existing = {rec.get('id') for bucket in buckets.values() for rec in bucket if rec.get('status') == 1}
+            # synonyms of full buckets may be anywhere in the overflow zone: collect them in one pass
+            full = {bucket_idx for bucket_idx, bucket in buckets.items() if bucket[-1].get('status') != 0
+                    and any(self._might_contain(records[pos].get('id')) for pos in groups[bucket_idx])}
+            for bucket_idx in full:
+                for slot in self.__directory().get(bucket_idx, ()):
+                    block_idx, rec_idx = self.__slot_position(slot)
+                    rec = self._read_bucket(block_idx)[rec_idx]
+                    if rec.get('status') == 1:
+                        existing.add(rec.get('id'))
+
+            spill = []
+            for bucket_idx, positions in groups.items():
+                bucket = buckets[bucket_idx]
+                dirty = False
+                for pos in positions:
+                    record = records[pos]
+                    if record.get('id') in existing:
+                        continue
+                    existing.add(record.get('id'))
+                    record['status'] = 1
+                    results[pos] = True
+                    self._bloom_add(record.get('id'))
+                    self._count(1, 0)
+                    free = next((i for i, rec in enumerate(bucket) if rec.get('status') != 1), None)
+                    if free is None:
+                        spill.append(record)
+                    else:
+                        if bucket[free].get('status') == 2:
+                            self._count(0, -1)
+                        bucket[free] = record
+                        dirty = True
+                if dirty:
+                    self._write_bucket(bucket_idx, bucket)
+            if spill:
+                self.__append_to_overflow(spill)
+                spilled = Counter(self.hash(record.get('id')) for record in spill)
+                if self._overflow_directory is not None:
+                    self._count(longest=max(self.__search_length(bucket_idx) for bucket_idx in spilled))
                 else:
-                    bucket[-1] = self.empty_record
-                f.seek(block_idx * self.block_size)
-                self.write_block(f, bucket)
-                if overflow_rec_idx is None:
-                    return True
-                block_idx = overflow_block_idx
-                rec_idx = overflow_rec_idx
-            
-            # remove from overflow zone
-            f.seek(block_idx * self.block_size)
-            block = self.read_block(f)
-            while block:
-                for i in range(rec_idx, self.blocking_factor-1):
-                    block[i] = block[i+1]
-                    if block[i].get('id') == self.empty_key:
+                    self._count(grown=max(spilled.values()))
+        return results
+
+    @timed
+    @indexed
+    def update_many(self, records: List[Dict]) -> List[bool]:
+        results = [False] * len(records)
+        with self._pinned():
+            groups = self._group_by_bucket([rec.get('id') for rec in records])
+            located = {}
+            missing = set()
+            for bucket_idx, positions in groups.items():
+                bucket = self._read_bucket(bucket_idx)
+                for rec_idx, rec in enumerate(bucket):
+                    if rec.get('status') == 1:
+                        located[rec.get('id')] = (bucket_idx, rec_idx)
+                if bucket[-1].get('status') != 0:
+                    missing.update(records[pos].get('id') for pos in positions)
+            missing.difference_update(located)
+            for id in missing:
+                target = self.__find_in_overflow(id)
+                if target is not None:
+                    located[id] = target[:2]
+
+            blocks = {}
+            for pos, record in enumerate(records):
+                target = located.get(record.get('id'))
+                if target is None:
+                    continue
+                block_idx, rec_idx = target
+                if block_idx not in blocks:
+                    blocks[block_idx] = self._read_bucket(block_idx)
+                record['status'] = 1
+                blocks[block_idx][rec_idx] = record
+                results[pos] = True
+            for block_idx, block in blocks.items():
+                self._write_bucket(block_idx, block)
+        return results
+
+    @timed
+    @indexed
+    def delete_many(self, ids: List[int]) -> List[bool]:
+        results = [False] * len(ids)
+        if self.deferred_delete:
+            with self._pinned():
+                for positions in self._group_by_bucket(ids).values():
+                    for pos in positions:
+                        results[pos] = self.logical_delete_by_id(ids[pos])
+            self.__vacuum_if_needed()
+            return results
+
+        with self._pinned():
+            buckets = {} # bucket_idx -> records left in the primary bucket
+            refill = {} # bucket_idx -> number of synonyms to pull back from the overflow zone
+            pending = {} # id -> position in ids, for ids that can only be in the overflow zone
+            for bucket_idx, positions in self._group_by_bucket(ids).items():
+                bucket = self._read_bucket(bucket_idx)
+                full = bucket[-1].get('id') != self.empty_key
+                kept = [rec for rec in bucket if rec.get('id') != self.empty_key]
+                occupied = len(kept)
+                for pos in positions:
+                    rec_idx = next((i for i, rec in enumerate(kept) if rec.get('id') == ids[pos] and rec.get('status') == 1), None)
+                    if rec_idx is not None:
+                        del kept[rec_idx]
+                        results[pos] = True
+                    elif full and ids[pos] not in pending:
+                        pending[ids[pos]] = pos
+                if len(kept) < occupied:
+                    buckets[bucket_idx] = kept
+                    if full:
+                        refill[bucket_idx] = occupied - len(kept)
+
+            if pending or refill:
+                self.__compact_overflow(buckets, refill, pending, results)
+            for bucket_idx, kept in buckets.items():
+                self._write_bucket(bucket_idx, kept + (self.blocking_factor - len(kept)) * [self.empty_record])
+        self._count(-sum(results), 0)
+        return results
+
+    def __compact_overflow(self, buckets: Dict, refill: Dict, pending: Dict, results: List[bool]):
+        # drops deleted records and moves synonyms back into their primary buckets
+        directory = self.__directory()
+        starts = []
+        for id in list(pending):
+            target = self.__find_in_overflow(id)
+            if target is None:
+                del pending[id]
+            else:
+                starts.append(self.__slot(*target[:2]))
+        starts.extend(directory[bucket_idx][0] for bucket_idx in refill if bucket_idx in directory)
+        if not starts:
+            return
+
+        def drop(rec: Dict) -> bool:
+            id = rec.get('id')
+            if rec.get('status') == 1 and id in pending:
+                results[pending.pop(id)] = True
+                return True
+            if refill.get(self.hash(id)):
+                buckets[self.hash(id)].append(rec)
+                refill[self.hash(id)] -= 1
+                return True
+            return False
+
+        self.__rewrite_overflow(min(starts), drop)
+
+    def __rewrite_overflow(self, start: int, drop: Callable[[Dict], bool]):
+        # single sequential pass over the overflow zone from the given slot on: records for which
+        # drop() is true are removed and the rest shifted forward, blocks before the first removed
+        # record are left untouched
+        directory = self.__directory()
+        new_directory = {bucket_idx: [slot for slot in slots if slot < start] for bucket_idx, slots in directory.items()}
+
+        last_block_idx = self._last_block_idx()
+        out_idx, first = self.__slot_position(start)
+        out_block = self._read_bucket(out_idx)[:first]
+        shifted = False
+        for block_idx in range(out_idx, last_block_idx + 1):
+            block = self._read_bucket(block_idx)
+            for rec in block[first if block_idx == out_idx else 0:]:
+                if rec.get('id') == self.empty_key:
+                    break
+                if drop(rec):
+                    shifted = True
+                    continue
+                new_directory.setdefault(self.hash(rec.get('id')), []).append(self.__slot(out_idx, len(out_block)))
+                out_block.append(rec)
+                if len(out_block) == self.blocking_factor:
+                    if shifted:
+                        self._write_bucket(out_idx, out_block)
+                    out_idx += 1
+                    out_block = []
+        if not shifted:
+            return
+        self._write_bucket(out_idx, out_block + (self.blocking_factor - len(out_block)) * [self.empty_record])
+        if out_idx < last_block_idx:
+            self._truncate((out_idx + 1) * self.block_size)
+        self._overflow_directory = {bucket_idx: slots for bucket_idx, slots in new_directory.items() if slots}
+
+    def __search_length(self, bucket_idx: int) -> int:
+        # blocks read by a search in a bucket with synonyms in the overflow zone
+        return 1 + len(self._overflow_directory.get(bucket_idx, ()))
+
+    def tombstone_ratio(self) -> float:
+        counters = self._known_counters()
+        live, tombstones = counters['records'], counters['tombstones']
+        if live + tombstones == 0:
+            return 0.0
+        return tombstones / (live + tombstones)
+
+    def __vacuum_if_needed(self):
+        if self.tombstone_ratio() > self.vacuum_threshold:
+            self.vacuum()
+
+    @timed
+    def vacuum(self) -> int:
+        # removes every tombstone: primary buckets are compacted in order and, when they were
+        # full, refilled with their first live synonyms, then the overflow zone is rewritten
+        # in one sequential pass without the tombstones and the records pulled back
+        removed = 0
+        pulled = set() # overflow zone slots of the synonyms moved into primary buckets
+        directory = self.__directory()
+        for bucket_idx in range(self.num_buckets):
+            bucket = self._read_bucket(bucket_idx)
+            kept = [rec for rec in bucket if rec.get('status') == 1]
+            tombstones = sum(1 for rec in bucket if rec.get('status') == 2)
+            if tombstones == 0:
+                continue
+            removed += tombstones
+            if bucket[-1].get('status') != 0:
+                for slot in directory.get(bucket_idx, ()):
+                    if len(kept) == self.blocking_factor:
                         break
-                next_block = self.read_block(f)
-                if next_block:
-                    block[-1] = next_block[0]
-                    if block[-1].get('id') == self.empty_key:
-                        os.ftruncate(f.fileno(), block_idx*self.block_size)
+                    block_idx, rec_idx = self.__slot_position(slot)
+                    rec = self._read_bucket(block_idx)[rec_idx]
+                    if rec.get('status') == 1:
+                        kept.append(rec)
+                        pulled.add(slot)
+            self._write_bucket(bucket_idx, kept + (self.blocking_factor - len(kept)) * [self.empty_record])
 
-                f.seek(block_idx*self.block_size)
-                self.write_block(f, block)
-                f.seek(self.block_size, 1)
+        slot = 0
+        def drop(rec: Dict) -> bool:
+            nonlocal slot, removed
+            slot += 1
+            if rec.get('status') == 2:
+                removed += 1
+                return True
+            return slot - 1 in pulled
+
+        self.__rewrite_overflow(0, drop)
+        self.flush()
+        self._known_counters()['tombstones'] = 0
+        return removed
 
-                block = next_block
-                block_idx += 1
-                rec_idx = 0
-        return True
-    
     def print_file(self):
-        with open(self.filename, "rb") as f:
-            for i in range(self.num_buckets):
-                print(f"BUCKET {i+1}:")
-                bucket = self.read_block(f)
-                for j, rec in enumerate(bucket):
-                    print(f"Record {j}:\t{rec}")
-            print("\nOverflow zone:")
-            i = 0
-            while True:
-                block = self.read_block(f)
-                if not block:
-                    break
-                i += 1
-                print(f"BLOCK {i}:")
-                for j, rec in enumerate(block):
-                    print(f"Record {j}:\t{rec}")
-            print()
\ No newline at end of file
+        for i in range(self.num_buckets):
+            print(f"BUCKET {i+1}:")
+            bucket = self._read_bucket(i)
+            for j, rec in enumerate(bucket):
+                print(f"Record {j}:\t{rec}")
+        print("\nOverflow zone:")
+        i = 0
+        while True:
+            block = self._read_bucket(self.num_buckets + i)
+            if not block:
+                break
+            i += 1
+            print(f"BLOCK {i}:")
+            for j, rec in enumerate(block):
+                print(f"Record {j}:\t{rec}")
+        print()
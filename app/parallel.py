@@ -0,0 +1,111 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterator, List, Optional, Tuple
+from app.hash_file import HashFile
+
+Zone = Tuple[int, int, int, int]
+
+
+# worker side: every worker gets an unopened copy of the file object and opens the file itself,
+# so it reads and writes through its own descriptor at its own positions
+
+def _find(file: HashFile, ids: List) -> List[Optional[Dict]]:
+    with file:
+        return [file._find_record(id) for id in ids]
+
+
+def _insert(file: HashFile, records: List[Dict]) -> List[Optional[bool]]:
+    # inserts the records that stay in their home bucket, None for the others
+    with file:
+        file.open()
+        return [file.insert_record(record) if file._local_insert(record.get('id')) else None for record in records]
+
+
+def _scan(file: HashFile, zones: List[Zone], attributes, where) -> List[Dict]:
+    with file:
+        return list(file._scan_zones(zones, attributes, where))
+
+
+class ParallelHashFile:
+    # Runs bulk operations of a hash file on a pool of processes.
+    #
+    # Lookups and inserts are sharded by contiguous ranges of home buckets, one range per worker,
+    # and scans split every zone of the file into runs of whole blocks. An insert runs in its worker
+    # if it only needs an empty slot of its home bucket: no other worker reads or writes that bucket,
+    # so this needs no locks. Inserts that need the shared parts of the file - probing past the home
+    # bucket, the overflow zone, the overflow free list, the header and splits of HashFileDynamic -
+    # are left over and run afterwards as a single batch in this process.
+    def __init__(self, file: HashFile, workers: Optional[int] = None):
+        if file._wal is not None or file._bloom is not None or file._indexes:
+            raise ValueError("the write-ahead log, Bloom filters and secondary indexes belong to a single process")
+        self.file = file
+        self.workers = workers or os.cpu_count()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.file.close()
+
+    def __copy(self) -> HashFile:
+        copy = self.file._clone(self.file.filename, self.file.num_buckets, self.file.blocking_factor)
+        copy._writes_superblock = False # left to this process, which knows what all workers changed
+        return copy
+
+    def __shards(self, ids: List) -> List[List[int]]:
+        # positions of the ids, split into contiguous ranges of home buckets
+        shards = [[] for _ in range(self.workers)]
+        for pos, id in enumerate(ids):
+            shards[self.file.hash(id) * self.workers // self.file.num_buckets].append(pos)
+        return [shard for shard in shards if shard]
+
+    def __slices(self) -> List[List[Zone]]:
+        # every zone cut into runs of whole blocks, a few per worker so that they even out
+        slices = []
+        for start, end, unit, header_size in self.file._zones():
+            blocks = (end - start) // unit
+            step = max(1, -(-blocks // (4 * self.workers)))
+            for first in range(0, blocks, step):
+                slices.append([(start + first * unit, start + min(blocks, first + step) * unit, unit, header_size)])
+        return slices
+
+    def find_records(self, ids: List) -> List[Optional[Dict]]:
+        # the record of every id, or None, in input order
+        self.file.flush()
+        shards = self.__shards(ids)
+        results: List[Optional[Dict]] = [None] * len(ids)
+        with ProcessPoolExecutor(self.workers) as pool:
+            for shard, records in zip(shards, pool.map(_find, [self.__copy()] * len(shards), [[ids[pos] for pos in shard] for shard in shards])):
+                for pos, record in zip(shard, records):
+                    results[pos] = record
+        return results
+
+    def insert_many(self, records: List[Dict]) -> List[bool]:
+        self.file.flush()
+        self.file.open()
+        self.file._touch() # the workers change the file but leave its superblock to this process
+        shards = self.__shards([record.get('id') for record in records])
+        results: List[Optional[bool]] = [None] * len(records)
+        try:
+            with ProcessPoolExecutor(self.workers) as pool:
+                for shard, inserted in zip(shards, pool.map(_insert, [self.__copy()] * len(shards), [[records[pos] for pos in shard] for shard in shards])):
+                    for pos, ok in zip(shard, inserted):
+                        results[pos] = ok
+        finally:
+            self.file._invalidate() # written by the workers, forgets the record counters too
+        left = [pos for pos, ok in enumerate(results) if ok is None]
+        for pos, ok in zip(left, self.file.insert_many([records[pos] for pos in left])):
+            results[pos] = ok
+        return results
+
+    def scan(self, attributes=None, where=()) -> Iterator[Dict]:
+        # like HashFile.scan, in file order
+        self.file.flush()
+        slices = self.__slices()
+        with ProcessPoolExecutor(self.workers) as pool:
+            for records in pool.map(_scan, [self.__copy()] * len(slices), slices, [attributes] * len(slices), [list(where)] * len(slices)):
+                yield from records
+
+    def reorganize(self, new_num_buckets: int, new_blocking_factor: Optional[int] = None, memory_records: int = 100000) -> int:
+        # like HashFile.reorganize, with the records read by a parallel scan
+        return self.file._reorganize(self.scan(), new_num_buckets, new_blocking_factor, memory_records)
@@ -9,11 +9,16 @@ class Record:
         self.attributes = attributes
         self.format = format
         self.coding = coding
+        self.struct = struct.Struct(format) # compiled once, shared by every encode/decode
+
+    def __reduce__(self):
+        # compiled structs cannot be pickled, e.g. to send a file to another process
+        return Record, (self.attributes, self.format, self.coding)
 
     def encoded_tuple_to_dict(self, binary_data: bytes):
-        t = struct.unpack(self.format, binary_data)
+        t = self.struct.unpack(binary_data)
         return {self.attributes[i]: t[i].decode(self.coding).strip('\x00') if isinstance(t[i], bytes) else t[i] for i in range(len(t))}
 
     def dict_to_encoded_values(self, d: Dict):
         values = [v.encode(self.coding) if isinstance(v, str) else v for v in d.values()]
-        return struct.pack(self.format, *values)
+        return self.struct.pack(*values)
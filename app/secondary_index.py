@@ -0,0 +1,78 @@
+import os
+from typing import Dict, List, Optional
+from app.hash_dynamic import HashFileDynamic
+from app.hash_functions import MASK_64, key_to_int
+from app.record import Record
+
+HASH_DIGITS = 16 # hex digits of the value hash that starts every entry key
+
+
+def value_hash(key: str, num_buckets: int) -> int:
+    # buckets entries by the hash of their value only, so that all entries of a value share a chain
+    return int(key[:HASH_DIGITS], 16) % num_buckets
+
+
+class SecondaryIndex:
+    # Companion HashFileDynamic <filename>.<attribute>.idx with one entry per live record of the
+    # file. An entry key is the 64-bit hash of the attribute value followed by the id of the record,
+    # both as hex digits; the entries are bucketed by the value hash alone.
+    def __init__(self, file, attribute: str, num_buckets: int = 8, blocking_factor: int = 16):
+        self.attribute = attribute
+        codec = file.codec
+        id_field = codec.attributes.index('id')
+        self.text_ids = id_field in codec.text_sizes
+        self.coding = codec.coding
+        id_digits = 2 * codec.text_sizes[id_field] if self.text_ids else 16
+        record = Record(['id', 'status'], f'{HASH_DIGITS + id_digits}si', 'ascii')
+        self.file = HashFileDynamic(f'{file.filename}.{attribute}.idx', record, num_buckets, blocking_factor,
+                                    {'id': '', 'status': 0}, '', buffer_size=file.buffer_size, hash_function=value_hash)
+
+    def __prefix(self, value) -> str:
+        return f'{key_to_int(value) & MASK_64:016x}'
+
+    def __key(self, record: Dict) -> str:
+        id = record['id']
+        ref = id.encode(self.coding).hex() if self.text_ids else f'{id & MASK_64:016x}'
+        return self.__prefix(record[self.attribute]) + ref
+
+    def __id(self, key: str):
+        ref = key[HASH_DIGITS:]
+        if self.text_ids:
+            return bytes.fromhex(ref).decode(self.coding)
+        id = int(ref, 16)
+        return id - (1 << 64) if id >= 1 << 63 else id
+
+    def build(self, file):
+        if not os.path.exists(file.filename):
+            self.file.init_file()
+            return
+        self.file.bulk_load({'id': self.__key(rec)} for rec in file.scan(['id', self.attribute]))
+
+    def add(self, record: Dict):
+        self.file.insert_record({'id': self.__key(record)})
+
+    def remove(self, record: Dict):
+        self.file.delete_by_id(self.__key(record))
+
+    def replace(self, old: Optional[Dict], new: Optional[Dict]):
+        if old is not None and new is not None and old[self.attribute] == new[self.attribute]:
+            return
+        if old is not None:
+            self.remove(old)
+        if new is not None:
+            self.add(new)
+
+    def ids(self, value) -> List:
+        # ids of the records whose value hashes like the given one
+        prefix = self.__prefix(value)
+        return [self.__id(rec['id']) for rec in self.file._bucket_records(self.file.hash(prefix)) if rec['id'].startswith(prefix)]
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+    def drop(self):
+        self.file.close()
+        self.file._discard()
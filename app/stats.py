@@ -0,0 +1,64 @@
+import threading
+from functools import wraps
+from typing import Callable, Dict, Optional
+
+
+class OperationStats:
+    def __init__(self):
+        self.count = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+
+class IOStats:
+    COUNTERS = ('blocks_read', 'blocks_written', 'bytes_read', 'bytes_written', 'seeks', 'opens', 'cache_hits', 'cache_misses')
+
+    def __init__(self, hook: Optional[Callable[[Dict], None]] = None):
+        self.hook = hook # called with a dict describing every completed public operation
+        self._local = threading.local() # per thread nesting depth: operations called from other operations are not recorded separately
+        self.reset()
+
+    def reset(self):
+        for name in self.COUNTERS:
+            setattr(self, name, 0)
+        self.operations: Dict[str, OperationStats] = {}
+
+    def counters(self) -> Dict[str, int]:
+        return {name: getattr(self, name) for name in self.COUNTERS}
+
+    def record(self, operation: str, seconds: float, before: Dict[str, int]):
+        stats = self.operations.setdefault(operation, OperationStats())
+        stats.count += 1
+        stats.total_time += seconds
+        stats.max_time = max(stats.max_time, seconds)
+        if self.hook is not None:
+            event = {'operation': operation, 'seconds': seconds}
+            event.update({name: value - before[name] for name, value in self.counters().items()})
+            self.hook(event)
+
+    def snapshot(self) -> Dict:
+        snapshot = self.counters()
+        snapshot['operations'] = {
+            name: {
+                'count': stats.count,
+                'total_time': stats.total_time,
+                'mean_time': stats.total_time / stats.count,
+                'max_time': stats.max_time,
+            }
+            for name, stats in self.operations.items()
+        }
+        return snapshot
+
+
+def timed(method):
+    # marks a public operation, see BinaryFile._operation
+    name = method.__name__
+
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if self.stats is None and self._wal is None:
+            return method(self, *args, **kwargs)
+        with self._operation(name):
+            return method(self, *args, **kwargs)
+
+    return wrapper
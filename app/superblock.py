@@ -0,0 +1,161 @@
+import builtins
+import json
+import os
+import shutil
+import struct
+from typing import Dict, Optional, Tuple
+from app import hash_functions
+from app.record import Record
+
+VERSION = 2
+SIZE = 4096 # bytes reserved for the superblock at the start of every data file
+HEADER = struct.Struct('<4sII') # magic, version, length of the JSON body that follows
+MAGIC = b'HSUP'
+
+
+# The superblock of a hash file is a versioned block at the start of the data file, below the positions
+# the classes address (see BinaryFile._reserved): it describes the class, layout and options of the
+# file, together with its record counters and overflow state as of the last close. The first change after
+# a file is opened writes it with the counters cleared, so a file that was not closed is counted again.
+#
+# Files written before the superblock moved into the data file have none; their superblock is kept in
+# <filename>.super, stamped with the size and modification time of the file, until upgrade rewrites them.
+
+def describe(file, counters: Optional[Dict], overflow: Optional[Dict]) -> Dict:
+    hash_name = file.hash_function.__name__
+    return {
+        'version': VERSION,
+        'class': type(file).__name__,
+        'record': {'attributes': file.record.attributes, 'format': file.record.format, 'coding': file.record.coding},
+        'num_buckets': file.num_buckets,
+        'blocking_factor': file.blocking_factor,
+        'empty_record': file.empty_record,
+        'empty_key': file.empty_key,
+        # None for hash functions that are not in app.hash_functions, which open has to be given
+        'hash_function': hash_name if getattr(hash_functions, hash_name, None) is file.hash_function else None,
+        'options': file._options(),
+        'counters': counters,
+        'overflow': overflow,
+    }
+
+
+def encode(data: Dict) -> bytes:
+    body = json.dumps(data).encode()
+    if HEADER.size + len(body) > SIZE:
+        raise ValueError(f"the superblock takes {HEADER.size + len(body)} bytes, more than the {SIZE} reserved for it")
+    return HEADER.pack(MAGIC, data['version'], len(body)) + body + bytes(SIZE - HEADER.size - len(body))
+
+
+def write(file, counters: Optional[Dict], overflow: Optional[Dict]):
+    # written in place, next to the data file's own buffered I/O, which never reads or writes it
+    os.pwrite(file._file.fileno(), encode(describe(file, counters, overflow)), 0)
+
+
+def present(fd: int) -> bool:
+    # whether the data file starts with a superblock
+    return os.pread(fd, len(MAGIC), 0) == MAGIC
+
+
+def decode(block: bytes, filename: str) -> Dict:
+    magic, version, length = HEADER.unpack_from(block)
+    if version > VERSION:
+        raise ValueError(f"superblock version {version} of {filename} is not supported")
+    return json.loads(block[HEADER.size:HEADER.size + length])
+
+
+def path(filename: str) -> str:
+    # the superblock of a file without one of its own
+    return filename + '.super'
+
+
+def save(file, stamp: Tuple[int, int], overflow: Dict):
+    data = dict(describe(file, file._counters, overflow), version=1, stamp=list(stamp))
+    # replaced atomically, processes sharing the file may save it at the same time
+    temp = f'{path(file.filename)}.{os.getpid()}.tmp'
+    with builtins.open(temp, 'w') as f:
+        json.dump(data, f)
+    os.replace(temp, path(file.filename))
+
+
+def _stamp(filename: str) -> Tuple[int, int]:
+    st = os.stat(filename)
+    return st.st_size, st.st_mtime_ns
+
+
+def read(filename: str) -> Dict:
+    # the saved superblock, with 'current' telling whether its counters describe the data file as it is
+    with builtins.open(filename, 'rb') as f:
+        block = f.read(SIZE)
+    if block.startswith(MAGIC):
+        data = decode(block, filename)
+        data['current'] = data['counters'] is not None
+        return data
+    with builtins.open(path(filename)) as f:
+        data = json.load(f)
+    if data.get('version', 0) > VERSION:
+        raise ValueError(f"superblock version {data['version']} of {filename} is not supported")
+    data['current'] = data['stamp'] == list(_stamp(filename))
+    return data
+
+
+def load_counters(file) -> Optional[Dict]:
+    # the counters saved for exactly this version of the data file of an open hash file
+    if file._reserved:
+        try:
+            return decode(os.pread(file._file.fileno(), SIZE, 0), file.filename)['counters']
+        except ValueError: # torn by a crash while it was written
+            return None
+    try:
+        with builtins.open(path(file.filename)) as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if data.get('version', 0) > VERSION or data.get('stamp') != list(_stamp(file.filename)):
+        return None
+    return data.get('counters')
+
+
+def upgrade(filename: str):
+    # moves the superblock of a file written before it had one of its own from <filename>.super into
+    # the data file, which is rewritten next to itself and then replaces it atomically
+    if os.path.exists(filename + '.wal'):
+        raise ValueError(f"{filename} has a write-ahead log left over, open it once to recover first")
+    data = read(filename)
+    if 'stamp' not in data:
+        return
+    current = data.pop('current')
+    data.pop('stamp')
+    data['version'] = VERSION
+    if not current:
+        data['counters'] = None
+    temp = filename + '.upgrade'
+    with builtins.open(filename, 'rb') as source, builtins.open(temp, 'wb') as target:
+        target.write(encode(data))
+        shutil.copyfileobj(source, target, 1 << 20)
+        target.flush()
+        os.fsync(target.fileno())
+    os.replace(temp, filename)
+    os.remove(path(filename))
+
+
+def open(filename: str, **options) -> 'HashFile':
+    # the hash file described by the superblock of filename, opened; options override the saved
+    # constructor arguments, e.g. buffer_size, use_mmap or a hash_function that was not saved
+    from app.hash_dynamic import HashFileDynamic
+    from app.hash_linear import HashFileLinear
+    from app.hash_linked_overflow import HashFileLinkedOverflow
+    from app.hash_serial_overflow import HashFileSerialOverflow
+    classes = {cls.__name__: cls for cls in (HashFileLinear, HashFileSerialOverflow, HashFileLinkedOverflow, HashFileDynamic)}
+    data = read(filename)
+    if data['class'] not in classes:
+        raise ValueError(f"unknown hash file class: {data['class']}")
+    kwargs = dict(data['options'])
+    if data['hash_function'] is not None:
+        kwargs['hash_function'] = getattr(hash_functions, data['hash_function'])
+    kwargs.update(options)
+    if 'hash_function' not in kwargs:
+        raise ValueError(f"{filename} uses a custom hash function, which has to be given")
+    record = Record(data['record']['attributes'], data['record']['format'], data['record']['coding'])
+    file = classes[data['class']](filename, record, data['num_buckets'], data['blocking_factor'], data['empty_record'], data['empty_key'], **kwargs)
+    file.open()
+    return file
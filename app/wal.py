@@ -0,0 +1,86 @@
+import os
+import struct
+import threading
+import zlib
+from typing import BinaryIO, Iterable, Optional, Tuple
+
+FRAME = struct.Struct('<4sQI') # magic, payload length, crc32 of the payload
+ENTRY = struct.Struct('<cQI') # kind, file position (or size), data length
+MAGIC = b'HWAL'
+PAGE = b'P' # after-image of the bytes at a position
+TRUNCATE = b'T' # the file was truncated to a size
+
+
+class WriteAheadLog:
+    # Append-only log of committed groups of operations. Every group is one frame holding the
+    # after-images of all pages its operations modified, written with a single fsync. A frame
+    # that was only partly written when the process died fails its checksum and is not replayed.
+    def __init__(self, filename: str, group_size: int, checkpoint_size: int):
+        self.filename = filename
+        self.group_size = group_size # operations committed together
+        self.checkpoint_size = checkpoint_size # log size past which the data file is synced and the log emptied
+        self.active = 0 # operations in progress, in any thread
+        self.pending = 0 # operations finished since the last commit
+        self.truncate: Optional[int] = None # smallest size the data file was truncated to since the last commit
+        self.size = 0
+        self.local = threading.local() # per thread nesting depth of operations
+        self._file: Optional[BinaryIO] = None
+
+    def append(self, entries: Iterable[Tuple[bytes, int, bytes]]):
+        payload = bytearray()
+        for kind, position, data in entries:
+            payload += ENTRY.pack(kind, position, len(data))
+            payload += data
+        if self._file is None:
+            self._file = open(self.filename, 'ab')
+            self.size = self._file.tell()
+        self._file.write(FRAME.pack(MAGIC, len(payload), zlib.crc32(payload)) + payload)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self.size += FRAME.size + len(payload)
+
+    def reset(self):
+        # everything logged so far is safely in the data file
+        if self._file is not None:
+            self._file.truncate(0)
+            os.fsync(self._file.fileno())
+        self.size = 0
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if os.path.exists(self.filename):
+            os.remove(self.filename)
+        self.size = 0
+
+
+def replay(filename: str, file: BinaryIO) -> int:
+    # applies every complete group of a log left behind by a crash to the data file, syncs it
+    # and removes the log; returns the number of groups applied
+    groups = 0
+    with open(filename, 'rb') as log:
+        while True:
+            frame = log.read(FRAME.size)
+            if len(frame) < FRAME.size:
+                break
+            magic, length, crc = FRAME.unpack(frame)
+            payload = log.read(length)
+            if magic != MAGIC or len(payload) < length or zlib.crc32(payload) != crc:
+                break # torn write of the last group
+            offset = 0
+            while offset < length:
+                kind, position, size = ENTRY.unpack_from(payload, offset)
+                offset += ENTRY.size
+                if kind == TRUNCATE:
+                    file.truncate(position)
+                else:
+                    file.seek(position)
+                    file.write(payload[offset:offset + size])
+                offset += size
+            groups += 1
+    file.flush()
+    os.fsync(file.fileno())
+    file.seek(0)
+    os.remove(filename)
+    return groups
@@ -0,0 +1,275 @@
+#!/usr/bin/python
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+from bisect import bisect_left
+from itertools import accumulate, product
+
+from app.hash_serial_overflow import HashFileSerialOverflow
+from app.hash_linked_overflow import HashFileLinkedOverflow
+from app.hash_linear import HashFileLinear
+from app.hash_dynamic import HashFileDynamic
+from app.record import Record
+from app.constants import *
+
+ORGANIZATIONS = {
+    'linear': HashFileLinear,
+    'serial': HashFileSerialOverflow,
+    'linked': HashFileLinkedOverflow,
+    'dynamic': HashFileDynamic,
+}
+
+# share of every operation in a workload
+MIXES = {
+    'read-heavy': {'find_by_id': 0.90, 'insert_record': 0.04, 'update_record': 0.04, 'delete_by_id': 0.02},
+    'balanced': {'find_by_id': 0.50, 'insert_record': 0.20, 'update_record': 0.15, 'delete_by_id': 0.15},
+    'write-heavy': {'find_by_id': 0.10, 'insert_record': 0.45, 'update_record': 0.30, 'delete_by_id': 0.15},
+    'delete-heavy': {'find_by_id': 0.20, 'insert_record': 0.35, 'update_record': 0.05, 'delete_by_id': 0.40},
+}
+
+MAX_KEY = 2 ** 31 - 1 # keys have to fit the 'i' id field
+
+
+class Keys:
+    # keys stored in the file and the key distribution operations draw from
+    def __init__(self, distribution: str, count: int, rnd: random.Random, zipf_s: float):
+        self.distribution = distribution
+        self.rnd = rnd
+        if distribution == 'sequential':
+            self.keys = list(range(count))
+        else:
+            self.keys = rnd.sample(range(MAX_KEY), count)
+        self.positions = {key: i for i, key in enumerate(self.keys)}
+        self.next_key = count
+        self.cursor = 0
+        # cumulative zipf weights over key ranks, rank 0 being the hottest key
+        self.zipf = list(accumulate(1 / (rank + 1) ** zipf_s for rank in range(max(count * 2, 1))))
+
+    def existing(self) -> int:
+        if not self.keys:
+            return self.new()
+        if self.distribution == 'uniform':
+            return self.keys[self.rnd.randrange(len(self.keys))]
+        if self.distribution == 'zipf':
+            n = min(len(self.keys), len(self.zipf))
+            rank = bisect_left(self.zipf, self.rnd.random() * self.zipf[n - 1], 0, n - 1)
+            return self.keys[rank]
+        self.cursor = (self.cursor + 1) % len(self.keys)
+        return self.keys[self.cursor]
+
+    def new(self) -> int:
+        if self.distribution == 'sequential':
+            self.next_key += 1
+            return self.next_key - 1
+        while True:
+            key = self.rnd.randrange(MAX_KEY)
+            if key not in self.positions:
+                return key
+
+    def add(self, key: int):
+        self.positions[key] = len(self.keys)
+        self.keys.append(key)
+
+    def remove(self, key: int):
+        i = self.positions.pop(key)
+        last = self.keys.pop()
+        if i < len(self.keys):
+            self.keys[i] = last
+            self.positions[last] = i
+
+
+def percentile(values, fraction: float) -> float:
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def make_file(organization: str, filename: str, num_buckets: int, blocking_factor: int, step: int, buffer_size: int):
+    record = Record(ATTRIBUTES, FMT, CODING)
+    if organization == 'linear':
+        return HashFileLinear(filename, record, num_buckets, blocking_factor, dict(EMPTY_REC), EMPTY_KEY, step, buffer_size)
+    return ORGANIZATIONS[organization](filename, record, num_buckets, blocking_factor, dict(EMPTY_REC), EMPTY_KEY, buffer_size=buffer_size)
+
+
+def run_scenario(directory: str, scenario: dict, args) -> dict:
+    rnd = random.Random('%d/%s' % (args.seed, scenario['name']))
+    capacity = scenario['num_buckets'] * scenario['blocking_factor']
+    keys = Keys(scenario['distribution'], int(capacity * scenario['load_factor']), rnd, args.zipf_s)
+    filename = os.path.join(directory, scenario['organization'] + '.bin')
+
+    with make_file(scenario['organization'], filename, scenario['num_buckets'], scenario['blocking_factor'], scenario['step'], args.buffer_size) as file:
+        stats = file.enable_stats()
+        file.bulk_load({'id': key, 'number': key, 'string': 'bulk'} for key in keys.keys)
+        bulk_seconds = stats.operations['bulk_load'].total_time
+
+        events = []
+        stats.reset()
+        stats.hook = events.append
+        mix = MIXES[scenario['mix']]
+        operations = list(mix)
+        weights = list(mix.values())
+        results = {operation: [0, 0] for operation in operations} # operation -> [succeeded, failed]
+        for i in range(args.ops):
+            operation = rnd.choices(operations, weights)[0]
+            if operation == 'insert_record':
+                key = keys.new()
+                ok = file.insert_record({'id': key, 'number': i, 'string': 'insert'})
+                if ok:
+                    keys.add(key)
+            elif operation == 'delete_by_id':
+                key = keys.existing()
+                ok = file.delete_by_id(key)
+                if ok:
+                    keys.remove(key)
+            elif operation == 'update_record':
+                ok = file.update_record({'id': keys.existing(), 'number': i, 'string': 'update'})
+            else:
+                ok = file.find_by_id(keys.existing())
+                if isinstance(file, HashFileLinear):
+                    ok = ok[0]
+            results[operation][0 if ok else 1] += 1
+        structure = file.structure_stats()
+
+    seconds = sum(event['seconds'] for event in events)
+    latencies = sorted(event['seconds'] for event in events)
+    per_operation = {}
+    for operation in operations:
+        op_events = [event for event in events if event['operation'] == operation]
+        op_latencies = sorted(event['seconds'] for event in op_events)
+        per_operation[operation] = {
+            'count': len(op_events),
+            'failed': results[operation][1],
+            'p50_ms': percentile(op_latencies, 0.50) * 1000,
+            'p99_ms': percentile(op_latencies, 0.99) * 1000,
+            'blocks_read_per_op': sum(event['blocks_read'] for event in op_events) / max(len(op_events), 1),
+            'blocks_written_per_op': sum(event['blocks_written'] for event in op_events) / max(len(op_events), 1),
+        }
+    n = max(len(events), 1)
+    return dict(scenario, **{
+        'operations': len(events),
+        'seconds': seconds,
+        'throughput': len(events) / seconds if seconds else 0.0,
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'blocks_read_per_op': sum(event['blocks_read'] for event in events) / n,
+        'blocks_written_per_op': sum(event['blocks_written'] for event in events) / n,
+        'seeks_per_op': sum(event['seeks'] for event in events) / n,
+        'bulk_load_seconds': bulk_seconds,
+        'per_operation': per_operation,
+        'structure': structure,
+    })
+
+
+def scenarios(args):
+    for organization, distribution, mix, load_factor, num_buckets, blocking_factor in product(
+            args.organizations, args.distributions, args.mixes, args.load_factors, args.num_buckets, args.blocking_factors):
+        for step in (args.steps if organization == 'linear' else [1]):
+            name = f"{organization}/{distribution}/{mix}/lf={load_factor}/B={num_buckets}/b={blocking_factor}"
+            if organization == 'linear':
+                name += f"/step={step}"
+            yield {
+                'name': name,
+                'organization': organization,
+                'distribution': distribution,
+                'mix': mix,
+                'load_factor': load_factor,
+                'num_buckets': num_buckets,
+                'blocking_factor': blocking_factor,
+                'step': step,
+            }
+
+
+def compare(results: list, baseline: dict, tolerance: float) -> list:
+    # scenarios that got slower or touch more blocks per operation than in the baseline
+    previous = {result['name']: result for result in baseline['results']}
+    regressions = []
+    for result in results:
+        base = previous.get(result['name'])
+        if base is None:
+            continue
+        throughput = result['throughput'] / base['throughput'] if base['throughput'] else 1.0
+        blocks = result['blocks_read_per_op'] + result['blocks_written_per_op']
+        base_blocks = base['blocks_read_per_op'] + base['blocks_written_per_op']
+        if throughput < 1 - tolerance or blocks > base_blocks * (1 + tolerance) + 1e-9:
+            regressions.append({
+                'name': result['name'],
+                'throughput_ratio': throughput,
+                'blocks_per_op': blocks,
+                'baseline_blocks_per_op': base_blocks,
+            })
+    return regressions
+
+
+def parse_list(convert):
+    return lambda value: [convert(item) for item in value.split(',') if item]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the hash file organizations and report the results as JSON.")
+    parser.add_argument('--organizations', type=parse_list(str), default=['linear', 'serial', 'linked'], help=f"comma separated, from {', '.join(ORGANIZATIONS)}")
+    parser.add_argument('--distributions', type=parse_list(str), default=['uniform', 'zipf', 'sequential'])
+    parser.add_argument('--mixes', type=parse_list(str), default=list(MIXES), help=f"comma separated, from {', '.join(MIXES)}")
+    parser.add_argument('--load-factors', type=parse_list(float), default=[0.5, 0.75, 0.9, 0.99])
+    parser.add_argument('--num-buckets', type=parse_list(int), default=[211])
+    parser.add_argument('--blocking-factors', type=parse_list(int), default=[4])
+    parser.add_argument('--steps', type=parse_list(int), default=[1], help="probe steps swept for the linear organization")
+    parser.add_argument('--ops', type=int, default=2000, help="operations per scenario")
+    parser.add_argument('--buffer-size', type=int, default=0, help="buffer pool size; 0 makes every block access reach the file")
+    parser.add_argument('--zipf-s', type=float, default=1.1, help="zipf exponent")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="write the JSON report to this file instead of stdout")
+    parser.add_argument('--compare', metavar='BASELINE', help="JSON report of an earlier run to check for regressions")
+    parser.add_argument('--tolerance', type=float, default=0.1, help="allowed relative change before a scenario counts as a regression")
+    args = parser.parse_args()
+
+    for organization in args.organizations:
+        if organization not in ORGANIZATIONS:
+            parser.error(f"unknown organization {organization}")
+    for mix in args.mixes:
+        if mix not in MIXES:
+            parser.error(f"unknown mix {mix}")
+    for distribution in args.distributions:
+        if distribution not in ('uniform', 'zipf', 'sequential'):
+            parser.error(f"unknown distribution {distribution}")
+
+    directory = tempfile.mkdtemp(prefix='hashfile-benchmark-')
+    try:
+        results = []
+        for scenario in scenarios(args):
+            print(scenario['name'], file=sys.stderr)
+            results.append(run_scenario(directory, scenario, args))
+    finally:
+        shutil.rmtree(directory)
+
+    report = {
+        'version': 1,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'config': {name: value for name, value in vars(args).items() if name not in ('output', 'compare', 'tolerance')},
+        'results': results,
+    }
+    if args.compare:
+        with open(args.compare) as f:
+            report['regressions'] = compare(results, json.load(f), args.tolerance)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+    for regression in report.get('regressions', []):
+        print(f"REGRESSION {regression['name']}: throughput x{regression['throughput_ratio']:.2f}, "
+              f"blocks/op {regression['baseline_blocks_per_op']:.2f} -> {regression['blocks_per_op']:.2f}", file=sys.stderr)
+    if report.get('regressions'):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+import asyncio
+import threading
+import pytest
+from app.async_hash_file import AsyncHashFile
+from app.binary_file import BinaryFile
+from app.constants import ATTRIBUTES, CODING, EMPTY_KEY, EMPTY_REC, FMT
+from app.hash_dynamic import HashFileDynamic
+from app.hash_linear import HashFileLinear
+from app.hash_linked_overflow import HashFileLinkedOverflow
+from app.hash_serial_overflow import HashFileSerialOverflow
+from app.record import Record
+
+
+def make(cls, path):
+    return cls(str(path), Record(ATTRIBUTES, FMT, CODING), 16, 4, dict(EMPTY_REC), EMPTY_KEY)
+
+
+@pytest.mark.parametrize('cls', [HashFileLinear, HashFileSerialOverflow, HashFileLinkedOverflow, HashFileDynamic])
+def test_requests_do_no_io_on_the_event_loop(tmp_path, monkeypatch, cls):
+    path = tmp_path / 'file.bin'
+    with make(cls, path) as file:
+        file.init_file()
+        for id in range(0, 60, 2):
+            file.insert_record({'id': id, 'number': id, 'string': 's'})
+    loop_threads = []
+    read = BinaryFile._file_read
+
+    def file_read(self, *args, **kwargs):
+        if threading.current_thread() is threading.main_thread():
+            loop_threads.append(args)
+        return read(self, *args, **kwargs)
+
+    monkeypatch.setattr(BinaryFile, '_file_read', file_read)
+
+    async def main():
+        # a file whose header, for HashFileDynamic, is not loaded yet
+        async with AsyncHashFile(make(cls, path)) as file:
+            found = await asyncio.gather(*(file.find(id) for id in range(60)))
+            inserted = await asyncio.gather(*(file.insert({'id': id, 'number': id, 'string': 's'}) for id in range(1, 60, 2)))
+            deleted = await asyncio.gather(*(file.delete(id) for id in range(0, 60, 3)))
+            return found, inserted, deleted
+
+    found, inserted, deleted = asyncio.run(main())
+    assert loop_threads == []
+    assert [bool(result[0] if cls is HashFileLinear else result) for result in found] == [id % 2 == 0 for id in range(60)]
+    assert all(inserted) and all(deleted)
+    with make(cls, path) as file:
+        assert sorted(rec['id'] for rec in file.scan()) == [id for id in range(60) if id % 3]
+
+
+@pytest.mark.parametrize('cls', [HashFileLinear, HashFileSerialOverflow, HashFileLinkedOverflow, HashFileDynamic])
+def test_buffer_pool_stays_bounded_under_concurrent_requests(tmp_path, monkeypatch, cls):
+    path = tmp_path / 'file.bin'
+    with make(cls, path) as file:
+        file.init_file()
+    largest = [0]
+    cache = BinaryFile._cache
+
+    def cached(self, *args):
+        cache(self, *args)
+        largest[0] = max(largest[0], len(self._buffer))
+
+    monkeypatch.setattr(BinaryFile, '_cache', cached)
+
+    async def main():
+        file = make(cls, path)
+        file.buffer_size = 4
+        async with AsyncHashFile(file, max_workers=8) as shared:
+            for round in range(4):
+                ids = range(round * 12, (round + 1) * 12)
+                assert all(await asyncio.gather(*(shared.insert({'id': id, 'number': id, 'string': 's'}) for id in ids)))
+                found = await asyncio.gather(*(shared.find(id) for id in range(0, (round + 1) * 12, 3)))
+                assert all(result[0] if cls is HashFileLinear else result for result in found)
+
+    asyncio.run(main())
+    assert 0 < largest[0] <= 4
+    with make(cls, path) as file:
+        assert sorted(rec['id'] for rec in file.scan()) == list(range(48))
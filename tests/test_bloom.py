@@ -0,0 +1,83 @@
+import random
+import pytest
+from app.constants import ATTRIBUTES, CODING, EMPTY_KEY, EMPTY_REC, FMT
+from app.hash_dynamic import HashFileDynamic
+from app.hash_linear import HashFileLinear
+from app.hash_linked_overflow import HashFileLinkedOverflow
+from app.hash_serial_overflow import HashFileSerialOverflow
+from app.record import Record
+
+CLASSES = [HashFileLinear, HashFileSerialOverflow, HashFileLinkedOverflow, HashFileDynamic]
+
+
+def make(cls, path, **options):
+    return cls(str(path), Record(ATTRIBUTES, FMT, CODING), 16, 4, dict(EMPTY_REC), EMPTY_KEY, buffer_size=0, **options)
+
+
+def record(id):
+    return {'id': id, 'number': id, 'string': 's'}
+
+
+def found(file, id) -> bool:
+    result = file.find_by_id(id)
+    return result[0] if isinstance(file, HashFileLinear) else result is not None
+
+
+def filled(cls, path, count):
+    file = make(cls, path)
+    file.init_file()
+    file.enable_bloom()
+    for id in range(0, 2 * count, 2):
+        assert file.insert_record(record(id))
+    return file
+
+
+@pytest.mark.parametrize('cls', CLASSES)
+def test_lookups_of_missing_keys_read_nothing(tmp_path, cls):
+    file = filled(cls, tmp_path / 'file.bin', 40 if cls is HashFileLinear else 120)
+    stats = file.enable_stats()
+    reading = 0
+    for id in range(1, 400, 2):
+        before = stats.blocks_read
+        assert not found(file, id)
+        reading += stats.blocks_read > before
+    assert reading <= 10 # false positives, about 1% of the lookups
+    assert all(found(file, id) for id in range(0, 80, 2))
+    file.close()
+
+
+@pytest.mark.parametrize('cls', CLASSES)
+def test_deleted_and_existing_keys_behave_as_without_filters(tmp_path, cls):
+    rnd = random.Random(7)
+    file = filled(cls, tmp_path / 'file.bin', 0)
+    model = set()
+    for _ in range(400):
+        id = rnd.randrange(50)
+        if rnd.random() < 0.6:
+            assert file.insert_record(record(id)) == (id not in model)
+            model.add(id)
+        else:
+            assert file.delete_by_id(id) == (id in model)
+            model.discard(id)
+    assert [id for id in range(50) if found(file, id)] == sorted(model)
+    file.close()
+
+
+@pytest.mark.parametrize('cls', CLASSES)
+def test_filters_saved_for_another_version_of_the_file_are_rebuilt(tmp_path, monkeypatch, cls):
+    path = tmp_path / 'file.bin'
+    filled(cls, path, 30).close()
+    rebuilds = []
+    rebuild = cls.rebuild_bloom
+    monkeypatch.setattr(cls, 'rebuild_bloom', lambda file: rebuilds.append(file) or rebuild(file))
+    with make(cls, path) as file:
+        file.enable_bloom()
+        assert rebuilds == [] # the saved filters match the file
+        assert found(file, 10) and not found(file, 11)
+    with make(cls, path) as file: # changed without filters, which leaves the saved ones stale
+        for id in range(1, 20, 2):
+            assert file.insert_record(record(id))
+    with make(cls, path) as file:
+        file.enable_bloom()
+        assert len(rebuilds) == 1
+        assert all(found(file, id) for id in range(20))
@@ -0,0 +1,45 @@
+import sys
+import threading
+import pytest
+from app.concurrency import ConcurrentHashFile
+from app.constants import ATTRIBUTES, CODING, EMPTY_KEY, EMPTY_REC, FMT
+from app.hash_dynamic import HashFileDynamic
+from app.hash_linear import HashFileLinear
+from app.hash_linked_overflow import HashFileLinkedOverflow
+from app.hash_serial_overflow import HashFileSerialOverflow
+from app.record import Record
+
+
+@pytest.fixture
+def switching():
+    # switch threads as often as possible, so that unguarded read-modify-writes interleave
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    yield
+    sys.setswitchinterval(interval)
+
+
+@pytest.mark.parametrize('cls', [HashFileLinear, HashFileSerialOverflow, HashFileLinkedOverflow, HashFileDynamic])
+def test_counters_and_bloom_filters_under_threads(tmp_path, switching, cls):
+    file = cls(str(tmp_path / 'file.bin'), Record(ATTRIBUTES, FMT, CODING), 64, 4, dict(EMPTY_REC), EMPTY_KEY)
+    file.init_file()
+    file.enable_bloom()
+    shared = ConcurrentHashFile(file, stripes=16)
+    threads, keys = 8, 160
+
+    def work(t):
+        for id in range(t, keys, threads):
+            assert shared.insert_record({'id': id, 'number': id, 'string': 's'})
+        for id in range(t, keys, 2 * threads):
+            assert shared.delete_by_id(id)
+
+    workers = [threading.Thread(target=work, args=(t,)) for t in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    live = [id for id in range(keys) if id % (2 * threads) >= threads]
+    assert file.occupancy()['records'] == len(live)
+    for id in live:
+        assert file._might_contain(id)
+    shared.close()
@@ -0,0 +1,76 @@
+import random
+import pytest
+from app.constants import ATTRIBUTES, CODING, EMPTY_KEY, EMPTY_REC, FMT
+from app.hash_dynamic import HashFileDynamic
+from app.record import Record
+
+
+def make(cls, path, num_buckets=2, **options):
+    return cls(str(path), Record(ATTRIBUTES, FMT, CODING), num_buckets, 4, dict(EMPTY_REC), EMPTY_KEY, **options)
+
+
+def record(id):
+    return {'id': id, 'number': id, 'string': f's{id}'}
+
+
+def check(file, ids):
+    # every record in the chain of the bucket its key hashes to, and the file no larger than the load allows
+    assert file.num_buckets == (file.initial_buckets << file.level) + file.split
+    assert 0 <= file.split < file.initial_buckets << file.level
+    buckets = {bucket_idx: file._bucket_records(bucket_idx) for bucket_idx in range(file.num_buckets)}
+    assert all(file.hash(rec['id']) == bucket_idx for bucket_idx, records in buckets.items() for rec in records)
+    assert sorted(rec['id'] for records in buckets.values() for rec in records) == sorted(ids)
+    assert len(ids) <= file.max_load * file.num_buckets * file.blocking_factor
+    assert file.structure_stats()['records'] == len(ids)
+
+
+@pytest.mark.parametrize('ids', [list(range(300)), random.Random(1).sample(range(10 ** 6), 300), [8 * i for i in range(300)]])
+def test_splits_advance_the_pointer_and_then_the_level(tmp_path, ids):
+    file = make(HashFileDynamic, tmp_path / 'file.bin')
+    file.init_file()
+    state = (0, 0)
+    for count, id in enumerate(ids, 1):
+        assert file.insert_record(record(id))
+        level, split = file.level, file.split
+        if (level, split) != state: # one split at a time, the level rising once every bucket of the round was split
+            assert (level, split) in ((state[0], state[1] + 1), (state[0] + 1, 0))
+            assert split > 0 or state[1] + 1 == file.initial_buckets << state[0]
+            state = level, split
+        if count % 25 == 0:
+            check(file, ids[:count])
+    assert file.level >= 5
+    file.close()
+    with make(HashFileDynamic, tmp_path / 'file.bin', 7) as file: # the layout comes from the file header
+        assert file.find_by_id(ids[0]) is not None
+        assert (file.level, file.split) == state
+        check(file, ids)
+
+
+def test_deletes_and_inserts_across_splits(tmp_path):
+    rnd = random.Random(4)
+    file = make(HashFileDynamic, tmp_path / 'file.bin', 3, max_load=0.5)
+    file.init_file()
+    model = set()
+    for op in range(1500):
+        id = rnd.randrange(400)
+        if rnd.random() < 0.65:
+            assert file.insert_record(record(id)) == (id not in model)
+            model.add(id)
+        else:
+            assert file.delete_by_id(id) == (id in model)
+            model.discard(id)
+        if op % 100 == 0:
+            check(file, model) # deletes leave the buckets as they are
+            assert [id for id in range(400) if file.find_by_id(id) is not None] == sorted(model)
+    assert [id for id in range(400) if file.find_by_id(id) is not None] == sorted(model)
+    file.close()
+
+
+def test_bulk_load_then_grow(tmp_path):
+    file = make(HashFileDynamic, tmp_path / 'file.bin', 4)
+    assert file.bulk_load(record(id) for id in range(0, 200, 2)) == 100
+    assert (file.level, file.split, file.num_buckets) == (0, 0, 4) # overflow chains until the next insert
+    assert all(file.insert_many([record(id) for id in range(1, 200, 2)]))
+    assert file.level > 0
+    check(file, range(200))
+    file.close()
@@ -0,0 +1,102 @@
+import random
+import pytest
+from app.constants import ATTRIBUTES, CODING, EMPTY_KEY, EMPTY_REC, FMT
+from app.hash_dynamic import HashFileDynamic
+from app.hash_linear import HashFileLinear
+from app.hash_linked_overflow import HashFileLinkedOverflow
+from app.hash_serial_overflow import HashFileSerialOverflow
+from app.record import Record
+
+CLASSES = [HashFileLinear, HashFileSerialOverflow, HashFileLinkedOverflow, HashFileDynamic]
+
+
+def make(cls, path, **options):
+    return cls(str(path), Record(ATTRIBUTES, FMT, CODING), 16, 4, dict(EMPTY_REC), EMPTY_KEY, **options)
+
+
+def record(id, number):
+    return {'id': id, 'number': number, 'string': f's{id}'}
+
+
+def check(file, model):
+    for number in range(6):
+        assert sorted(rec['id'] for rec in file.find_by('number', number)) == sorted(id for id, n in model.items() if n == number)
+    assert len(list(file._indexes['number'].file.scan())) == len(model)
+
+
+def run(file, model, rnd):
+    id, number = rnd.randrange(40), rnd.randrange(6)
+    op = rnd.choice(['insert', 'update', 'upsert', 'update_if', 'delete', 'logical_delete', 'get_and_delete', 'many'])
+    if op == 'insert':
+        assert file.insert_record(record(id, number)) == (id not in model)
+        model.setdefault(id, number)
+    elif op == 'update':
+        assert file.update_record(record(id, number)) == (id in model)
+        if id in model:
+            model[id] = number
+    elif op == 'upsert':
+        assert file.upsert(record(id, number))
+        model[id] = number
+    elif op == 'update_if':
+        expected = rnd.randrange(6)
+        assert file.update_if(id, {'number': expected}, record(id, number)) == (model.get(id) == expected)
+        if model.get(id) == expected:
+            model[id] = number
+    elif op == 'delete':
+        assert file.delete_by_id(id) == (id in model)
+        model.pop(id, None)
+    elif op == 'logical_delete' and hasattr(file, 'logical_delete_by_id'):
+        assert file.logical_delete_by_id(id) == (id in model)
+        model.pop(id, None)
+    elif op == 'get_and_delete':
+        deleted = file.get_and_delete(id)
+        assert (None if deleted is None else deleted['number']) == model.pop(id, None)
+    elif op == 'many':
+        ids = rnd.sample(range(40), 5)
+        inserted = file.insert_many([record(i, number) for i in ids[:3]])
+        assert inserted == [i not in model for i in ids[:3]]
+        for i in ids[:3]:
+            model.setdefault(i, number)
+        assert file.update_many([record(i, (number + 1) % 6) for i in ids[3:]]) == [i in model for i in ids[3:]]
+        for i in ids[3:]:
+            if i in model:
+                model[i] = (number + 1) % 6
+        assert file.delete_many(ids[:1]) == [True]
+        del model[ids[0]]
+
+
+@pytest.mark.parametrize('cls', CLASSES)
+def test_find_by_follows_every_change_of_the_file(tmp_path, cls):
+    rnd = random.Random(3)
+    path = tmp_path / 'file.bin'
+    file = make(cls, path)
+    file.init_file()
+    file.create_index('number')
+    model = {}
+    for step in range(300):
+        run(file, model, rnd)
+        if step % 20 == 0:
+            check(file, model)
+    check(file, model)
+    file.close()
+    with make(cls, path) as file:
+        file.create_index('number') # the saved index, as it is
+        check(file, model)
+
+
+@pytest.mark.parametrize('cls', CLASSES)
+def test_index_of_an_existing_file_is_built_and_rebuilt(tmp_path, cls):
+    path = tmp_path / 'file.bin'
+    with make(cls, path) as file:
+        file.init_file()
+        assert all(file.insert_many([record(id, id % 6) for id in range(30)]))
+        assert file.find_by('number', 2) == list(file.scan(where=[('number', '==', 2)])) # without an index, a scan
+        file.create_index('number')
+        check(file, {id: id % 6 for id in range(30)})
+    with make(cls, path) as file: # changed while the index was not loaded
+        assert file.upsert(record(3, 5))
+    with make(cls, path) as file:
+        file.create_index('number', rebuild=True)
+        check(file, {**{id: id % 6 for id in range(30)}, 3: 5})
+        file.drop_index('number')
+        assert file.find_by('number', 5) == list(file.scan(where=[('number', '==', 5)]))
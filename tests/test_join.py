@@ -0,0 +1,70 @@
+import pytest
+from app.constants import ATTRIBUTES, CODING, EMPTY_KEY, EMPTY_REC, FMT
+from app.hash_dynamic import HashFileDynamic
+from app.hash_linear import HashFileLinear
+from app.hash_linked_overflow import HashFileLinkedOverflow
+from app.hash_serial_overflow import HashFileSerialOverflow
+from app.record import Record
+
+CLASSES = [HashFileLinear, HashFileSerialOverflow, HashFileLinkedOverflow, HashFileDynamic]
+MINE = range(0, 80, 2)
+THEIRS = range(0, 120, 3)
+
+
+def make(cls, path, num_buckets=16, **options):
+    return cls(str(path), Record(ATTRIBUTES, FMT, CODING), num_buckets, 4, dict(EMPTY_REC), EMPTY_KEY, **options)
+
+
+def filled(cls, path, ids, num_buckets=16, **options):
+    file = make(cls, path, num_buckets, **options)
+    file.init_file()
+    for id in ids:
+        assert file.insert_record({'id': id, 'number': id // 2, 'string': f's{id}'})
+    file.delete_by_id(ids[1]) # leaves a tombstone or a moved record behind
+    return file
+
+
+def check(mine, theirs, their_ids=THEIRS):
+    ours = set(MINE) - {MINE[1]}
+    other = set(their_ids) - {their_ids[1]}
+    assert sorted(record['id'] for record in mine.intersect(theirs, memory_records=5)) == sorted(ours & other)
+    assert sorted(record['id'] for record in mine.difference(theirs, memory_records=5)) == sorted(ours - other)
+    pairs = sorted((record['id'], match['id']) for record, match in mine.join(theirs, memory_records=5))
+    assert pairs == sorted((id, id) for id in ours & other)
+    pairs = sorted((record['id'], match['id']) for record, match in mine.join(theirs, on='number', memory_records=5))
+    assert pairs == sorted((id, id // 2) for id in ours if id // 2 in other)
+
+
+@pytest.mark.parametrize('other', CLASSES)
+@pytest.mark.parametrize('cls', CLASSES)
+def test_aligned_files(tmp_path, cls, other):
+    mine = filled(cls, tmp_path / 'mine.bin', MINE)
+    theirs = filled(other, tmp_path / 'theirs.bin', THEIRS)
+    assert (mine._placement() == theirs._placement()) == ((cls is HashFileDynamic) == (other is HashFileDynamic))
+    check(mine, theirs)
+    mine.close()
+    theirs.close()
+
+
+@pytest.mark.parametrize('other', CLASSES)
+@pytest.mark.parametrize('cls', CLASSES)
+def test_files_with_different_buckets(tmp_path, cls, other):
+    options = {'double_hashing': True} if cls is HashFileLinear else {}
+    mine = filled(cls, tmp_path / 'mine.bin', MINE, **options)
+    theirs = filled(other, tmp_path / 'theirs.bin', THEIRS, 11)
+    assert mine._placement() != theirs._placement()
+    check(mine, theirs)
+    mine.close()
+    theirs.close()
+
+
+@pytest.mark.parametrize('their_ids', [THEIRS, range(0, 240, 3)])
+def test_dynamic_files_that_grew(tmp_path, their_ids):
+    # aligned while both have split the same buckets
+    mine = filled(HashFileDynamic, tmp_path / 'mine.bin', MINE, 4)
+    theirs = filled(HashFileDynamic, tmp_path / 'theirs.bin', their_ids, 4)
+    assert mine.level > 0
+    assert (mine._placement() == theirs._placement()) == (their_ids is THEIRS)
+    check(mine, theirs, their_ids)
+    mine.close()
+    theirs.close()
@@ -0,0 +1,145 @@
+import random
+import pytest
+from app.constants import ATTRIBUTES, CODING, EMPTY_KEY, EMPTY_REC, FMT
+from app.hash_functions import division, mixing, multiplicative
+from app.hash_linear import HashFileLinear
+from app.record import Record
+
+
+def make(cls, path, num_buckets=7, blocking_factor=3, **options):
+    return cls(str(path), Record(ATTRIBUTES, FMT, CODING), num_buckets, blocking_factor, dict(EMPTY_REC), EMPTY_KEY, **options)
+
+
+def record(id):
+    return {'id': id, 'number': id, 'string': f's{id}'}
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_delete_from_a_full_file_keeps_every_other_record(tmp_path, seed):
+    ids = random.Random(seed).sample(range(100), 21)
+    for deleted in ids:
+        file = make(HashFileLinear, tmp_path / 'file.bin')
+        file.init_file()
+        for id in ids:
+            assert file.insert_record(record(id))
+        assert file.delete_by_id(deleted)
+        assert [id for id in ids if id != deleted and not file.find_by_id(id)[0]] == []
+        assert file.insert_record(record(deleted))
+        file.close()
+
+
+def test_delete_from_a_full_file_shifts_around_the_whole_file(tmp_path):
+    # any layout of a full file is valid, since searches walk every bucket; here most records are far
+    # from home, so the holes left by the backward shift move around the file past the deleted bucket
+    ids = list(range(50, 71))
+    for deleted in ids:
+        file = make(HashFileLinear, tmp_path / 'file.bin')
+        file.init_file()
+        for bucket_idx in range(7):
+            file._write_bucket(bucket_idx, [dict(record(id), status=1) for id in ids[3 * bucket_idx:3 * bucket_idx + 3]])
+        assert file.delete_by_id(deleted)
+        assert [id for id in ids if id != deleted and not file.find_by_id(id)[0]] == []
+        file.close()
+
+
+def displacements(file):
+    return [(bucket_idx - file.hash(rec['id'])) % file.num_buckets
+            for bucket_idx in range(file.num_buckets) for rec in file._read_bucket(bucket_idx) if rec['status'] == 1]
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_robin_hood_keeps_every_record_within_max_displacement(tmp_path, seed):
+    rnd = random.Random(seed)
+    path = tmp_path / 'file.bin'
+    file = make(HashFileLinear, path, 11, 3, robin_hood=True)
+    file.init_file()
+    model = set()
+    for op in range(300):
+        id = rnd.randrange(60)
+        if rnd.random() < 0.6:
+            inserted = file.insert_record(record(id))
+            assert inserted == (id not in model and len(model) < 33)
+            if inserted:
+                model.add(id)
+        else:
+            assert file.delete_by_id(id) == (id in model)
+            model.discard(id)
+        assert max(displacements(file), default=0) <= file.max_displacement
+        if op % 50 == 0:
+            file.close()
+            file = make(HashFileLinear, path, 11, 3, robin_hood=True)
+        assert sorted(rec['id'] for rec in file.scan()) == sorted(model)
+    bound = file.max_displacement
+    file.close()
+    assert make(HashFileLinear, path, 11, 3, robin_hood=True).occupancy()['max_displacement'] == bound
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_robin_hood_misses_stop_within_max_displacement(tmp_path, seed):
+    ids = random.Random(seed).sample(range(1000), 30)
+    reads = {}
+    for robin_hood in (True, False):
+        file = make(HashFileLinear, tmp_path / f'{robin_hood}.bin', 11, 3, buffer_size=0, robin_hood=robin_hood)
+        file.init_file()
+        for id in ids:
+            assert file.insert_record(record(id))
+        stats = file.enable_stats()
+        reads[robin_hood] = []
+        for id in range(1000, 1100):
+            before = stats.blocks_read
+            assert not file.find_by_id(id)[0]
+            reads[robin_hood].append(stats.blocks_read - before)
+        if robin_hood:
+            assert max(reads[True]) <= file.max_displacement + 1
+        file.close()
+    assert sum(reads[True]) < sum(reads[False])
+
+
+def found(file, id) -> bool:
+    return file.find_by_id(id)[0]
+
+
+@pytest.mark.parametrize('num_buckets', [11, 12])
+@pytest.mark.parametrize('hash_function', [division, multiplicative, mixing])
+def test_double_hashing_finds_records_after_deletes(tmp_path, hash_function, num_buckets):
+    rnd = random.Random(num_buckets)
+    file = make(HashFileLinear, tmp_path / 'file.bin', num_buckets, 3, double_hashing=True, hash_function=hash_function)
+    file.init_file()
+    model = {}
+    for op in range(600):
+        id = rnd.randrange(60)
+        choice = rnd.random()
+        if choice < 0.5:
+            inserted = file.insert_record(dict(record(id), number=op))
+            assert inserted == (id not in model and len(model) < 3 * num_buckets)
+            if inserted:
+                model[id] = op
+        elif choice < 0.6:
+            assert file.update_record(dict(record(id), number=-op)) == (id in model)
+            if id in model:
+                model[id] = -op
+        elif choice < 0.8:
+            assert file.delete_by_id(id) == (id in model)
+            model.pop(id, None)
+        else:
+            assert file.logical_delete_by_id(id) == (id in model)
+            model.pop(id, None)
+        if op % 10 == 0:
+            assert [id for id in range(60) if found(file, id)] == sorted(model)
+    assert [id for id in range(60) if found(file, id)] == sorted(model)
+    assert {rec['id']: rec['number'] for rec in file.scan()} == model
+    assert file.occupancy()['tombstones'] == file.structure_stats()['tombstones']
+    file.close()
+
+
+def test_double_hashing_probes_every_bucket_of_a_full_file(tmp_path):
+    file = make(HashFileLinear, tmp_path / 'file.bin', 12, 2, double_hashing=True)
+    file.init_file()
+    ids = [12 * i for i in range(24)] # all at home in bucket 0
+    assert all(file.insert_record(record(id)) for id in ids)
+    assert not file.insert_record(record(1000))
+    for id in ids:
+        assert file.delete_by_id(id)
+        assert [other for other in ids if not found(file, other)] == [id]
+        assert file.insert_record(record(id))
+    file.close()
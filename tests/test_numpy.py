@@ -0,0 +1,75 @@
+import random
+import pytest
+from app.constants import ATTRIBUTES, CODING, EMPTY_KEY, EMPTY_REC, FMT
+from app.hash_dynamic import HashFileDynamic
+from app.hash_functions import division, mixing
+from app.hash_linear import HashFileLinear
+from app.hash_linked_overflow import HashFileLinkedOverflow
+from app.hash_serial_overflow import HashFileSerialOverflow
+from app.record import Record
+
+np = pytest.importorskip('numpy')
+
+FILES = [
+    (HashFileLinear, 17, {}),
+    (HashFileLinear, 16, {'step': 3}),
+    (HashFileLinear, 17, {'double_hashing': True}),
+    (HashFileLinear, 17, {'robin_hood': True}),
+    (HashFileSerialOverflow, 8, {}),
+    (HashFileSerialOverflow, 8, {'deferred_delete': True}),
+    (HashFileLinkedOverflow, 8, {'overflow_blocking_factor': 2}),
+    (HashFileDynamic, 4, {}),
+]
+
+
+def make(cls, path, num_buckets, **options):
+    return cls(str(path), Record(ATTRIBUTES, FMT, CODING), num_buckets, 4, dict(EMPTY_REC), EMPTY_KEY, **options)
+
+
+def found(file, id) -> bool:
+    result = file.find_by_id(id)
+    return result[0] if isinstance(file, HashFileLinear) else result is not None
+
+
+def filled(path, cls, num_buckets, options, hash_function):
+    # most buckets full, with synonyms further along the probe sequence or in the overflow records
+    file = make(cls, path, num_buckets, hash_function=hash_function, **options)
+    file.init_file()
+    rnd = random.Random(5)
+    model = {}
+    for op in range(300):
+        id = rnd.randrange(100)
+        if rnd.random() < 0.75 and len(model) < 60:
+            if file.insert_record({'id': id, 'number': op, 'string': f's{id}'}):
+                model[id] = op
+        elif file.delete_by_id(id):
+            del model[id]
+    return file, model
+
+
+@pytest.mark.parametrize('hash_function', [division, mixing])
+@pytest.mark.parametrize('cls, num_buckets, options', FILES)
+def test_find_many_agrees_with_find_by_id(tmp_path, monkeypatch, cls, num_buckets, options, hash_function):
+    file, model = filled(tmp_path / 'file.bin', cls, num_buckets, options, hash_function)
+    fallbacks = []
+    find_record = cls._find_record
+    monkeypatch.setattr(cls, '_find_record', lambda file, id: fallbacks.append(id) or find_record(file, id))
+    ids = list(range(110))
+    records, hits = file.find_many(ids)
+    assert hits.tolist() == [found(file, id) for id in ids]
+    assert hits.tolist() == [id in model for id in ids]
+    for id, record, hit in zip(ids, records, hits):
+        if hit:
+            assert (record['id'], record['number'], record['string']) == (id, model[id], f's{id}'.encode())
+    # the organizations with overflow records look up the ids missing from full buckets one by one
+    assert bool(fallbacks) == (cls is not HashFileLinear)
+    assert len(file.find_many([])[0]) == 0
+    file.close()
+
+
+@pytest.mark.parametrize('cls, num_buckets, options', FILES)
+def test_to_numpy_holds_the_live_records(tmp_path, cls, num_buckets, options):
+    file, model = filled(tmp_path / 'file.bin', cls, num_buckets, options, division)
+    records, live = file.to_numpy()
+    assert sorted(zip(records['id'][live].tolist(), records['number'][live].tolist())) == sorted(model.items())
+    file.close()
@@ -0,0 +1,115 @@
+import os
+from contextlib import nullcontext
+import pytest
+from app.constants import ATTRIBUTES, CODING, EMPTY_KEY, EMPTY_REC, FMT
+from app.hash_dynamic import HashFileDynamic
+from app.hash_linear import HashFileLinear
+from app.hash_linked_overflow import HashFileLinkedOverflow
+from app.hash_serial_overflow import HashFileSerialOverflow
+from app.parallel import ParallelHashFile
+from app.record import Record
+
+
+def make(cls, path, num_buckets, blocking_factor, **options):
+    return cls(str(path), Record(ATTRIBUTES, FMT, CODING), num_buckets, blocking_factor, dict(EMPTY_REC), EMPTY_KEY, **options)
+
+
+def contents(file):
+    return sorted((rec['id'], rec['number']) for rec in file.scan())
+
+
+def filled(cls, path, ids, num_buckets=10, blocking_factor=3, **options):
+    file = make(cls, path, num_buckets, blocking_factor, **options)
+    file.init_file()
+    for id in ids:
+        assert file.insert_record({'id': id, 'number': id * 7, 'string': f's{id}'})
+    return file
+
+
+@pytest.mark.parametrize('cls, options', [
+    (HashFileLinear, {}),
+    (HashFileLinear, {'robin_hood': True}),
+    (HashFileLinear, {'double_hashing': True}),
+    (HashFileSerialOverflow, {}),
+    (HashFileSerialOverflow, {'deferred_delete': True}),
+    (HashFileLinkedOverflow, {}),
+    (HashFileLinkedOverflow, {'overflow_blocking_factor': 2}),
+    (HashFileDynamic, {}),
+])
+def test_reorganize_keeps_every_record(tmp_path, cls, options):
+    path = tmp_path / 'file.bin'
+    file = filled(cls, path, range(25), **options)
+    for id in range(0, 25, 5):
+        assert file.delete_by_id(id)
+    if hasattr(file, 'logical_delete_by_id'):
+        assert file.logical_delete_by_id(1)
+    expected = contents(file)
+    # grows, shrinks to just enough slots, changes the blocking factor
+    for num_buckets, blocking_factor in ((17, 2), (7, 3), (40, 1), (5, 4)):
+        assert file.reorganize(num_buckets, blocking_factor) == len(expected)
+        assert contents(file) == expected
+        assert not os.path.exists(f'{path}.reorg')
+    file.close()
+    reopened = make(cls, path, file.num_buckets, file.blocking_factor, **options)
+    assert contents(reopened) == expected
+    reopened.close()
+
+
+@pytest.mark.parametrize('options', [{}, {'robin_hood': True}, {'double_hashing': True}, {'step': 3}])
+def test_reorganize_linear_too_small_keeps_original(tmp_path, options):
+    path = tmp_path / 'file.bin'
+    file = filled(HashFileLinear, path, range(25), **options)
+    expected = contents(file)
+    with pytest.raises(ValueError):
+        file.reorganize(4)
+    assert contents(file) == expected
+    assert file.num_buckets == 10
+    assert not os.path.exists(f'{path}.reorg')
+    file.close()
+
+
+def test_reorganize_linear_step_sharing_a_divisor(tmp_path):
+    # with step 2 and 8 buckets, keys only probe the 4 buckets of matching parity
+    path = tmp_path / 'file.bin'
+    file = filled(HashFileLinear, path, range(10), num_buckets=9, step=2)
+    expected = contents(file)
+    assert file.reorganize(8, 2) == 10 # 5 homes of each parity, 8 slots per cycle
+    assert contents(file) == expected
+    file.close()
+
+    path = tmp_path / 'even.bin'
+    file = filled(HashFileLinear, path, range(0, 20, 2), num_buckets=9, step=2)
+    expected = contents(file)
+    with pytest.raises(ValueError): # 16 slots in all, but 10 keys in a cycle of 8
+        file.reorganize(8, 2)
+    assert contents(file) == expected
+    assert file.num_buckets == 9
+    assert not os.path.exists(f'{path}.reorg')
+    file.close()
+
+
+@pytest.mark.parametrize('step, num_buckets, blocking_factor, ids', [
+    (1, 4, 3, range(13)),
+    (2, 8, 2, range(0, 20, 2)),
+    (3, 6, 3, range(0, 21, 3)),
+])
+def test_linear_bulk_load_raises_when_records_do_not_fit(tmp_path, step, num_buckets, blocking_factor, ids):
+    path = tmp_path / 'file.bin'
+    file = make(HashFileLinear, path, num_buckets, blocking_factor, step=step)
+    with pytest.raises(ValueError):
+        file.bulk_load({'id': id, 'number': id, 'string': 's'} for id in ids)
+    assert not os.path.exists(path)
+
+
+@pytest.mark.parametrize('cls', [HashFileLinear, HashFileSerialOverflow, HashFileLinkedOverflow, HashFileDynamic])
+def test_parallel_reorganize_keeps_every_record(tmp_path, cls):
+    path = tmp_path / 'file.bin'
+    file = filled(cls, path, range(25))
+    expected = contents(file)
+    parallel = ParallelHashFile(file, workers=2)
+    assert parallel.reorganize(7, 4) == len(expected)
+    assert contents(file) == expected
+    with pytest.raises(ValueError) if cls is HashFileLinear else nullcontext():
+        parallel.reorganize(4, 3)
+    assert contents(file) == expected
+    file.close()
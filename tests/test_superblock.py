@@ -0,0 +1,157 @@
+import os
+import shutil
+import pytest
+from app import superblock
+from app.constants import ATTRIBUTES, CODING, EMPTY_KEY, EMPTY_REC, FMT
+from app.hash_dynamic import HashFileDynamic
+from app.hash_linear import HashFileLinear
+from app.hash_linked_overflow import HashFileLinkedOverflow
+from app.hash_serial_overflow import HashFileSerialOverflow
+from app.parallel import ParallelHashFile
+from app.record import Record
+
+CLASSES = [HashFileLinear, HashFileSerialOverflow, HashFileLinkedOverflow, HashFileDynamic]
+
+
+def make(cls, path, **options):
+    return cls(str(path), Record(ATTRIBUTES, FMT, CODING), 16, 4, dict(EMPTY_REC), EMPTY_KEY, **options)
+
+
+def contents(file):
+    return sorted((rec['id'], rec['number']) for rec in file.scan())
+
+
+def filled(cls, path, ids, **options):
+    with make(cls, path, **options) as file:
+        file.init_file()
+        for id in ids:
+            file.insert_record({'id': id, 'number': id, 'string': 's'})
+
+
+def legacy(cls, path, ids):
+    # a file as written before the superblock moved into it, with its superblock in <filename>.super
+    filled(cls, f'{path}.new', ids)
+    with open(f'{path}.new', 'rb') as new, open(path, 'wb') as old:
+        new.seek(superblock.SIZE)
+        shutil.copyfileobj(new, old)
+    with make(cls, path) as file:
+        file.occupancy() # saves the missing superblock next to the file, with its counters
+
+
+@pytest.mark.parametrize('cls', CLASSES)
+def test_the_data_file_describes_itself(tmp_path, cls):
+    path = tmp_path / 'file.bin'
+    filled(cls, path, range(30), use_mmap=cls is HashFileLinear)
+    assert not os.path.exists(superblock.path(str(path)))
+    data = superblock.read(str(path))
+    assert data['class'] == cls.__name__ and data['version'] == superblock.VERSION
+    assert data['current'] and data['counters']['records'] == 30
+    moved = tmp_path / 'moved.bin'
+    shutil.move(path, moved)
+    with superblock.open(str(moved)) as file:
+        assert type(file) is cls
+        assert contents(file) == [(id, id) for id in range(30)]
+        assert file.occupancy()['records'] == 30
+
+
+@pytest.mark.parametrize('cls', CLASSES)
+def test_close_without_changes_leaves_the_file_alone(tmp_path, cls):
+    path = tmp_path / 'file.bin'
+    filled(cls, path, range(20))
+    before = os.stat(path).st_mtime_ns
+    with make(cls, path) as file:
+        assert file.find_by_id(3)
+        assert len(list(file.scan())) == 20
+        assert file.occupancy()['records'] == 20
+    assert os.stat(path).st_mtime_ns == before
+    with make(cls, path) as file:
+        file.insert_record({'id': 100, 'number': 1, 'string': 's'})
+    data = superblock.read(str(path))
+    assert data['current'] and data['counters']['records'] == 21
+
+
+@pytest.mark.parametrize('cls', CLASSES)
+def test_counters_of_a_file_that_was_not_closed_are_counted_again(tmp_path, cls):
+    path = tmp_path / 'file.bin'
+    filled(cls, path, range(20))
+    file = make(cls, path)
+    file.insert_record({'id': 100, 'number': 1, 'string': 's'})
+    file.flush()
+    assert not superblock.read(str(path))['current']
+    file._file.close() # the process dies without closing the file
+    with make(cls, path) as file:
+        assert file.occupancy()['records'] == 21
+    assert superblock.read(str(path))['counters']['records'] == 21
+    before = os.stat(path).st_mtime_ns
+    with make(cls, path) as file:
+        file.open()
+        assert file._counters['records'] == 21
+    assert os.stat(path).st_mtime_ns == before
+
+
+@pytest.mark.parametrize('cls', CLASSES)
+def test_parallel_workers_do_not_write_the_superblock(tmp_path, monkeypatch, cls):
+    path = tmp_path / 'file.bin'
+    filled(cls, path, range(0, 40, 2))
+    writers = tmp_path / 'writers'
+    write = superblock.write
+
+    def logged(file, *args):
+        with open(writers, 'a') as log: # the workers are forked with this function in place
+            log.write(f'{os.getpid()}\n')
+        write(file, *args)
+
+    monkeypatch.setattr(superblock, 'write', logged)
+    with ParallelHashFile(make(cls, path), workers=2) as parallel:
+        assert len(parallel.find_records(list(range(40)))) == 40
+        assert len(list(parallel.scan())) == 20
+        assert all(parallel.insert_many([{'id': id, 'number': id, 'string': 's'} for id in range(1, 40, 2)]))
+    assert set(writers.read_text().split()) == {str(os.getpid())}
+    with make(cls, path) as file:
+        assert file.occupancy()['records'] == 40
+    assert superblock.read(str(path))['counters']['records'] == 40
+
+
+@pytest.mark.parametrize('cls', CLASSES)
+def test_files_without_a_superblock_of_their_own(tmp_path, cls):
+    path = tmp_path / 'file.bin'
+    legacy(cls, path, range(25))
+    assert superblock.read(str(path))['current']
+    with make(cls, path) as file:
+        assert contents(file) == [(id, id) for id in range(25)]
+        file.insert_record({'id': 100, 'number': 1, 'string': 's'})
+    data = superblock.read(str(path))
+    assert data['current'] and data['counters']['records'] == 26
+    superblock.upgrade(str(path))
+    assert not os.path.exists(superblock.path(str(path)))
+    data = superblock.read(str(path))
+    assert data['version'] == superblock.VERSION and data['counters']['records'] == 26
+    with superblock.open(str(path)) as file:
+        assert contents(file) == [(id, id) for id in range(25)] + [(100, 1)]
+
+
+@pytest.mark.parametrize('cls', CLASSES)
+def test_reorganize_moves_the_superblock_into_the_file(tmp_path, cls):
+    path = tmp_path / 'file.bin'
+    legacy(cls, path, range(25))
+    with make(cls, path) as file:
+        file.reorganize(9)
+        assert contents(file) == [(id, id) for id in range(25)]
+    assert not os.path.exists(superblock.path(str(path)))
+    assert superblock.read(str(path))['counters']['records'] == 25
+
+
+@pytest.mark.parametrize('cls', CLASSES[1:])
+def test_occupancy_keeps_a_bound_when_the_bloom_filter_skips_reading_chains(tmp_path, cls):
+    path = tmp_path / 'file.bin'
+    with make(cls, path) as file:
+        file.init_file()
+        file.enable_bloom()
+        for id in range(0, 200, 2):
+            file.insert_record({'id': id, 'number': id, 'string': 's'})
+        assert all(file.insert_many([{'id': id, 'number': id, 'string': 's'} for id in range(1, 200, 2)]))
+        stats = file.enable_stats()
+        occupancy = file.occupancy()
+        assert stats.blocks_read == 0
+        assert occupancy['records'] == 200
+        assert occupancy['longest_search'] >= file.structure_stats()['longest_search']
@@ -0,0 +1,108 @@
+import os
+import shutil
+import subprocess
+import sys
+import pytest
+from app import wal
+from app.binary_file import BinaryFile
+from app.constants import ATTRIBUTES, CODING, EMPTY_KEY, EMPTY_REC, FMT
+from app.hash_dynamic import HashFileDynamic
+from app.hash_linear import HashFileLinear
+from app.hash_linked_overflow import HashFileLinkedOverflow
+from app.hash_serial_overflow import HashFileSerialOverflow
+from app.record import Record
+
+CLASSES = [HashFileLinear, HashFileSerialOverflow, HashFileLinkedOverflow, HashFileDynamic]
+GROUP = 4
+
+
+def make(cls, path):
+    return cls(str(path), Record(ATTRIBUTES, FMT, CODING), 8, 2, dict(EMPTY_REC), EMPTY_KEY)
+
+
+def contents(file):
+    return sorted((rec['id'], rec['number']) for rec in file.scan())
+
+
+def crashed(cls, tmp_path, monkeypatch, inserts, write_back=True):
+    # the data file and the log as a process dying after the given inserts leaves them: the log is
+    # synced on every commit, and without write_back no committed page reached the data file yet
+    path = tmp_path / 'file.bin'
+    file = make(cls, path)
+    file.init_file()
+    file.enable_wal(group_size=GROUP)
+    if not write_back:
+        monkeypatch.setattr(BinaryFile, '_write_back', lambda self: None)
+    for id in range(inserts):
+        file.insert_record({'id': id, 'number': id * 3, 'string': f's{id}'})
+    monkeypatch.undo()
+    crash = tmp_path / 'crash.bin'
+    shutil.copyfile(path, crash)
+    shutil.copyfile(f'{path}.wal', f'{crash}.wal')
+    return crash
+
+
+def committed(inserts):
+    return [(id, id * 3) for id in range(inserts // GROUP * GROUP)]
+
+
+@pytest.mark.parametrize('cls', CLASSES)
+@pytest.mark.parametrize('write_back', [True, False])
+def test_replay_recovers_committed_groups(tmp_path, monkeypatch, cls, write_back):
+    crash = crashed(cls, tmp_path, monkeypatch, 3 * GROUP + 2, write_back)
+    with make(cls, crash) as file:
+        file.open()
+        assert not os.path.exists(f'{crash}.wal')
+        assert contents(file) == committed(3 * GROUP + 2)
+        for id, _ in committed(3 * GROUP + 2):
+            assert file.find_by_id(id)
+
+
+@pytest.mark.parametrize('cls', CLASSES)
+def test_replay_is_idempotent(tmp_path, monkeypatch, cls):
+    # a crash during replay leaves the log in place, so it is replayed again over its own result
+    crash = crashed(cls, tmp_path, monkeypatch, 2 * GROUP + 1, write_back=False)
+    log = tmp_path / 'copy.wal'
+    shutil.copyfile(f'{crash}.wal', log)
+    with open(crash, 'r+b') as f:
+        assert wal.replay(f'{crash}.wal', f) == 2
+    shutil.copyfile(log, f'{crash}.wal')
+    with make(cls, crash) as file:
+        assert contents(file) == committed(2 * GROUP + 1)
+        file.insert_record({'id': 100, 'number': 1, 'string': 'x'})
+    with make(cls, crash) as file:
+        assert contents(file) == committed(2 * GROUP + 1) + [(100, 1)]
+
+
+@pytest.mark.parametrize('cls', CLASSES)
+@pytest.mark.parametrize('torn', ['header', 'payload', 'checksum'])
+def test_torn_tail_is_ignored(tmp_path, monkeypatch, cls, torn):
+    crash = crashed(cls, tmp_path, monkeypatch, 2 * GROUP, write_back=False)
+    payload = wal.ENTRY.pack(wal.PAGE, 0, 8) + b'\xff' * 8
+    frame = wal.FRAME.pack(wal.MAGIC, len(payload), wal.zlib.crc32(payload))
+    tail = {'header': frame[:7], 'payload': frame + payload[:5], 'checksum': frame[:-4] + b'\0\0\0\0' + payload}[torn]
+    with open(f'{crash}.wal', 'ab') as log:
+        log.write(tail)
+    with make(cls, crash) as file:
+        assert contents(file) == committed(2 * GROUP)
+    assert not os.path.exists(f'{crash}.wal')
+
+
+@pytest.mark.parametrize('cls', CLASSES)
+def test_killed_process_recovers_committed_groups(tmp_path, cls):
+    path = tmp_path / 'file.bin'
+    make(cls, path).init_file()
+    script = (
+        'import os, sys\n'
+        'from tests.test_wal import make, ' + cls.__name__ + '\n'
+        'file = make(' + cls.__name__ + ', sys.argv[1])\n'
+        'file.enable_wal(group_size=' + str(GROUP) + ')\n'
+        'for id in range(' + str(2 * GROUP + 3) + '):\n'
+        '    file.insert_record({"id": id, "number": id * 3, "string": "s"})\n'
+        'os._exit(3)\n'
+    )
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    assert subprocess.run([sys.executable, '-c', script, str(path)], cwd=root).returncode == 3
+    assert os.path.exists(f'{path}.wal')
+    with make(cls, path) as file:
+        assert contents(file) == committed(2 * GROUP + 3)